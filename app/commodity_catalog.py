@@ -0,0 +1,155 @@
+"""
+Commodity Catalog
+Canonical commodity IDs with an alias table (English spellings plus Hindi, Telugu and
+Punjabi names, romanized and in native script). Built once at startup into an exact
+alias map and a character-trigram inverted index, so scraped names, API filters and
+chatbot messages all resolve to the same ID in microseconds.
+"""
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+COMMODITY_CATALOG_PATH = os.getenv(
+    "COMMODITY_CATALOG_PATH", os.path.join(os.path.dirname(__file__), "data", "commodities.json")
+)
+
+# Minimum Dice similarity (shared trigrams) for a fuzzy match to count
+FUZZY_THRESHOLD = 0.5
+
+# Longest alias, in words, tried when scanning free text
+MAX_ALIAS_WORDS = 3
+
+_PARENTHESES = re.compile(r"\(([^)]*)\)")
+
+
+def normalize_name(name: str) -> str:
+    """Lookup key: NFKC, case-folded, punctuation stripped, whitespace collapsed"""
+    name = unicodedata.normalize("NFKC", name).casefold()
+    # Combining marks (Indic vowel signs, nukta, anusvara) belong to the word
+    cleaned = "".join(
+        ch if ch.isalnum() or unicodedata.category(ch)[0] == "M" else " " for ch in name
+    )
+    return " ".join(cleaned.split())
+
+
+def trigrams(key: str) -> set:
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CommodityCatalog:
+    def __init__(self, entries: List[dict]):
+        self.entries: Dict[str, dict] = {}
+        self._exact: Dict[str, str] = {}
+        self._alias_ids: List[str] = []
+        self._alias_sizes: List[int] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+        for entry in entries:
+            self.entries[entry["id"]] = entry
+            names = [entry["id"].replace("_", " "), entry["name"], *entry.get("aliases", [])]
+            # "Brinjal (Eggplant)" is also known as "Brinjal" and "Eggplant"
+            for inner in _PARENTHESES.findall(entry["name"]):
+                names.extend([_PARENTHESES.sub("", entry["name"]), inner])
+            for name in names:
+                self._add_alias(normalize_name(name), entry["id"])
+        self._postings = dict(self._postings)
+
+    @classmethod
+    def load(cls, path: str = COMMODITY_CATALOG_PATH) -> "CommodityCatalog":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _add_alias(self, key: str, commodity_id: str):
+        if not key or key in self._exact:
+            return
+        self._exact[key] = commodity_id
+        index = len(self._alias_ids)
+        self._alias_ids.append(commodity_id)
+        grams = trigrams(key)
+        self._alias_sizes.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(index)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def alias_count(self) -> int:
+        return len(self._alias_ids)
+
+    @property
+    def categories(self) -> List[str]:
+        return list(dict.fromkeys(entry["category"] for entry in self.entries.values()))
+
+    def get(self, commodity_id: str) -> Optional[dict]:
+        return self.entries.get(commodity_id)
+
+    def display_name(self, commodity_id: str) -> str:
+        entry = self.entries.get(commodity_id)
+        return entry["name"] if entry else commodity_id
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Canonical ID for a commodity name, alias or misspelling (None if nothing is close)"""
+        match = self.match(name)
+        return match[0] if match else None
+
+    def match(self, name: str) -> Optional[Tuple[str, float]]:
+        return self._match_key(normalize_name(name))
+
+    @lru_cache(maxsize=4096)
+    def _match_key(self, key: str) -> Optional[Tuple[str, float]]:
+        if not key:
+            return None
+        commodity_id = self._exact.get(key)
+        if commodity_id is not None:
+            return commodity_id, 1.0
+        return self._fuzzy(key)
+
+    def _fuzzy(self, key: str) -> Optional[Tuple[str, float]]:
+        grams = trigrams(key)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for index in self._postings.get(gram, ()):
+                shared[index] += 1
+        best_index, best_score = -1, 0.0
+        for index, count in shared.items():
+            score = 2.0 * count / (len(grams) + self._alias_sizes[index])
+            if score > best_score:
+                best_index, best_score = index, score
+        if best_score < FUZZY_THRESHOLD:
+            return None
+        return self._alias_ids[best_index], round(best_score, 3)
+
+    def find_in_text(self, text: str) -> List[str]:
+        """
+        Commodity IDs mentioned in free text, in order of appearance. Word n-grams are
+        matched exactly first (longest wins); single longer words then fall back to
+        fuzzy matching to tolerate misspellings.
+        """
+        words = normalize_name(text).split()
+        found: List[str] = []
+        i = 0
+        while i < len(words):
+            commodity_id, width = None, 1
+            for n in range(min(MAX_ALIAS_WORDS, len(words) - i), 0, -1):
+                commodity_id = self._exact.get(" ".join(words[i:i + n]))
+                if commodity_id is not None:
+                    width = n
+                    break
+            if commodity_id is None and len(words[i]) >= 5:
+                match = self._fuzzy(words[i])
+                # Stricter bar for single words inside a sentence
+                if match and match[1] >= 0.7:
+                    commodity_id = match[0]
+            if commodity_id is not None and commodity_id not in found:
+                found.append(commodity_id)
+            i += width
+        return found
+
+
+catalog = CommodityCatalog.load()
@@ -0,0 +1,193 @@
+"""
+Image Result Cache
+Caches image analysis results keyed by a hash of the image bytes and the model
+version, so resent photos (WhatsApp retries, double-clicked uploads) are answered
+without decoding. In-memory LRU with an optional on-disk tier, single-flight for
+concurrent identical uploads, and an optional perceptual-hash mode that also matches
+re-compressed or resized copies of a photo.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from app.image_executor import run_image_task
+from app.image_upload import open_working_image
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "512"))
+# Directory for the on-disk tier; empty disables it
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "")
+# Near-duplicate matching costs a small decode on every exact-hash miss
+IMAGE_CACHE_PERCEPTUAL = os.getenv("IMAGE_CACHE_PERCEPTUAL", "false").lower() == "true"
+# Max differing bits (of 64) for two perceptual hashes to count as the same photo
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "4"))
+
+HASH_SIZE = 8
+_DCT_SIZE = 32
+_k = np.arange(_DCT_SIZE)
+_DCT = np.cos(np.pi * (2 * _k[None, :] + 1) * _k[:, None] / (2 * _DCT_SIZE))
+
+
+def perceptual_hash(source: Union[bytes, str]) -> int:
+    """64-bit DCT hash of the image (robust to re-compression and resizing)"""
+    image = open_working_image(source, _DCT_SIZE * 4, mode="L")
+    pixels = np.asarray(image.resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BOX), dtype=np.float64)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only tracks overall brightness
+    bits = coefficients[1:] > np.median(coefficients[1:])
+    return int(np.packbits(np.append(bits, False)).view(">u8")[0])
+
+
+class ImageResultCache:
+    def __init__(self, namespace: str, model_version: str, max_entries: int = IMAGE_CACHE_SIZE,
+                 directory: str = IMAGE_CACHE_DIR, perceptual: bool = IMAGE_CACHE_PERCEPTUAL,
+                 max_distance: int = IMAGE_CACHE_MAX_DISTANCE):
+        self.namespace = namespace
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.directory = os.path.join(directory, namespace) if directory else None
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._phashes: Dict[str, int] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = self.near_hits = self.disk_hits = self.misses = 0
+
+    def key(self, content_hash: str) -> str:
+        """Cache key from the image's sha256 (hex) and the model version"""
+        return hashlib.sha256(f"{self.model_version}:{content_hash}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+            return result
+        result = self._read_disk(key)
+        if result is not None:
+            self.disk_hits += 1
+            self._remember(key, result)
+        return result
+
+    def lookup(self, content_hash: str) -> Optional[dict]:
+        """Cached result for the image with the given sha256, without computing on a miss"""
+        result = self.get(self.key(content_hash))
+        if result is not None:
+            self.hits += 1
+        return result
+
+    def store(self, content_hash: str, result: dict):
+        """Add a result computed outside get_or_compute (e.g. by a batch analysis)"""
+        key = self.key(content_hash)
+        self.misses += 1
+        self._remember(key, result)
+        self._write_disk(key, result)
+
+    def _remember(self, key: str, result: dict, phash: Optional[int] = None):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if phash is not None:
+            self._phashes[key] = phash
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._phashes.pop(evicted, None)
+
+    def _nearest(self, phash: int) -> Optional[str]:
+        if not self._phashes:
+            return None
+        keys = list(self._phashes)
+        hashes = np.fromiter(self._phashes.values(), dtype=np.uint64, count=len(keys))
+        distances = np.unpackbits((hashes ^ np.uint64(phash)).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        best = int(np.argmin(distances))
+        return keys[best] if distances[best] <= self.max_distance else None
+
+    async def get_or_compute(self, content_hash: str, source: Union[bytes, str],
+                             analyze: Callable[[Union[bytes, str]], Union[dict, Awaitable[dict]]]) -> dict:
+        """
+        Cached result for the image with the given sha256, running analyze(source) in
+        the image executor on a miss (source is the image bytes or a staged file path).
+        analyze may also be a coroutine function (e.g. MicroBatcher.submit), awaited as is.
+        Concurrent requests for the same image share one computation. The returned dict
+        is shared between requests and must not be modified.
+        """
+        key = self.key(content_hash)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result, phash = await self._compute(source, analyze)
+            self._remember(key, result, phash)
+            self._write_disk(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _compute(self, source: Union[bytes, str], analyze: Callable):
+        phash = None
+        if self.perceptual:
+            phash = await run_image_task(perceptual_hash, source)
+            near = self._nearest(phash)
+            if near is not None:
+                self.near_hits += 1
+                return self._entries[near], phash
+        self.misses += 1
+        if asyncio.iscoroutinefunction(analyze):
+            return await analyze(source), phash
+        return await run_image_task(analyze, source), phash
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[dict]:
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"Unreadable {self.namespace} cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, result: dict):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.error(f"Failed to write {self.namespace} cache entry {key}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_duplicate_hits": self.near_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
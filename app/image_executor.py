@@ -0,0 +1,233 @@
+"""
+Image Processing Executor
+Shared process pool for CPU-bound image work (soil analysis, pest detection) so
+decoding and inference never run on the event loop. Workers are spawned and warmed
+at startup with the models loaded once per process; submissions are bounded (callers
+get ImageQueueFull instead of piling up) and each task has a timeout. MicroBatcher
+gathers concurrent single-image calls into one batched task for models that infer
+faster in batches.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+
+# Worker processes; 0 runs tasks in a thread instead (development/tests)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+# Tasks running or waiting across all workers before new ones are rejected
+IMAGE_QUEUE_LIMIT = int(os.getenv("IMAGE_QUEUE_LIMIT", str(max(32, IMAGE_WORKERS * 8))))
+IMAGE_TASK_TIMEOUT = float(os.getenv("IMAGE_TASK_TIMEOUT_SECONDS", "30"))
+
+
+class ImageQueueFull(Exception):
+    pass
+
+
+def warm_worker():
+    """Process initializer: import the models and run each once on a tiny image"""
+    from app import pest_vision, soil_vision
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), (120, 90, 60)).save(buffer, format="JPEG")
+    soil_vision.analyze_soil_image(buffer.getvalue())
+    pest_vision.detect_pests(buffer.getvalue())
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class ImageExecutor:
+    def __init__(self, workers: int = IMAGE_WORKERS, queue_limit: int = IMAGE_QUEUE_LIMIT,
+                 timeout: float = IMAGE_TASK_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Spawn and warm all workers now rather than on the first upload"""
+        if self.workers <= 0 or self._pool is not None:
+            return
+        # spawn, not fork: the parent has running threads (event loop, MQTT, SQLite)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_worker,
+        )
+        for _ in range(self.workers):
+            self._pool.submit(_ping)
+        logging.info(f"Image executor started with {self.workers} workers")
+
+    async def stop(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+        if self._threads is not None:
+            threads, self._threads = self._threads, None
+            await asyncio.to_thread(threads.shutdown, wait=True, cancel_futures=True)
+
+    def _executor(self) -> Executor:
+        if self.workers <= 0:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(thread_name_prefix="image")
+            return self._threads
+        self.start()
+        return self._pool
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """
+        Run fn(*args) in a worker. Raises ImageQueueFull when too many tasks are in
+        flight and asyncio.TimeoutError when the result takes longer than the timeout.
+        A timed-out task that already started finishes in the background (its result
+        is discarded) and keeps counting towards the queue limit until it does.
+        """
+        if self.pending >= self.queue_limit:
+            raise ImageQueueFull(f"{self.pending} image tasks already in progress")
+        loop = asyncio.get_running_loop()
+        executor = self._executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        self.pending += 1
+        # Released when the worker is done, not when the caller stops waiting
+        future.add_done_callback(lambda _: self._release(loop))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        # Done-callbacks run on the executor's thread (or the caller's, on cancel)
+        try:
+            loop.call_soon_threadsafe(self._decrement)
+        except RuntimeError:  # loop already closed at shutdown
+            self._decrement()
+
+    def _decrement(self):
+        self.pending -= 1
+
+    def _restart(self, broken: Executor):
+        """A worker died (e.g. OOM-killed): drop the pool, start a fresh one on the next call"""
+        if broken is not self._pool:
+            return  # another caller already replaced it
+        logging.error("Image executor pool broke; restarting workers")
+        self._pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending, "queue_limit": self.queue_limit}
+
+
+image_executor = ImageExecutor()
+
+
+def image_http_error(e: BaseException) -> Optional[HTTPException]:
+    """The HTTP error for an image task failure, or None if it isn't an expected one"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ImageQueueFull):
+        return HTTPException(status_code=503, detail="Image analysis is busy, please retry shortly",
+                             headers={"Retry-After": "5"})
+    if isinstance(e, BrokenProcessPool):
+        return HTTPException(status_code=503, detail="Image analysis is restarting, please retry",
+                             headers={"Retry-After": "5"})
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(status_code=504, detail="Image analysis timed out")
+    if isinstance(e, Image.DecompressionBombError):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, OSError):  # PIL.UnidentifiedImageError or a truncated file
+        return HTTPException(status_code=400, detail=f"Could not read image: {e}")
+    return None
+
+
+async def run_image_task(fn: Callable, *args):
+    """image_executor.run for request handlers, with failures mapped to HTTP errors"""
+    try:
+        return await image_executor.run(fn, *args)
+    except Exception as e:
+        error = image_http_error(e)
+        if error is None:
+            raise
+        raise error
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent single-item calls into one batched image task. A batch is sent
+    to the executor as soon as max_batch items are waiting, or max_wait seconds after
+    the first of them arrived, so a lone request waits at most max_wait. batch_fn takes
+    a list of items and returns one result per item, or an exception instance for an
+    item that failed on its own.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch: int, max_wait: float):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._waiting: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Task] = set()
+        self.batches = self.items = 0
+
+    async def submit(self, item):
+        """Result of batch_fn for this item; failures raise the mapped HTTPException"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((item, future))
+        if len(self._waiting) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._waiting = self._waiting, []
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await run_image_task(self.batch_fn, [item for item, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():  # the caller went away
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(image_http_error(result) or result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "waiting": len(self._waiting),
+            "batches": self.batches,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
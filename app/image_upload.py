@@ -0,0 +1,233 @@
+"""
+Image Upload Pipeline
+Shared handling of uploaded photos for the soil and pest endpoints:
+
+- UploadSizeLimitMiddleware rejects oversized request bodies with 413, from the
+  Content-Length header up front or while the body streams in.
+- stage_upload() copies the (already spooled) upload in fixed-size chunks to a temp
+  file while hashing it, so the request never holds the whole photo in memory.
+- open_working_image() runs in the image workers and decodes straight to the working
+  resolution (JPEG draft mode, then integer reduce, then mode conversion) from the
+  staged file.
+- extract_zip_images() stages the photos inside a zip (batch survey uploads) the
+  same way, with the per-image cap enforced on the decompressed bytes.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from typing import Dict, List, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 256 * 1024
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None
+
+# Batch (field survey) uploads: whole request body and number of photos
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(400 * 1024 * 1024)))
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "200"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".heic")
+
+# Larger images are refused before decoding (decompression bombs)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "60000000"))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Room for multipart boundaries and the other form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Upload endpoints and their body size limits
+UPLOAD_LIMITS = {
+    "/api/soil/analyze": MAX_UPLOAD_BYTES,
+    "/api/pest/detect": MAX_UPLOAD_BYTES,
+    "/api/soil/analyze/batch": MAX_BATCH_UPLOAD_BYTES,
+}
+
+
+class StagedUpload:
+    """An upload copied to a temp file; the file is removed when the context exits"""
+
+    def __init__(self, path: str, size: int, sha256: str, filename: Optional[str]):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+
+    async def __aenter__(self) -> "StagedUpload":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.discard()
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def stage_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                       directory: Optional[str] = UPLOAD_TMP_DIR) -> StagedUpload:
+    """Copy an upload to a temp file chunk by chunk, hashing it and enforcing the size cap"""
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty upload")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return StagedUpload(path, size, digest.hexdigest(), file.filename)
+
+
+def extract_zip_images(archive: str, directory: str, max_images: int = MAX_BATCH_IMAGES,
+                       max_bytes: int = MAX_UPLOAD_BYTES) -> List[StagedUpload]:
+    """
+    Stage the image members of a zip file into directory (blocking; run it in a
+    thread). Other members are ignored. Sizes are counted while decompressing, since
+    the sizes a zip declares can't be trusted.
+    """
+    staged: List[StagedUpload] = []
+    try:
+        with zipfile.ZipFile(archive) as bundle:
+            for member in bundle.infolist():
+                name = os.path.basename(member.filename)
+                if member.is_dir() or name.startswith(".") or "__MACOSX/" in member.filename:
+                    continue
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if len(staged) >= max_images:
+                    raise HTTPException(status_code=413, detail=f"More than {max_images} images in one batch")
+                if member.file_size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{name} is larger than {max_bytes // (1024 * 1024)} MB")
+
+                digest = hashlib.sha256()
+                size = 0
+                fd, path = tempfile.mkstemp(prefix="upload-", dir=directory)
+                with os.fdopen(fd, "wb") as out, bundle.open(member) as source:
+                    while True:
+                        chunk = source.read(UPLOAD_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise HTTPException(status_code=413,
+                                                detail=f"{name} is larger than {max_bytes // (1024 * 1024)} MB")
+                        digest.update(chunk)
+                        out.write(chunk)
+                if size:
+                    staged.append(StagedUpload(path, size, digest.hexdigest(), member.filename))
+                else:
+                    os.unlink(path)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read zip archive: {e}")
+    return staged
+
+
+# Modes Image.reduce() accepts; the others (palette, 1-bit, 16-bit) are shrunk by
+# sampling, which keeps palette indices valid
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F")
+
+
+def open_working_image(source: Union[bytes, str], size: int, mode: str = "RGB") -> Image.Image:
+    """
+    Decode an image (bytes or file path) to at most size x size. JPEGs are decoded
+    at 1/2..1/8 scale directly; other formats are integer-reduced in their own mode
+    and only the small result is converted, so no full-resolution copy is kept
+    beyond the decoder's own. Images over MAX_IMAGE_PIXELS are refused before decoding.
+    """
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    # Pillow only raises above twice its limit (and warns in between)
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise Image.DecompressionBombError(
+            f"Image size ({image.width * image.height} pixels) exceeds limit of {MAX_IMAGE_PIXELS} pixels"
+        )
+    image.draft(mode, (size, size))
+    factor = min(image.width, image.height) // (size * 2)
+    if factor > 1:
+        if image.mode in REDUCIBLE_MODES:
+            image = image.reduce(factor)
+        else:
+            image = image.resize((image.width // factor, image.height // factor), Image.Resampling.NEAREST)
+    image = image.convert(mode)
+    image.thumbnail((size, size), Image.Resampling.BILINEAR)
+    return image
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping request bodies on the upload endpoints. Requests that
+    declare a larger Content-Length get 413 before any of the body is read; bodies
+    without one (chunked) are counted as they stream and cut off at the limit.
+    """
+
+    def __init__(self, app, limits: Dict[str, int] = UPLOAD_LIMITS):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        limit += MULTIPART_OVERHEAD_BYTES
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return await self._reject(send, limit)
+
+        received = 0
+        exceeded = False
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise HTTPException(status_code=413)
+            return message
+
+        async def guarded_send(message):
+            # Once over the limit, whatever the app answers is replaced by a 413
+            nonlocal responded
+            if not exceeded:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                await self._reject(send, limit)
+            responded = True
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except HTTPException:
+            if not exceeded:
+                raise
+            if not responded:
+                await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": f"Upload larger than {limit // (1024 * 1024)} MB"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
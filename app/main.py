@@ -8,16 +8,44 @@ from typing import Optional, List, Dict, Any
 import uvicorn
 import os
 import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+from app.image_executor import image_executor
+from app.image_upload import UploadSizeLimitMiddleware
+from app.message_dedup import seen_messages
+from app.whatsapp_client import whatsapp_client
+from app.whatsapp_outbox import outbox
 from app.routers import weather, pest_detection, soil_advisory, market_prices, dealer_network, farming_tools, whatsapp_webhook, voice_chat, mqtt_control
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background services shared across requests"""
+    image_executor.start()
+    await whatsapp_client.start()
+    await whatsapp_webhook.pipeline.start()
+    await outbox.start()
+    await mqtt_control.scheduler.start()
+    await market_prices.refresher.start()
+    await market_prices.forecaster.start(market_prices.get_price_series, list(market_prices.MOCK_DATA))
+    yield
+    await market_prices.forecaster.stop()
+    await market_prices.refresher.stop()
+    await market_prices.scraper_pool.stop()
+    await mqtt_control.scheduler.stop()
+    await whatsapp_webhook.pipeline.stop()
+    await outbox.stop()
+    await seen_messages.close()
+    await whatsapp_client.stop()
+    await image_executor.stop()
+
 app = FastAPI(
     title="Smart AgriTech API",
     description="AI-Powered Agricultural Advisory Platform",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Custom CORS middleware to ensure headers are always present
@@ -68,6 +96,9 @@ app.add_middleware(
 # Add custom CORS middleware as backup to ensure headers are always present
 app.add_middleware(CustomCORSMiddleware)
 
+# Reject oversized photo uploads before they are parsed
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Include routers
 app.include_router(weather.router, prefix="/api/weather", tags=["weather"])
 app.include_router(pest_detection.router, prefix="/api/pest", tags=["pest-detection"])
@@ -98,7 +129,16 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "All services operational"}
+    return {
+        "status": "healthy",
+        "message": "All services operational",
+        "image_executor": image_executor.stats(),
+        "pest_batching": pest_detection.detector.stats(),
+        "whatsapp": whatsapp_client.stats(),
+        "whatsapp_pipeline": whatsapp_webhook.pipeline.stats(),
+        "whatsapp_dedup": seen_messages.stats(),
+        "whatsapp_outbox": outbox.stats()
+    }
 
 @app.get("/api/test-cors")
 async def test_cors():
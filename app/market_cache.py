@@ -0,0 +1,126 @@
+"""
+Market Data Cache
+Stale-while-revalidate cache for scraped market prices, keyed by (source, location).
+Fresh entries are served from memory, stale entries are served immediately while a
+single background refresh runs, and failed refreshes keep the last good result.
+A key that has never loaded remembers its failure for a retry interval, so requests
+fail fast (and the caller serves a fallback) instead of each waiting out the fetch.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+# Seconds a scrape is considered fresh
+MARKET_CACHE_TTL = float(os.getenv("MARKET_CACHE_TTL_SECONDS", "900"))
+
+# Seconds to wait before retrying a key whose last refresh failed
+MARKET_CACHE_RETRY_AFTER = float(os.getenv("MARKET_CACHE_RETRY_AFTER_SECONDS", "60"))
+
+
+class CacheUnavailable(Exception):
+    """Nothing cached for a key and its last load failed; a retry is pending or running"""
+
+
+class CacheEntry:
+    __slots__ = ("value", "fetched_at", "expires_at", "retry_at", "last_error")
+
+    def __init__(self, value: Any, ttl: float):
+        now = time.monotonic()
+        self.value = value
+        self.fetched_at = time.time()
+        self.expires_at = now + ttl
+        self.retry_at = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+class StaleWhileRevalidateCache:
+    """Async SWR cache with single-flight loading per key"""
+
+    def __init__(self, ttl: float = MARKET_CACHE_TTL, retry_after: float = MARKET_CACHE_RETRY_AFTER):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._entries: Dict[Hashable, CacheEntry] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # Keys that have never loaded: (monotonic time of the next attempt, last error)
+        self._failures: Dict[Hashable, tuple] = {}
+
+    def peek(self, key: Hashable) -> Optional[CacheEntry]:
+        """Return the cached entry (fresh or stale) without triggering a load"""
+        return self._entries.get(key)
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> CacheEntry:
+        """
+        Return the entry for key.
+
+        - miss: wait for the (shared) load; raises if it fails
+        - miss after a failed load: raises CacheUnavailable at once, starting one
+          background retry once the retry interval has passed
+        - fresh: returned from memory
+        - stale: returned from memory, one background refresh is started
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            failure = self._failures.get(key)
+            if failure is None:
+                return await asyncio.shield(self._load(key, loader))
+            retry_at, error = failure
+            if time.monotonic() >= retry_at:
+                self._load(key, loader)
+            raise CacheUnavailable(error)
+
+        if entry.stale and time.monotonic() >= entry.retry_at:
+            self._load(key, loader)
+        return entry
+
+    async def refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> CacheEntry:
+        """
+        Reload key now, joining a load already in flight rather than starting a second one.
+        Returns the previous entry unchanged if the load failed and one exists.
+        """
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start (or join) the single in-flight load for key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key, loader))
+            # Background retries have no awaiter; mark their failure as handled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> CacheEntry:
+        try:
+            value = await loader()
+            entry = CacheEntry(value, self.ttl)
+            self._entries[key] = entry
+            self._failures.pop(key, None)
+            return entry
+        except Exception as e:
+            previous = self._entries.get(key)
+            if previous is None:
+                self._failures[key] = (time.monotonic() + self.retry_after, str(e))
+                raise
+            # Keep serving the last good result, back off before the next attempt
+            logging.error(f"Refresh failed for {key}, serving last good data: {e}")
+            previous.retry_at = time.monotonic() + self.retry_after
+            previous.last_error = str(e)
+            return previous
+        finally:
+            self._inflight.pop(key, None)
+
+    def set(self, key: Hashable, value: Any) -> CacheEntry:
+        """Store a value fetched elsewhere (e.g. by a background refresher)"""
+        entry = CacheEntry(value, self.ttl)
+        self._entries[key] = entry
+        self._failures.pop(key, None)
+        return entry
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
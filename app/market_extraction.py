@@ -0,0 +1,135 @@
+"""
+Market Price Extraction
+Compiled, per-site selector specs for pulling price rows out of scraped HTML.
+Uses lxml (compiled XPath over a C parser) when installed and falls back to
+BeautifulSoup restricted by a SoupStrainer to the price table only.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:  # pragma: no cover - optional fast path
+    HAS_LXML = False
+
+PRICE_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+UNIT_RES = (
+    ("kg", re.compile(r"\bkgs?\b|kilo", re.I)),
+    ("ton", re.compile(r"\btons?\b|\btonnes?\b", re.I)),
+    ("quintal", re.compile(r"quintal|\bqtl\b", re.I)),
+)
+
+_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_LOWER = "abcdefghijklmnopqrstuvwxyz"
+
+
+def parse_price_cell(text: str, default_unit: str = "quintal") -> Optional[Tuple[float, str]]:
+    """Parse "₹ 2,800 / Quintal" into (2800.0, "quintal"); None when no number is present"""
+    match = PRICE_RE.search(text)
+    if match is None:
+        return None
+    price = float(match.group().replace(",", ""))
+    for unit, pattern in UNIT_RES:
+        if pattern.search(text):
+            return price, unit
+    return price, default_unit
+
+
+class SiteSpec:
+    """
+    Selector spec for one source site, compiled once at import time.
+
+    table_classes: class substrings identifying the price table (case-insensitive)
+    commodity_col / price_col / unit_col: cell indexes within a row
+    """
+
+    def __init__(self, name: str, table_classes: Tuple[str, ...], commodity_col: int = 0,
+                 price_col: int = 1, unit_col: Optional[int] = None,
+                 default_unit: str = "quintal", max_rows: Optional[int] = None):
+        self.name = name
+        self.table_classes = table_classes
+        self.commodity_col = commodity_col
+        self.price_col = price_col
+        self.unit_col = unit_col
+        self.default_unit = default_unit
+        self.max_rows = max_rows
+        self._min_cells = max(c for c in (commodity_col, price_col, unit_col) if c is not None) + 1
+
+        # First table whose class matches any token; rows only from that table
+        class_test = " or ".join(
+            f"contains(translate(@class, '{_UPPER}', '{_LOWER}'), '{token.lower()}')"
+            for token in table_classes
+        )
+        self._table_class_re = re.compile("|".join(map(re.escape, table_classes)), re.I)
+        self.strainer = SoupStrainer("table", class_=self._table_class_re)
+        if HAS_LXML:
+            self.row_xpath = etree.XPath(f"(//table[{class_test}][.//td])[1]//tr")
+            self.cell_xpath = etree.XPath("./td")
+
+    def row_to_price(self, cells: List[str]) -> Optional[dict]:
+        if len(cells) < self._min_cells:
+            return None
+        commodity = cells[self.commodity_col]
+        price_text = cells[self.price_col]
+        if self.unit_col is not None:
+            price_text = f"{price_text} {cells[self.unit_col]}"
+        parsed = parse_price_cell(price_text, self.default_unit)
+        if not commodity or parsed is None:
+            return None
+        price, unit = parsed
+        return {"commodity": commodity, "price": price, "unit": unit}
+
+
+def _extract_lxml(content: bytes, spec: SiteSpec) -> List[dict]:
+    doc = lxml.html.fromstring(content)
+    prices = []
+    for row in spec.row_xpath(doc):
+        item = spec.row_to_price([cell.text_content().strip() for cell in spec.cell_xpath(row)])
+        if item is not None:
+            prices.append(item)
+            if spec.max_rows and len(prices) >= spec.max_rows:
+                break
+    return prices
+
+
+def _extract_soup(content: bytes, spec: SiteSpec) -> List[dict]:
+    soup = BeautifulSoup(content, "html.parser", parse_only=spec.strainer)
+    prices = []
+    for table in soup.find_all("table"):
+        for row in table.find_all("tr"):
+            cells = [cell.get_text(strip=True) for cell in row.find_all("td", recursive=False)]
+            item = spec.row_to_price(cells)
+            if item is not None:
+                prices.append(item)
+                if spec.max_rows and len(prices) >= spec.max_rows:
+                    return prices
+        if prices:
+            break
+    return prices
+
+
+EXTRACTORS = {"soup": _extract_soup}
+if HAS_LXML:
+    EXTRACTORS["lxml"] = _extract_lxml
+
+DEFAULT_BACKEND = "lxml" if HAS_LXML else "soup"
+
+
+def extract_prices(content: bytes, spec: SiteSpec, backend: Optional[str] = None) -> List[dict]:
+    """Extract [{"commodity", "price", "unit"}] rows from a page using the site's spec"""
+    return EXTRACTORS[backend or DEFAULT_BACKEND](content, spec)
+
+
+# Selector specs per source site
+SITE_SPECS = {
+    "todaypricerates": SiteSpec(
+        name="todaypricerates",
+        table_classes=("price", "market", "vegetable"),
+        commodity_col=0,
+        price_col=1,
+    ),
+}
@@ -0,0 +1,85 @@
+"""
+Market Data Refresher
+Background task that re-scrapes every registered market source on a jittered
+schedule and pushes the results into the price cache.
+"""
+import asyncio
+import logging
+import os
+import random
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.market_cache import StaleWhileRevalidateCache
+
+MARKET_REFRESH_INTERVAL = float(os.getenv("MARKET_REFRESH_INTERVAL_SECONDS", "1800"))
+
+# +/- fraction of the interval added to each sleep so refreshes don't align across instances
+MARKET_REFRESH_JITTER = float(os.getenv("MARKET_REFRESH_JITTER", "0.1"))
+
+# Upper bound for one refresh cycle across all sources; unfinished jobs are cancelled
+MARKET_REFRESH_CYCLE_TIMEOUT = float(os.getenv("MARKET_REFRESH_CYCLE_TIMEOUT_SECONDS", "60"))
+
+
+class MarketRefresher:
+    """Runs registered refresh jobs every interval (with jitter)"""
+
+    def __init__(self, cache: StaleWhileRevalidateCache,
+                 interval: float = MARKET_REFRESH_INTERVAL, jitter: float = MARKET_REFRESH_JITTER,
+                 cycle_timeout: float = MARKET_REFRESH_CYCLE_TIMEOUT):
+        self.cache = cache
+        self.interval = interval
+        self.jitter = jitter
+        self.cycle_timeout = cycle_timeout
+        self.jobs: Dict[Hashable, Callable[[], Awaitable[Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        self.jobs[key] = loader
+
+    async def start(self):
+        if self._task is None and self.jobs:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def refresh_all(self) -> Dict[Hashable, bool]:
+        """
+        Refresh every job concurrently within one bounded cycle.
+        A failing or slow job never blocks the others; returns success per key.
+        """
+        if not self.jobs:
+            return {}
+        tasks = {asyncio.create_task(self._refresh(key, loader)): key for key, loader in self.jobs.items()}
+        done, pending = await asyncio.wait(tasks, timeout=self.cycle_timeout)
+        for task in pending:
+            task.cancel()
+            logging.error(f"Scheduled market refresh timed out for {tasks[task]}")
+        return {tasks[task]: task in done and task.result() for task in tasks}
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> bool:
+        # Through the cache's load path, so a stale-triggered load of the same key is joined
+        previous = self.cache.peek(key)
+        try:
+            return await self.cache.refresh(key, loader) is not previous
+        except Exception as e:
+            logging.error(f"Scheduled market refresh failed for {key}: {e}")
+            return False
+
+    def _next_delay(self) -> float:
+        spread = self.interval * self.jitter
+        return max(1.0, self.interval + random.uniform(-spread, spread))
+
+    async def _run(self):
+        # Small random initial delay so restarts of several workers don't scrape at once
+        await asyncio.sleep(random.uniform(0, self.interval * self.jitter))
+        while True:
+            await self.refresh_all()
+            await asyncio.sleep(self._next_delay())
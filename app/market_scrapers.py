@@ -0,0 +1,154 @@
+"""
+Market Scrapers
+Multi-state price scraping over one shared pooled HTTP client, with a per-host
+concurrency limit and retry with exponential backoff. Each location lists the sources
+tried in order; today every state has a single source (todaypricerates), so a refresh
+cycle fans out across locations, not across sites.
+Set MARKET_FIXTURES_DIR to serve the fixture pages (fixtures/market/) instead of the
+network. Those pages are synthetic (see fixtures/market/README.md), not captures.
+"""
+import asyncio
+import os
+import random
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from app.market_extraction import SITE_SPECS, SiteSpec, extract_prices
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 in httpx
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+MARKET_PER_HOST_LIMIT = int(os.getenv("MARKET_PER_HOST_LIMIT", "4"))
+MARKET_FETCH_RETRIES = int(os.getenv("MARKET_FETCH_RETRIES", "3"))
+MARKET_FETCH_BACKOFF = float(os.getenv("MARKET_FETCH_BACKOFF_SECONDS", "0.5"))
+MARKET_FETCH_TIMEOUT = float(os.getenv("MARKET_FETCH_TIMEOUT_SECONDS", "10"))
+MARKET_FIXTURES_DIR = os.getenv("MARKET_FIXTURES_DIR")
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class MarketSource:
+    """A price website: URL pattern per location plus the selector spec for its pages"""
+
+    def __init__(self, name: str, url_template: str, spec: SiteSpec):
+        self.name = name
+        self.url_template = url_template
+        self.spec = spec
+
+    def url_for(self, location: str) -> str:
+        return self.url_template.format(slug=location.replace(" ", "-"))
+
+
+SOURCES = {
+    "todaypricerates": MarketSource(
+        name="todaypricerates",
+        url_template="https://market.todaypricerates.com/{slug}-vegetables-price",
+        spec=SITE_SPECS["todaypricerates"],
+    ),
+}
+
+# Sources tried in order for each location
+LOCATION_SOURCES = {
+    "Punjab": ["todaypricerates"],
+    "Haryana": ["todaypricerates"],
+    "Uttar Pradesh": ["todaypricerates"],
+    "Maharashtra": ["todaypricerates"],
+    "Karnataka": ["todaypricerates"],
+}
+
+
+def fixture_transport(fixtures_dir: str) -> httpx.MockTransport:
+    """Serve <fixtures_dir>/<last path segment>.html for every request"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        name = request.url.path.rstrip("/").rsplit("/", 1)[-1] + ".html"
+        path = os.path.join(fixtures_dir, name)
+        if not os.path.exists(path):
+            return httpx.Response(404, request=request)
+        with open(path, "rb") as f:
+            return httpx.Response(200, content=f.read(), request=request)
+    return httpx.MockTransport(handler)
+
+
+class ScraperPool:
+    """Shared HTTP client plus per-host semaphores used by every market scrape"""
+
+    def __init__(self, per_host_limit: int = MARKET_PER_HOST_LIMIT, retries: int = MARKET_FETCH_RETRIES,
+                 backoff: float = MARKET_FETCH_BACKOFF, timeout: float = MARKET_FETCH_TIMEOUT,
+                 fixtures_dir: Optional[str] = MARKET_FIXTURES_DIR):
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.fixtures_dir = fixtures_dir
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HAS_HTTP2 and not self.fixtures_dir,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+                headers={"User-Agent": USER_AGENT},
+                follow_redirects=True,
+                transport=fixture_transport(self.fixtures_dir) if self.fixtures_dir else None,
+            )
+        return self._client
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), 30.0)
+        return self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+
+    async def fetch(self, url: str) -> bytes:
+        """GET url with per-host concurrency limit; retries transport errors, 429 and 5xx"""
+        limit = self._host_limit(url)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                async with limit:
+                    response = await self.client.get(url)
+                if response.status_code == 200:
+                    return response.content
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = str(e) or e.__class__.__name__
+            if attempt == self.retries:
+                raise RuntimeError(f"Failed to fetch {url} after {attempt + 1} attempts: {error}")
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def scrape(self, location: str) -> tuple:
+        """Return (source name, prices) from the first source that yields rows"""
+        errors = []
+        for source_name in LOCATION_SOURCES.get(location, []):
+            source = SOURCES[source_name]
+            try:
+                content = await self.fetch(source.url_for(location))
+                prices = extract_prices(content, source.spec)
+                if prices:
+                    return source_name, prices
+                errors.append(f"{source_name}: no price rows")
+            except Exception as e:
+                errors.append(f"{source_name}: {e}")
+        raise ValueError(f"No market data for {location} ({'; '.join(errors) or 'no sources'})")
@@ -0,0 +1,131 @@
+"""
+WhatsApp Message Deduplication
+Meta redelivers webhooks it thinks we missed (timeouts, 5xx, network blips), so the
+same message ID can arrive several times. The webhook claims each message ID here
+before queueing it and drops the ones already claimed. IDs are remembered for a
+bounded time and, in the local store, up to a fixed number of IDs.
+
+The local store is per process. With several server processes, set
+WHATSAPP_DEDUP_REDIS_URL so they share one set of claims in Redis (needs the redis
+package).
+"""
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+try:
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+# Meta keeps retrying a failed delivery for hours, with growing gaps
+WHATSAPP_DEDUP_TTL = float(os.getenv("WHATSAPP_DEDUP_TTL_SECONDS", str(24 * 3600)))
+WHATSAPP_DEDUP_MAX_IDS = int(os.getenv("WHATSAPP_DEDUP_MAX_IDS", "100000"))
+WHATSAPP_DEDUP_REDIS_URL = os.getenv("WHATSAPP_DEDUP_REDIS_URL")
+
+
+class SeenStore(ABC):
+    """Remembers claimed message IDs; subclasses decide where"""
+
+    def __init__(self, ttl: float = WHATSAPP_DEDUP_TTL):
+        self.ttl = ttl
+        self.claimed = self.duplicates = 0
+
+    async def claim(self, message_ids: List[str]) -> List[bool]:
+        """
+        Claim each ID; True where it had not been seen within the TTL (the caller
+        processes it), False for duplicates. An ID repeated in the list is claimed once.
+        """
+        fresh = await self._claim(message_ids)
+        self.claimed += sum(fresh)
+        self.duplicates += len(fresh) - sum(fresh)
+        return fresh
+
+    @abstractmethod
+    async def release(self, message_ids: List[str]):
+        """Forget claims for messages that were not processed after all, so a redelivery is"""
+
+    @abstractmethod
+    async def _claim(self, message_ids: List[str]) -> List[bool]:
+        """Claim IDs in the backing store; True per ID that was not already claimed"""
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"store": self.__class__.__name__, "claimed": self.claimed, "duplicates": self.duplicates}
+
+
+class LocalSeenStore(SeenStore):
+    """In-process stand-in: IDs in arrival order, dropped when expired or over max_ids"""
+
+    def __init__(self, ttl: float = WHATSAPP_DEDUP_TTL, max_ids: int = WHATSAPP_DEDUP_MAX_IDS):
+        super().__init__(ttl)
+        self.max_ids = max_ids
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def _expire(self, now: float):
+        # Every ID gets the same TTL, so the oldest claims expire first
+        while self._seen:
+            message_id, expires = next(iter(self._seen.items()))
+            if expires > now:
+                break
+            del self._seen[message_id]
+
+    async def _claim(self, message_ids: List[str]) -> List[bool]:
+        now = time.monotonic()
+        self._expire(now)
+        fresh = []
+        for message_id in message_ids:
+            if message_id in self._seen:
+                fresh.append(False)
+                continue
+            self._seen[message_id] = now + self.ttl
+            if len(self._seen) > self.max_ids:
+                self._seen.popitem(last=False)
+            fresh.append(True)
+        return fresh
+
+    async def release(self, message_ids: List[str]):
+        for message_id in message_ids:
+            self._seen.pop(message_id, None)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "remembered": len(self._seen), "max_ids": self.max_ids}
+
+
+class RedisSeenStore(SeenStore):
+    """Claims shared by every server process: SET NX with an expiry, one round trip per batch"""
+
+    def __init__(self, url: str, ttl: float = WHATSAPP_DEDUP_TTL, prefix: str = "wa:seen:"):
+        super().__init__(ttl)
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url)
+
+    async def _claim(self, message_ids: List[str]) -> List[bool]:
+        pipe = self._redis.pipeline(transaction=False)
+        for message_id in message_ids:
+            pipe.set(self.prefix + message_id, 1, nx=True, ex=int(self.ttl))
+        return [bool(result) for result in await pipe.execute()]
+
+    async def release(self, message_ids: List[str]):
+        if message_ids:
+            await self._redis.delete(*(self.prefix + message_id for message_id in message_ids))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_seen_store(redis_url: Optional[str] = WHATSAPP_DEDUP_REDIS_URL) -> SeenStore:
+    if redis_url:
+        if HAS_REDIS:
+            return RedisSeenStore(redis_url)
+        logging.warning("WHATSAPP_DEDUP_REDIS_URL is set but redis is not installed; deduplicating per process")
+    return LocalSeenStore()
+
+
+seen_messages = create_seen_store()
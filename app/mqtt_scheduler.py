@@ -0,0 +1,455 @@
+"""
+MQTT Command Scheduler
+Debounces relay commands per device, enforces minimum on/off durations and
+fires scheduled/recurring commands (e.g. irrigate 06:00-06:20) from one timer heap.
+Publishing runs in a worker thread so a slow broker never blocks the event loop;
+a background publish that fails stays pending and is retried.
+
+Schedules and device state live in this process. Run the API with a single worker
+process (uvicorn's default): every worker would load the schedule file and fire
+each schedule once per worker.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+# Relays that can be driven through krishimithr/device/cmd
+DEVICES = ["motor", "hv", "hv_auto"]
+
+# Identical commands for a device inside this window are collapsed into one publish
+DEBOUNCE_SECONDS = float(os.getenv("MQTT_DEBOUNCE_SECONDS", "2"))
+
+# Minimum time (seconds) a relay must stay on / off before it may be toggled again
+MIN_DURATIONS = {
+    "motor": (
+        float(os.getenv("MQTT_MOTOR_MIN_ON_SECONDS", "60")),
+        float(os.getenv("MQTT_MOTOR_MIN_OFF_SECONDS", "60")),
+    ),
+    "hv": (
+        float(os.getenv("MQTT_HV_MIN_ON_SECONDS", "10")),
+        float(os.getenv("MQTT_HV_MIN_OFF_SECONDS", "10")),
+    ),
+    "hv_auto": (0.0, 0.0),
+}
+
+SCHEDULE_FILE = os.getenv("MQTT_SCHEDULE_FILE", "data/mqtt_schedules.json")
+SCHEDULE_TIMEZONE = os.getenv("MQTT_SCHEDULE_TZ", "Asia/Kolkata")
+
+# A deferred or scheduled command whose publish failed is retried after this delay
+PUBLISH_RETRY_SECONDS = float(os.getenv("MQTT_PUBLISH_RETRY_SECONDS", "30"))
+
+# Writes are coalesced so bulk schedule changes rewrite the file once
+SAVE_DELAY_SECONDS = 1.0
+
+
+def parse_command(command: str) -> tuple:
+    """Split "motor:on" into ("motor", "on"), validating device and action"""
+    device, _, action = command.partition(":")
+    if device not in DEVICES or action not in ("on", "off"):
+        raise ValueError(f"Invalid command: {command}")
+    return device, action
+
+
+def parse_clock(value: str) -> tuple:
+    """Parse "HH:MM" into (hour, minute)"""
+    hour, _, minute = value.partition(":")
+    hour, minute = int(hour), int(minute or 0)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time of day: {value}")
+    return hour, minute
+
+
+class _Timer:
+    """Heap entry; cancelled timers are skipped when they reach the top"""
+    __slots__ = ("fire_at", "callback", "cancelled")
+
+    def __init__(self, fire_at: float, callback: Callable[[], None]):
+        self.fire_at = fire_at
+        self.callback = callback
+        self.cancelled = False
+
+
+class _DeviceState:
+    __slots__ = ("state", "last_change", "last_sent", "last_command", "pending", "error", "lock")
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.last_change = 0.0
+        self.last_sent = 0.0
+        self.last_command: Optional[str] = None
+        self.pending: Optional[tuple] = None  # (command, _Timer)
+        self.error: Optional[str] = None  # last failed publish, cleared by the next success
+        # Held from deciding on a command until its publish finishes
+        self.lock = asyncio.Lock()
+
+
+class CommandScheduler:
+    """
+    Per-device command scheduler.
+
+    All timed work (deferred toggles and schedule occurrences) lives in a single
+    min-heap drained by one asyncio task that sleeps until the earliest deadline,
+    so idle schedules cost nothing and each firing is O(log n).
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str], None],
+        store_path: str = SCHEDULE_FILE,
+        debounce_seconds: float = DEBOUNCE_SECONDS,
+        min_durations: Optional[Dict[str, tuple]] = None,
+        timezone: str = SCHEDULE_TIMEZONE,
+    ):
+        self.publish = publish
+        self.store_path = store_path
+        self.debounce_seconds = debounce_seconds
+        self.min_durations = min_durations or MIN_DURATIONS
+        self.tz = ZoneInfo(timezone)
+        self.devices: Dict[str, _DeviceState] = {d: _DeviceState() for d in DEVICES}
+        self.schedules: Dict[str, dict] = {}
+        self._schedule_timers: Dict[str, _Timer] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._sends: set = set()
+
+    # ------------------------------------------------------------------ lifecycle
+
+    async def start(self):
+        """Load persisted schedules/device state and start the timer loop"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._load()
+        for schedule in self.schedules.values():
+            self._arm(schedule, resume=True)
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ MQTT command scheduler started with {len(self.schedules)} schedule(s)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for task in self._sends:
+            task.cancel()
+        await asyncio.gather(*self._sends, return_exceptions=True)
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        self._save()
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, timer = heapq.heappop(self._heap)
+                if timer.cancelled:
+                    continue
+                try:
+                    timer.callback()
+                except Exception as e:
+                    logging.error(f"MQTT scheduled command failed: {e}")
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _call_at(self, fire_at: float, callback: Callable[[], None]) -> _Timer:
+        timer = _Timer(fire_at, callback)
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (fire_at, next(self._seq), timer))
+        if self._wakeup is not None and (earliest is None or fire_at < earliest):
+            self._wakeup.set()
+        return timer
+
+    def _spawn(self, coro):
+        """Run a publish from a timer callback without holding up the timer loop"""
+        task = asyncio.create_task(coro)
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    # ------------------------------------------------------------------ commands
+
+    async def submit(self, command: str, source: str = "api") -> dict:
+        """
+        Submit a relay command.
+
+        Returns a dict whose "action" is one of:
+        - "sent": published immediately
+        - "collapsed": redundant with the current/pending state, nothing published
+        - "deferred": held until the device's minimum on/off duration has elapsed
+        - "cancelled": reverted a pending toggle, so nothing needs publishing
+        """
+        device, action = parse_command(command)
+        dev = self.devices[device]
+        async with dev.lock:
+            return await self._submit(device, dev, command, action, source)
+
+    async def _submit(self, device: str, dev: _DeviceState, command: str, action: str, source: str) -> dict:
+        now = time.time()
+        if dev.pending is not None:
+            pending_command, timer = dev.pending
+            if pending_command == command:
+                return {"action": "collapsed", "command": command, "fire_at": timer.fire_at}
+            # Opposite of what is queued: the device is already in the requested state
+            timer.cancelled = True
+            dev.pending = None
+            return {"action": "cancelled", "command": command, "cancelled": pending_command}
+
+        if action == dev.state and dev.last_command == command and now - dev.last_sent < self.debounce_seconds:
+            return {"action": "collapsed", "command": command}
+
+        if dev.state is not None and action != dev.state:
+            min_on, min_off = self.min_durations.get(device, (0.0, 0.0))
+            hold = min_on if dev.state == "on" else min_off
+            earliest = dev.last_change + hold
+            if now < earliest:
+                timer = self._call_at(earliest, lambda: self._fire_pending(device))
+                dev.pending = (command, timer)
+                return {"action": "deferred", "command": command, "fire_at": earliest}
+
+        await self._send(device, command, now)
+        return {"action": "sent", "command": command, "source": source}
+
+    def _fire_pending(self, device: str):
+        self._spawn(self._send_pending(device))
+
+    async def _send_pending(self, device: str):
+        dev = self.devices[device]
+        async with dev.lock:
+            if dev.pending is None:
+                return
+            command, _ = dev.pending
+            try:
+                await self._send(device, command, time.time())
+            except Exception as e:
+                self._retry_later(device, command, e)
+                return
+            dev.pending = None
+
+    async def _submit_scheduled(self, command: str):
+        try:
+            await self.submit(command, source="schedule")
+        except Exception as e:
+            device = command.partition(":")[0]
+            async with self.devices[device].lock:
+                if self.devices[device].pending is None:
+                    self._retry_later(device, command, e)
+
+    def _retry_later(self, device: str, command: str, error: Exception):
+        """Keep a command whose publish failed pending and try it again later"""
+        dev = self.devices[device]
+        dev.error = str(getattr(error, "detail", error))
+        logging.error(f"MQTT command {command} failed, retrying in {PUBLISH_RETRY_SECONDS:.0f}s: {dev.error}")
+        timer = self._call_at(time.time() + PUBLISH_RETRY_SECONDS, lambda: self._fire_pending(device))
+        dev.pending = (command, timer)
+
+    async def _send(self, device: str, command: str, now: float):
+        dev = self.devices[device]
+        try:
+            await asyncio.to_thread(self.publish, command)
+        except Exception as e:
+            dev.error = str(getattr(e, "detail", e))
+            raise
+        dev.error = None
+        action = command.split(":", 1)[1]
+        if action != dev.state:
+            dev.state = action
+            dev.last_change = now
+        dev.last_sent = now
+        dev.last_command = command
+        self._mark_dirty()
+
+    def device_states(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "state": dev.state,
+                "last_change": dev.last_change or None,
+                "pending": {"command": dev.pending[0], "fire_at": dev.pending[1].fire_at} if dev.pending else None,
+                "error": dev.error,
+            }
+            for name, dev in self.devices.items()
+        }
+
+    # ------------------------------------------------------------------ schedules
+
+    def add_schedule(self, device: str, start_time: str, end_time: Optional[str] = None,
+                     days: Optional[List[int]] = None, recurring: bool = True) -> dict:
+        """Add a daily (or weekday-restricted) schedule, e.g. motor on 06:00 off 06:20"""
+        if device not in DEVICES:
+            raise ValueError(f"Invalid device: {device}")
+        parse_clock(start_time)
+        if end_time is not None and parse_clock(end_time) == parse_clock(start_time):
+            raise ValueError("end_time must differ from start_time")
+        if days is not None and any(d not in range(7) for d in days):
+            raise ValueError("days must be weekday numbers 0 (Mon) to 6 (Sun)")
+
+        schedule = {
+            "id": uuid.uuid4().hex[:12],
+            "device": device,
+            "start_time": start_time,
+            "end_time": end_time,
+            "days": sorted(set(days)) if days else None,
+            "recurring": recurring,
+            "created_at": datetime.now(self.tz).isoformat(),
+        }
+        self.schedules[schedule["id"]] = schedule
+        self._arm(schedule)
+        self._mark_dirty()
+        return self._describe(schedule)
+
+    def remove_schedule(self, schedule_id: str) -> bool:
+        schedule = self.schedules.pop(schedule_id, None)
+        if schedule is None:
+            return False
+        timer = self._schedule_timers.pop(schedule_id, None)
+        if timer is not None:
+            timer.cancelled = True
+        self._mark_dirty()
+        return True
+
+    def list_schedules(self) -> List[dict]:
+        return [self._describe(s) for s in self.schedules.values()]
+
+    def _describe(self, schedule: dict) -> dict:
+        timer = self._schedule_timers.get(schedule["id"])
+        next_run = None
+        if timer is not None and not timer.cancelled:
+            next_run = datetime.fromtimestamp(timer.fire_at, self.tz).isoformat()
+        return {**schedule, "next_run": next_run}
+
+    def _next_occurrence(self, schedule: dict, clock: str, after: datetime) -> datetime:
+        """First time of day `clock` strictly after `after` on an allowed weekday"""
+        hour, minute = parse_clock(clock)
+        candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate <= after:
+            candidate += timedelta(days=1)
+        days = schedule.get("days")
+        for _ in range(7):
+            if not days or candidate.weekday() in days:
+                return candidate
+            candidate += timedelta(days=1)
+        return candidate
+
+    def _last_occurrence(self, schedule: dict, clock: str, before: datetime) -> datetime:
+        """Latest time of day `clock` at or before `before` on an allowed weekday"""
+        hour, minute = parse_clock(clock)
+        candidate = before.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate > before:
+            candidate -= timedelta(days=1)
+        days = schedule.get("days")
+        for _ in range(7):
+            if not days or candidate.weekday() in days:
+                return candidate
+            candidate -= timedelta(days=1)
+        return candidate
+
+    @staticmethod
+    def _duration(schedule: dict) -> Optional[timedelta]:
+        """On-time of a window; an end before the start runs past midnight"""
+        if not schedule.get("end_time"):
+            return None
+        start_hour, start_minute = parse_clock(schedule["start_time"])
+        end_hour, end_minute = parse_clock(schedule["end_time"])
+        minutes = (end_hour * 60 + end_minute - start_hour * 60 - start_minute) % (24 * 60)
+        return timedelta(minutes=minutes)
+
+    def _next_edge(self, schedule: dict, now: datetime) -> tuple:
+        """
+        (when, action, inside_window) for a schedule's next edge. `days` restricts the
+        on edges only: the off edge follows the on edge that opened the window, so
+        22:00-02:00 on Mondays turns off at 02:00 Tuesday.
+        """
+        duration = self._duration(schedule)
+        if duration:
+            last_on = self._last_occurrence(schedule, schedule["start_time"], now)
+            if last_on + duration > now:
+                return last_on + duration, "off", True
+        return self._next_occurrence(schedule, schedule["start_time"], now), "on", False
+
+    def _arm(self, schedule: dict, resume: bool = False):
+        """Queue the next edge (on or off) of a schedule"""
+        fire_dt, action, inside = self._next_edge(schedule, datetime.now(self.tz))
+        # Restarted inside an active window: turn on now, off at the window's end
+        if resume and inside and self.devices[schedule["device"]].state != "on":
+            self._spawn(self._submit_scheduled(f"{schedule['device']}:on"))
+        schedule_id = schedule["id"]
+        self._schedule_timers[schedule_id] = self._call_at(
+            fire_dt.timestamp(), lambda: self._fire_schedule(schedule_id, action)
+        )
+
+    def _fire_schedule(self, schedule_id: str, action: str):
+        schedule = self.schedules.get(schedule_id)
+        if schedule is None:
+            return
+        self._spawn(self._submit_scheduled(f"{schedule['device']}:{action}"))
+        finished = action == "off" or not schedule.get("end_time")
+        if finished and not schedule.get("recurring", True):
+            self.remove_schedule(schedule_id)
+        else:
+            self._arm(schedule)
+
+    # ------------------------------------------------------------------ persistence
+
+    def _load(self):
+        if not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load MQTT schedules from {self.store_path}: {e}")
+            return
+        self.schedules = {s["id"]: s for s in data.get("schedules", [])}
+        for name, saved in data.get("devices", {}).items():
+            if name in self.devices:
+                self.devices[name].state = saved.get("state")
+                self.devices[name].last_change = saved.get("last_change") or 0.0
+
+    def _mark_dirty(self):
+        """Schedule a coalesced write (immediate when no event loop is running)"""
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._save()
+            return
+        self._save_handle = loop.call_later(SAVE_DELAY_SECONDS, self._save)
+
+    def _save(self):
+        self._save_handle = None
+        data = {
+            "schedules": list(self.schedules.values()),
+            "devices": {
+                name: {"state": dev.state, "last_change": dev.last_change}
+                for name, dev in self.devices.items()
+            },
+        }
+        try:
+            directory = os.path.dirname(self.store_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.store_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            logging.error(f"Could not persist MQTT schedules to {self.store_path}: {e}")
@@ -0,0 +1,191 @@
+"""
+Pest Catalog
+Pest and disease knowledge base (description, symptoms, lifecycle, treatment and
+prevention for several hundred pests of Indian crops), shipped as a data file and
+built once at startup into indexes: names and aliases, crops, types, and an inverted
+index of symptom keywords. Lookups are dict hits and symptom searches only touch the
+posting lists of the query's keywords, never the whole catalog.
+"""
+import hashlib
+import json
+import math
+import os
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.commodity_catalog import catalog as commodity_catalog, normalize_name
+
+PEST_CATALOG_PATH = os.getenv(
+    "PEST_CATALOG_PATH", os.path.join(os.path.dirname(__file__), "data", "pests.json")
+)
+
+# Too common in symptom descriptions to narrow a search
+STOPWORDS = frozenset(
+    "a all an and are as at be by from has have in into is it like my not of on or some the their "
+    "there they this to up very when with turn turns plant plants crop crops".split()
+)
+
+SUMMARY_FIELDS = ("id", "name", "type", "scientific_name", "description", "common_crops", "treatment")
+
+
+def keyword(word: str) -> str:
+    """Crude stem so 'curled', 'curling' and 'curl', or 'powdery' and 'powder', share a key"""
+    if word.endswith("ves") and len(word) > 4:
+        return word[:-3] + "f"
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    for suffix in ("ing", "ed", "es", "s", "y", "e"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            word = word[:-len(suffix)]
+            break
+    # "spotted" -> "spott" -> "spot"
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "ls":
+        word = word[:-1]
+    return word
+
+
+def keywords(text: str) -> Dict[str, str]:
+    """Distinct symptom keywords of a phrase, in order, each with the word as written"""
+    found: Dict[str, str] = {}
+    for word in normalize_name(text).split():
+        if word not in STOPWORDS and len(word) > 1:
+            found.setdefault(keyword(word), word)
+    return found
+
+
+def stemmed_name(key: str) -> str:
+    return " ".join(keyword(word) for word in key.split())
+
+
+class PestCatalog:
+    def __init__(self, entries: List[dict], version: str = ""):
+        self.version = version
+        self.entries: Dict[str, dict] = {}
+        self._names: Dict[str, str] = {}
+        self._stemmed_names: Dict[str, str] = {}
+        self._crops: Dict[str, List[str]] = defaultdict(list)
+        self._crop_names: Dict[str, str] = {}
+        self._commodity_crops: Dict[str, str] = {}
+        self._types: Dict[str, List[str]] = defaultdict(list)
+        self._symptoms: Dict[str, Set[str]] = defaultdict(set)
+
+        for entry in entries:
+            pest_id = entry["id"]
+            self.entries[pest_id] = entry
+            for name in (pest_id.replace("_", " "), entry["name"], entry["scientific_name"], *entry.get("aliases", [])):
+                key = normalize_name(name)
+                # Crop-specific entries can share a scientific name; the first one listed wins
+                if key and key not in self._names:
+                    self._names[key] = pest_id
+                    self._stemmed_names.setdefault(stemmed_name(key), pest_id)
+            for crop in entry["common_crops"]:
+                key = normalize_name(crop)
+                self._crops[key].append(pest_id)
+                self._crop_names.setdefault(key, crop)
+            self._types[entry["type"]].append(pest_id)
+            for symptom in entry["symptoms"]:
+                for word in keywords(symptom):
+                    self._symptoms[word].add(pest_id)
+
+        # Crops also answer to their market names in any language ("tamatar", "धान")
+        for key in self._crop_names:
+            commodity_id = commodity_catalog.resolve(key)
+            if commodity_id is not None:
+                self._commodity_crops.setdefault(commodity_id, key)
+        self._crops = dict(self._crops)
+        self._types = dict(self._types)
+        self._crop_sets = {key: frozenset(ids) for key, ids in self._crops.items()}
+        self._type_sets = {key: frozenset(ids) for key, ids in self._types.items()}
+        self._symptoms = {word: frozenset(ids) for word, ids in self._symptoms.items()}
+        self._order = {pest_id: i for i, pest_id in enumerate(self.entries)}
+        self._idf = {word: math.log(1 + len(self.entries) / len(ids)) for word, ids in self._symptoms.items()}
+
+    @classmethod
+    def load(cls, path: str = PEST_CATALOG_PATH) -> "PestCatalog":
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls(json.loads(data), version=hashlib.sha256(data).hexdigest()[:12])
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def crops(self) -> List[str]:
+        return sorted(self._crop_names.values())
+
+    @property
+    def types(self) -> List[str]:
+        return list(self._types)
+
+    def get(self, pest_id: str) -> Optional[dict]:
+        return self.entries.get(pest_id)
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Pest ID for an ID, name, scientific name or local name (None if unknown)"""
+        key = normalize_name(name)
+        pest_id = self._names.get(key)
+        if pest_id is None:
+            # "aphid" for "Aphids", "leaf spots" for "Leaf Spot"
+            pest_id = self._stemmed_names.get(stemmed_name(key))
+        return pest_id
+
+    @lru_cache(maxsize=1024)
+    def crop_key(self, crop: str) -> Optional[str]:
+        """Index key for a crop name, or its market name/alias (None if no pest lists it)"""
+        key = normalize_name(crop)
+        if key in self._crops:
+            return key
+        commodity_id = commodity_catalog.resolve(crop)
+        return self._commodity_crops.get(commodity_id) if commodity_id else None
+
+    def crop_name(self, crop_key: str) -> str:
+        return self._crop_names[crop_key]
+
+    def for_crop(self, crop_key: str) -> List[str]:
+        return self._crops.get(crop_key, [])
+
+    def of_type(self, pest_type: str) -> List[str]:
+        return self._types.get(pest_type, [])
+
+    def search_symptoms(self, text: str, crop_key: Optional[str] = None,
+                        pest_type: Optional[str] = None) -> List[Tuple[str, float, List[str]]]:
+        """
+        (pest ID, score, matched query words) for entries sharing symptom keywords with the
+        text, best first. The score sums the keywords' inverse document frequency, so a
+        rare symptom ("honeydew") counts for more than a common one ("yellow").
+        """
+        candidates = None
+        if crop_key:
+            candidates = self._crop_sets.get(crop_key, frozenset())
+        if pest_type:
+            of_type = self._type_sets.get(pest_type, frozenset())
+            candidates = of_type if candidates is None else candidates & of_type
+
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, List[str]] = defaultdict(list)
+        for stem, word in keywords(text).items():
+            postings = self._symptoms.get(stem)
+            if not postings:
+                continue
+            # Walk whichever side is shorter: the keyword's postings or the crop's pests
+            if candidates is None:
+                hits = postings
+            elif len(postings) <= len(candidates):
+                hits = (pest_id for pest_id in postings if pest_id in candidates)
+            else:
+                hits = (pest_id for pest_id in candidates if pest_id in postings)
+            for pest_id in hits:
+                scores[pest_id] += self._idf[stem]
+                matched[pest_id].append(word)
+
+        results = [(pest_id, round(score, 3), matched[pest_id]) for pest_id, score in scores.items()]
+        results.sort(key=lambda r: (-r[1], self._order[r[0]]))
+        return results
+
+    def summary(self, pest_id: str) -> dict:
+        entry = self.entries[pest_id]
+        return {field: entry[field] for field in SUMMARY_FIELDS}
+
+
+pest_catalog = PestCatalog.load()
@@ -0,0 +1,366 @@
+"""
+Pest Image Analysis
+CPU-bound part of /api/pest/detect, run in the image executor's worker processes
+(pure NumPy; the weights below are module constants, loaded once per worker).
+Photos are decoded to a fixed-size square input and a batch of them goes through one
+forward pass: colour-class maps (HSV) and local-contrast texture maps are pooled into
+a symptom feature vector per image, and a linear softmax layer scores the classes.
+
+Tiled mode (detect_pests_tiled) is for field photos where insects are only a few
+pixels: the photo is decoded at a higher working size and cut into overlapping
+model-size tiles. Tiles without leaf (excess-green mask) are skipped before any model
+work, the rest go through the model as batches, and per-tile detections are boxed by
+their symptom pixels and merged across tile overlaps with non-maximum suppression.
+"""
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.image_upload import open_working_image
+from app.pest_catalog import pest_catalog
+
+# Bumped whenever detection logic or weights change
+PEST_MODEL_VERSION = "pest-np-2"
+
+# Longest side (pixels) of the decoded image, and the square model input cut from it
+WORKING_SIZE = 384
+INPUT_SIZE = 160
+
+# Tiled mode: longest side of the decoded photo, overlap between neighbouring tiles,
+# and tiles per forward pass (bounds memory)
+TILED_WORKING_SIZE = 1280
+TILE_OVERLAP = 32
+TILE_BATCH = 32
+# Excess green (2G - R - B, 0-255 scale) marking vegetation, and the share of a tile
+# that must be vegetation for the tile to be analyzed
+EXG_THRESHOLD = 20
+MIN_TILE_LEAF = 0.15
+# Overlap (IoU) above which two boxes of the same class are one detection
+NMS_IOU = 0.3
+
+PEST_CLASSES = ["Healthy", "Aphids", "Whitefly", "Powdery Mildew", "Leaf Spot", "Rust", "Leaf Miner",
+                "Caterpillar"]
+
+FEATURE_NAMES = [
+    "green",        # share of healthy green tissue
+    "yellow",       # chlorotic (yellowed) tissue
+    "brown",        # dark brown/necrotic lesions
+    "rust",         # orange pustules
+    "white",        # white/grey coating
+    "dark_speck",   # small dark specks darker than their surroundings (insect colonies)
+    "pale_trace",   # pale lines/blotches brighter than surrounding leaf (mines)
+    "hole",         # background showing through inside the leaf (chewing damage)
+    "white_speck",  # small isolated white specks (adult whiteflies, eggs)
+    "plant",        # share of the frame covered by plant tissue
+]
+
+# Feature level that counts as strong evidence; features are scaled by it and capped
+FEATURE_SCALE = np.array([0.6, 0.15, 0.05, 0.02, 0.2, 0.01, 0.02, 0.03, 0.006, 0.8])
+FEATURE_CAP = 3.0
+
+CLASS_WEIGHTS = np.array([
+    # green yellow brown  rust  white speck trace  hole  wspeck plant
+    [2.0, -1.5, -2.0, -2.0, -1.5, -2.0, -2.0, -2.0, -2.0, 0.5],   # Healthy
+    [0.5, 1.0, 0.0, -0.5, -0.5, 3.0, -0.5, 0.0, -0.5, 0.0],       # Aphids
+    [0.5, 1.0, 0.0, -0.5, 0.5, -0.5, 0.0, 0.0, 3.0, 0.0],         # Whitefly
+    [0.0, 0.0, 0.0, -0.5, 3.0, 0.0, 0.0, 0.0, 0.5, 0.0],          # Powdery Mildew
+    [0.0, 0.5, 3.0, -0.5, 0.0, 0.5, 0.0, 0.0, 0.0, 0.0],          # Leaf Spot
+    [0.0, 0.5, 0.5, 3.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],           # Rust
+    [0.5, 0.0, 0.0, 0.0, 0.0, 0.0, 3.0, 0.0, 0.0, 0.0],           # Leaf Miner
+    [0.5, 0.0, 0.5, 0.0, 0.0, 0.0, 0.0, 3.0, 0.0, 0.0],           # Caterpillar
+])
+CLASS_BIAS = np.array([0.0, -1.5, -1.5, -1.5, -1.5, -1.5, -1.5, -1.5])
+SOFTMAX_TEMPERATURE = 0.5
+
+# A pest or disease is reported when its probability reaches this
+DETECTION_THRESHOLD = 0.3
+# Share of affected (non-green) plant tissue for Medium / High severity
+SEVERITY_THRESHOLDS = (0.1, 0.3)
+
+# Pest catalog entry (app/pest_catalog.py) behind each detectable class
+CATALOG_IDS = {
+    "Aphids": "aphids",
+    "Whitefly": "whitefly",
+    "Powdery Mildew": "powdery_mildew",
+    "Leaf Spot": "leaf_spot",
+    "Rust": "rust",
+    "Leaf Miner": "leaf_miner",
+    "Caterpillar": "caterpillar",
+}
+GENERAL_RECOMMENDATIONS = ["Monitor plant health daily"]
+
+# Feature map that localizes each class inside a tile
+CLASS_EVIDENCE = {
+    "Aphids": "dark_speck",
+    "Whitefly": "white_speck",
+    "Powdery Mildew": "white",
+    "Leaf Spot": "brown",
+    "Rust": "rust",
+    "Leaf Miner": "pale_trace",
+    "Caterpillar": "hole",
+}
+
+
+def load_input(source: Union[bytes, str]) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Decode (bytes or file path) to the square model input (float32 RGB in [0, 1], center
+    crop) and the working image size
+    """
+    image = open_working_image(source, WORKING_SIZE)
+    fitted = ImageOps.fit(image, (INPUT_SIZE, INPUT_SIZE), Image.Resampling.BILINEAR)
+    return np.asarray(fitted, dtype=np.float32) / 255.0, image.size
+
+
+def rgb_to_hsv(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """RGB in [0, 1] -> (hue in degrees, saturation, value), any leading shape"""
+    # Contiguous channel planes; strided rgb[..., i] views are several times slower
+    r, g, b = np.ascontiguousarray(np.moveaxis(rgb, -1, 0))
+    v = np.maximum(np.maximum(r, g), b)
+    delta = v - np.minimum(np.minimum(r, g), b)
+    safe = np.where(delta > 1e-6, delta, 1.0)
+    hue = np.where(v == r, (g - b) / safe, np.where(v == g, (b - r) / safe + 2.0, (r - g) / safe + 4.0))
+    hue = np.where(hue < 0, hue + 6.0, hue) * 60.0
+    saturation = delta / np.where(v > 1e-6, v, 1.0)
+    return hue, saturation, v
+
+
+def box_mean(x: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over a (2r+1)^2 window around each pixel of an (N, H, W) stack (integral image)"""
+    k = 2 * radius + 1
+    padded = np.pad(x.astype(np.float64), ((0, 0), (radius, radius), (radius, radius)), mode="edge")
+    c = np.pad(padded.cumsum(axis=1).cumsum(axis=2), ((0, 0), (1, 0), (1, 0)))
+    return (c[:, k:, k:] - c[:, :-k, k:] - c[:, k:, :-k] + c[:, :-k, :-k]) / (k * k)
+
+
+def feature_maps(rgb: np.ndarray) -> List[np.ndarray]:
+    """Per-pixel boolean maps (N, H, W), one per FEATURE_NAMES entry, for a stack of inputs"""
+    hue, sat, val = rgb_to_hsv(rgb)
+
+    green = (hue >= 70) & (hue < 170) & (sat > 0.2) & (val > 0.15)
+    # Symptom colours only count on a leaf, so soil and stones in the frame don't
+    around = box_mean(green.astype(np.float32), 12)
+    on_leaf = around > 0.25
+    yellow = (hue >= 45) & (hue < 70) & (sat > 0.3) & (val > 0.4) & on_leaf
+    rust = (hue >= 15) & (hue < 45) & (sat > 0.55) & (val > 0.45) & on_leaf
+    brown = ((hue < 45) | (hue >= 330)) & (sat > 0.25) & (val > 0.1) & (val <= 0.45) & on_leaf
+    white = (sat < 0.18) & (val > 0.72) & on_leaf
+    plant = green | yellow | rust | brown | white
+
+    # Local contrast against a 7x7 neighbourhood picks out specks and thin trails
+    local = box_mean(val, 3)
+    leafy = box_mean(green.astype(np.float32), 4)
+    dark_speck = (val < local - 0.12) & (leafy > 0.4)
+    # Trails must also stand out from the leaf as a whole, not just from nearby dark specks
+    leaf_val = (val * green).sum(axis=(1, 2)) / np.maximum(np.count_nonzero(green, axis=(1, 2)), 1)
+    pale_trace = green & (val > local + 0.08) & (val > leaf_val[:, None, None] + 0.12)
+    white_speck = white & (box_mean(white.astype(np.float32), 3) < 0.3) & (leafy > 0.4)
+    # Holes: non-plant pixels mostly surrounded by leaf (the leaf outline itself is convex)
+    hole = ~plant & (around > 0.55)
+
+    return [green, yellow, brown, rust, white, dark_speck, pale_trace, hole, white_speck, plant]
+
+
+def pool_features(maps: List[np.ndarray]) -> np.ndarray:
+    """Feature matrix (N x FEATURE_NAMES): the share of each map's pixels that are set"""
+    area = maps[0].shape[1] * maps[0].shape[2]
+    return np.stack([np.count_nonzero(m, axis=(1, 2)) / area for m in maps], axis=1)
+
+
+def extract_features_batch(rgb: np.ndarray) -> np.ndarray:
+    """Feature matrix (N x FEATURE_NAMES) for a stack of model inputs (N, INPUT_SIZE, INPUT_SIZE, 3)"""
+    return pool_features(feature_maps(rgb))
+
+
+def forward(features: np.ndarray) -> np.ndarray:
+    """Class probabilities (N x PEST_CLASSES) from a feature matrix"""
+    z = np.minimum(features / FEATURE_SCALE, FEATURE_CAP)
+    logits = (z @ CLASS_WEIGHTS.T + CLASS_BIAS) / SOFTMAX_TEMPERATURE
+    e = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def _severity(features: np.ndarray) -> str:
+    plant = features[FEATURE_NAMES.index("plant")]
+    affected = 1.0 - features[FEATURE_NAMES.index("green")] / plant if plant > 0 else 0.0
+    return ["Low", "Medium", "High"][int(np.searchsorted(SEVERITY_THRESHOLDS, affected))]
+
+
+def _detection(name: str, confidence: float, severity: str) -> Dict:
+    info = pest_catalog.get(CATALOG_IDS[name])
+    return {
+        "pest_id": info["id"],
+        "name": name,
+        "confidence": round(confidence, 2),
+        "description": info["description"],
+        "treatment": info["treatment"],
+        "severity": severity,
+    }
+
+
+def _result(detected: List[Dict], probabilities: np.ndarray, image_size) -> Dict:
+    recommendations = [r for pest in detected for r in pest_catalog.get(pest["pest_id"])["prevention"]]
+    return {
+        "detected_pests": detected,
+        "recommendations": recommendations + GENERAL_RECOMMENDATIONS,
+        "plant_status": "Affected" if detected else "Healthy",
+        "probabilities": {name: round(float(p), 3) for name, p in zip(PEST_CLASSES, probabilities)},
+        "image_size": list(image_size),
+        "model_version": PEST_MODEL_VERSION,
+    }
+
+
+def _describe(features: np.ndarray, probabilities: np.ndarray, image_size) -> Dict:
+    severity = _severity(features)
+    detected = [
+        _detection(PEST_CLASSES[i], float(probabilities[i]), severity)
+        for i in np.argsort(-probabilities)
+        if PEST_CLASSES[i] != "Healthy" and probabilities[i] >= DETECTION_THRESHOLD
+    ]
+    return _result(detected, probabilities, image_size)
+
+
+def detect_pests_batch(sources: List[Union[bytes, str]]) -> List[Union[Dict, Exception]]:
+    """
+    Detection for many images (bytes or file paths) with one batched forward pass.
+    An image that can't be decoded gets its exception in its slot instead of a result,
+    so one bad upload doesn't fail the others batched with it.
+    """
+    results: List[Union[Dict, Exception]] = [None] * len(sources)
+    inputs, sizes, slots = [], [], []
+    for i, source in enumerate(sources):
+        try:
+            pixels, size = load_input(source)
+        except (Image.DecompressionBombError, OSError) as e:
+            results[i] = e
+            continue
+        inputs.append(pixels)
+        sizes.append(size)
+        slots.append(i)
+
+    if inputs:
+        features = extract_features_batch(np.stack(inputs))
+        for i, row, probabilities, size in zip(slots, features, forward(features), sizes):
+            results[i] = _describe(row, probabilities, size)
+    return results
+
+
+def detect_pests(source: Union[bytes, str]) -> Dict:
+    """Detection for one image (bytes or file path)"""
+    result = detect_pests_batch([source])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def tile_starts(length: int) -> List[int]:
+    """Offsets of INPUT_SIZE tiles overlapping by TILE_OVERLAP; the last one ends at the edge"""
+    if length <= INPUT_SIZE:
+        return [0]
+    return list(range(0, length - INPUT_SIZE, INPUT_SIZE - TILE_OVERLAP)) + [length - INPUT_SIZE]
+
+
+def leaf_tiles(pixels: np.ndarray) -> List[Tuple[int, int]]:
+    """(y, x) of the tiles whose excess-green vegetation share reaches MIN_TILE_LEAF"""
+    r, g, b = (pixels[..., i].astype(np.int16) for i in range(3))
+    vegetation = (2 * g - r - b) > EXG_THRESHOLD
+    # Integral image: any tile's vegetation count from four lookups
+    counts = np.pad(vegetation.cumsum(axis=0, dtype=np.int32).cumsum(axis=1), ((1, 0), (1, 0)))
+    tiles = []
+    for y in tile_starts(pixels.shape[0]):
+        for x in tile_starts(pixels.shape[1]):
+            y1, x1 = y + INPUT_SIZE, x + INPUT_SIZE
+            leaf = counts[y1, x1] - counts[y, x1] - counts[y1, x] + counts[y, x]
+            if leaf >= MIN_TILE_LEAF * INPUT_SIZE * INPUT_SIZE:
+                tiles.append((y, x))
+    return tiles
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU of one (x0, y0, x1, y1) box with each row of boxes"""
+    x0 = np.maximum(box[0], boxes[:, 0])
+    y0 = np.maximum(box[1], boxes[:, 1])
+    x1 = np.minimum(box[2], boxes[:, 2])
+    y1 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou: float = NMS_IOU) -> List[int]:
+    """Indices of the boxes kept: highest score first, dropping boxes overlapping a kept one"""
+    order = list(np.argsort(-scores, kind="stable"))
+    keep = []
+    while order:
+        best = order.pop(0)
+        keep.append(best)
+        if order:
+            overlaps = box_iou(boxes[best], boxes[order])
+            order = [i for i, o in zip(order, overlaps) if o <= iou]
+    return keep
+
+
+def detect_pests_tiled(source: Union[bytes, str]) -> Dict:
+    """
+    Tiled detection for one image (bytes or file path). Detected pests carry their
+    regions as boxes (x0, y0, x1, y1) relative to the image width and height.
+    """
+    image = open_working_image(source, TILED_WORKING_SIZE)
+    if min(image.size) < INPUT_SIZE:
+        scale = INPUT_SIZE / min(image.size)
+        image = image.resize((max(INPUT_SIZE, round(image.width * scale)), max(INPUT_SIZE, round(image.height * scale))),
+                             Image.Resampling.BILINEAR)
+    pixels = np.asarray(image)
+    height, width = pixels.shape[:2]
+    tiles = leaf_tiles(pixels)
+
+    features, probabilities, boxes, scores, classes = [], [], [], [], []
+    for start in range(0, len(tiles), TILE_BATCH):
+        chunk = tiles[start:start + TILE_BATCH]
+        batch = np.stack([pixels[y:y + INPUT_SIZE, x:x + INPUT_SIZE] for y, x in chunk]).astype(np.float32) / 255.0
+        maps = feature_maps(batch)
+        chunk_features = pool_features(maps)
+        chunk_probabilities = forward(chunk_features)
+        features.append(chunk_features)
+        probabilities.append(chunk_probabilities)
+
+        for t, c in zip(*np.nonzero(chunk_probabilities[:, 1:] >= DETECTION_THRESHOLD)):
+            name = PEST_CLASSES[c + 1]
+            y, x = chunk[t]
+            ys, xs = np.nonzero(maps[FEATURE_NAMES.index(CLASS_EVIDENCE[name])][t])
+            if len(ys):
+                y0, y1, x0, x1 = y + ys.min(), y + ys.max() + 1, x + xs.min(), x + xs.max() + 1
+            else:
+                y0, y1, x0, x1 = y, y + INPUT_SIZE, x, x + INPUT_SIZE
+            boxes.append((x0 / width, y0 / height, x1 / width, y1 / height))
+            scores.append(float(chunk_probabilities[t, c + 1]))
+            classes.append(name)
+
+    if features:
+        features = np.concatenate(features)
+        probabilities = np.concatenate(probabilities)
+        severity = _severity(features.mean(axis=0))
+        class_probabilities = probabilities.max(axis=0)
+    else:
+        severity = "Low"
+        class_probabilities = np.eye(len(PEST_CLASSES))[0]
+
+    detected = []
+    boxes, scores, classes = np.array(boxes).reshape(-1, 4), np.array(scores), np.array(classes)
+    for name in PEST_CLASSES[1:]:
+        members = np.nonzero(classes == name)[0]
+        if not len(members):
+            continue
+        kept = members[non_max_suppression(boxes[members], scores[members])]
+        detection = _detection(name, float(scores[kept].max()), severity)
+        detection["regions"] = [
+            {"box": [round(float(v), 4) for v in boxes[i]], "confidence": round(float(scores[i]), 2)}
+            for i in kept
+        ]
+        detected.append(detection)
+    detected.sort(key=lambda d: -d["confidence"])
+
+    result = _result(detected, class_probabilities, image.size)
+    result["tiles"] = {"total": len(tile_starts(height)) * len(tile_starts(width)), "analyzed": len(tiles)}
+    return result
@@ -0,0 +1,148 @@
+"""
+Price Analytics
+Vectorized NumPy analytics over array-backed daily price series: one
+(commodities x days) matrix per location, with every statistic computed for all
+commodities at once (SMA, EMA, rolling volatility, % change, seasonal indices).
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class PriceSeries:
+    """
+    Daily price grid: values[i, j] is commodity i's price on dates[j] (forward-filled).
+    observed[i] counts the days with a real snapshot, before filling.
+    """
+
+    def __init__(self, commodities: List[str], dates: np.ndarray, values: np.ndarray,
+                 observed: Optional[np.ndarray] = None):
+        self.commodities = commodities
+        self.dates = dates
+        self.values = values
+        self.observed = observed if observed is not None else np.sum(~np.isnan(values), axis=1)
+        self.index = {name: i for i, name in enumerate(commodities)}
+
+    @classmethod
+    def from_history(cls, history: Dict[str, List[dict]], start: date, end: date) -> "PriceSeries":
+        """Build the grid from PriceStore.history() output"""
+        commodities = sorted(history)
+        n_days = (end - start).days + 1
+        dates = np.arange(np.datetime64(start, "D"), np.datetime64(start, "D") + n_days)
+        values = np.full((len(commodities), n_days), np.nan)
+        for i, commodity in enumerate(commodities):
+            points = history[commodity]
+            cols = (np.array([p["date"] for p in points], dtype="datetime64[D]") - dates[0]).astype(int)
+            values[i, cols] = [p["price"] for p in points]
+        return cls(commodities, dates, forward_fill(values), np.sum(~np.isnan(values), axis=1))
+
+    def select(self, commodities: Sequence[str]) -> "PriceSeries":
+        rows = [self.index[c] for c in commodities if c in self.index]
+        return PriceSeries([self.commodities[r] for r in rows], self.dates, self.values[rows], self.observed[rows])
+
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    """Carry the last observation forward along each row (leading gaps stay NaN)"""
+    if values.size == 0:
+        return values
+    mask = ~np.isnan(values)
+    idx = np.where(mask, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = values[np.arange(values.shape[0])[:, None], idx]
+    # Positions before the first observation picked column 0, which may be NaN anyway
+    filled[np.cumsum(mask, axis=1) == 0] = np.nan
+    return filled
+
+
+def sma_last(values: np.ndarray, window: int) -> np.ndarray:
+    """Simple moving average over the last `window` days, per row"""
+    window = max(1, min(window, values.shape[1]))
+    return np.nanmean(values[:, -window:], axis=1)
+
+
+def ema_last(values: np.ndarray, span: int) -> np.ndarray:
+    """Exponential moving average (adjusted weights) at the last day, per row"""
+    alpha = 2.0 / (span + 1.0)
+    n = values.shape[1]
+    weights = (1.0 - alpha) ** np.arange(n - 1, -1, -1)
+    present = ~np.isnan(values)
+    numerator = np.where(present, values, 0.0) @ weights
+    denominator = present @ weights
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return numerator / denominator
+
+
+def rolling_volatility(values: np.ndarray, window: int) -> np.ndarray:
+    """Std-dev of daily log returns (percent) over the last `window` days, per row"""
+    if values.shape[1] < 2:
+        return np.full(values.shape[0], np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.diff(np.log(values[:, -(window + 1):]), axis=1)
+    counts = np.sum(~np.isnan(returns), axis=1)
+    result = np.full(values.shape[0], np.nan)
+    valid = counts >= 2
+    if valid.any():
+        result[valid] = np.nanstd(returns[valid], axis=1, ddof=1) * 100
+    return result
+
+
+def pct_change(values: np.ndarray, windows: Sequence[int]) -> np.ndarray:
+    """Percent change from `w` days ago to the last day; shape (rows, len(windows))"""
+    n = values.shape[1]
+    cols = np.clip(n - 1 - np.asarray(windows), 0, n - 1)
+    last = values[:, -1:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (last / values[:, cols] - 1.0) * 100
+
+
+def seasonal_indices(values: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    """
+    Monthly seasonal index per row: mean price in each calendar month divided by the
+    overall mean (1.0 = average). Months without data are NaN. Shape (rows, 12).
+    """
+    months = dates.astype("datetime64[M]").astype(int) % 12
+    onehot = np.zeros((len(dates), 12))
+    onehot[np.arange(len(dates)), months] = 1.0
+    present = ~np.isnan(values)
+    sums = np.where(present, values, 0.0) @ onehot
+    counts = present.astype(float) @ onehot
+    with np.errstate(invalid="ignore", divide="ignore"):
+        monthly_mean = sums / counts
+        overall = sums.sum(axis=1) / counts.sum(axis=1)
+        return monthly_mean / overall[:, None]
+
+
+def _clean(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def analyze(series: PriceSeries, sma_window: int = 7, ema_span: int = 14, volatility_window: int = 14,
+            change_windows: Sequence[int] = (1, 7, 30)) -> List[dict]:
+    """All statistics for every commodity in the series, computed in one vectorized pass"""
+    values = series.values
+    if values.size == 0:
+        return []
+    latest = values[:, -1]
+    sma = sma_last(values, sma_window)
+    ema = ema_last(values, ema_span)
+    volatility = rolling_volatility(values, volatility_window)
+    changes = pct_change(values, change_windows)
+    seasonal = seasonal_indices(values, series.dates)
+
+    results = []
+    for i, commodity in enumerate(series.commodities):
+        results.append({
+            "commodity": commodity,
+            "latest_price": _clean(latest[i]),
+            "sma": _clean(sma[i]),
+            "ema": _clean(ema[i]),
+            "volatility_percent": _clean(volatility[i]),
+            "change_percent": {f"{w}d": _clean(changes[i, j]) for j, w in enumerate(change_windows)},
+            "seasonal_index": [_clean(v) for v in seasonal[i]],
+        })
+    return results
+
+
+def analysis_window(latest: date, days: int) -> tuple:
+    return latest - timedelta(days=days - 1), latest
@@ -0,0 +1,263 @@
+"""
+Price Forecasting
+Holt linear exponential smoothing per (location, commodity). Parameters are fitted
+in a batch job (grid search vectorized over all commodities and parameter pairs),
+cached, and rolled forward incrementally as new snapshots arrive, so serving a
+forecast is just level + h * trend. A commodity whose Holt fit does not beat the
+naive last-price forecast on a holdout of recent days is served the naive forecast.
+Forecasts are dated from today and say how old the underlying data is.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.price_analytics import PriceSeries
+
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "365"))
+FORECAST_REFIT_INTERVAL = float(os.getenv("FORECAST_REFIT_INTERVAL_SECONDS", "86400"))
+# After a longer gap without snapshots the cached trend says nothing about today:
+# restart the model from the new price instead of extrapolating across the gap
+FORECAST_MAX_GAP_DAYS = int(os.getenv("FORECAST_MAX_GAP_DAYS", "14"))
+
+ALPHA_GRID = np.array([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9])
+BETA_GRID = np.array([0.01, 0.05, 0.1, 0.2, 0.3])
+
+# Recent days held out to choose between Holt and the naive forecast
+FORECAST_HOLDOUT_DAYS = int(os.getenv("FORECAST_HOLDOUT_DAYS", "14"))
+# Holt is kept only if its holdout error is this fraction below the naive one;
+# on a short holdout a narrow win is mostly noise
+FORECAST_HOLT_MARGIN = float(os.getenv("FORECAST_HOLT_MARGIN", "0.2"))
+
+# Forecast moves within this percent of today's price are "hold"
+DECISION_THRESHOLD_PERCENT = 1.0
+
+
+class HoltState:
+    """Cached model for one series"""
+    __slots__ = ("alpha", "beta", "level", "trend", "last_date", "mae", "n_obs", "kind", "holdout_mae",
+                 "_before_last")
+
+    def __init__(self, alpha: float, beta: float, level: float, trend: float,
+                 last_date: date, mae: float, n_obs: int, kind: str = "holt", holdout_mae: float = float("nan")):
+        self.kind = kind
+        self.holdout_mae = holdout_mae
+        self.alpha = alpha
+        self.beta = beta
+        self.level = level
+        self.trend = trend
+        self.last_date = last_date
+        self.mae = mae
+        self.n_obs = n_obs
+        self._before_last: Optional[Tuple[float, float]] = None
+
+    def update(self, price: float, on: date):
+        """Roll the state forward to `on` with one new observation (O(1), no refit)"""
+        if on < self.last_date:
+            return
+        if on == self.last_date and self._before_last is not None:
+            # Another snapshot on the same day replaces the day's observation
+            level, trend = self._before_last
+            gap = 1
+        else:
+            level, trend = self.level, self.trend
+            gap = (on - self.last_date).days
+        if gap > FORECAST_MAX_GAP_DAYS:
+            # Flat at the new price until a refit or further snapshots give a trend
+            self.level, self.trend = price, 0.0
+            self.last_date = on
+            self.n_obs = 1
+            self._before_last = None
+            return
+        self._before_last = (level, trend)
+        # Days without observations carry the trend forward
+        level += trend * (gap - 1)
+        predicted = level + trend
+        new_level = self.alpha * price + (1 - self.alpha) * predicted
+        self.trend = self.beta * (new_level - level) + (1 - self.beta) * trend
+        self.level = new_level
+        self.last_date = on
+        self.n_obs += 1
+
+    def forecast(self, horizon: int) -> np.ndarray:
+        return self.level + self.trend * np.arange(1, horizon + 1)
+
+
+def fit_holt(values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Grid-search alpha/beta for every row at once by one-step-ahead MAE.
+    values: (series, days) without NaN. Returns per-row alpha, beta, level, trend, mae.
+    """
+    alphas, betas = np.meshgrid(ALPHA_GRID, BETA_GRID, indexing="ij")
+    alphas, betas = alphas.ravel()[None, :], betas.ravel()[None, :]
+    n_series, n_days = values.shape
+    level = np.repeat(values[:, :1], alphas.shape[1], axis=1)
+    trend = np.repeat(values[:, 1:2] - values[:, :1], alphas.shape[1], axis=1)
+    abs_error = np.zeros_like(level)
+    for t in range(1, n_days):
+        observed = values[:, t:t + 1]
+        predicted = level + trend
+        abs_error += np.abs(observed - predicted)
+        new_level = alphas * observed + (1 - alphas) * predicted
+        trend = betas * (new_level - level) + (1 - betas) * trend
+        level = new_level
+    mae = abs_error / max(n_days - 1, 1)
+    best = np.argmin(mae, axis=1)
+    rows = np.arange(n_series)
+    return alphas[0, best], betas[0, best], level[rows, best], trend[rows, best], mae[rows, best]
+
+
+class Forecaster:
+    """Model cache keyed by (location, commodity), refit periodically in the background"""
+
+    def __init__(self, history_days: int = FORECAST_HISTORY_DAYS, refit_interval: float = FORECAST_REFIT_INTERVAL):
+        self.history_days = history_days
+        self.refit_interval = refit_interval
+        self.models: Dict[Tuple[str, str], HoltState] = {}
+        self.fitted_locations = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def fit_series(self, location: str, series: PriceSeries):
+        """Batch fit every commodity of a location's daily grid"""
+        values = series.values.copy()
+        # Real snapshots, not the forward-filled days in between
+        observed_days = series.observed
+        # Commodities first seen mid-window are back-filled with their first price
+        first = np.argmax(~np.isnan(values), axis=1)
+        rows = np.arange(values.shape[0])
+        leading = np.arange(values.shape[1])[None, :] < first[:, None]
+        values[leading] = np.broadcast_to(values[rows, first][:, None], values.shape)[leading]
+
+        last_date = series.dates[-1].astype(date)
+        fit_rows = np.flatnonzero(observed_days >= 3)
+        holt_holdout, naive_holdout = self.holdout_errors(values[fit_rows])
+        if fit_rows.size:
+            alpha, beta, level, trend, mae = fit_holt(values[fit_rows])
+            for k, row in enumerate(fit_rows):
+                key = (location, series.commodities[row])
+                if holt_holdout[k] >= naive_holdout[k] * (1 - FORECAST_HOLT_MARGIN):
+                    self.models[key] = HoltState(
+                        1.0, 0.0, float(values[row, -1]), 0.0, last_date,
+                        float(np.mean(np.abs(np.diff(values[row])))), int(observed_days[row]),
+                        kind="naive", holdout_mae=float(naive_holdout[k]),
+                    )
+                else:
+                    self.models[key] = HoltState(
+                        float(alpha[k]), float(beta[k]), float(level[k]), float(trend[k]),
+                        last_date, float(mae[k]), int(observed_days[row]), holdout_mae=float(holt_holdout[k]),
+                    )
+        # Too little history to fit: naive model, flat at the last price
+        for row in np.flatnonzero((observed_days > 0) & (observed_days < 3)):
+            self.models[(location, series.commodities[row])] = HoltState(
+                1.0, 0.0, float(values[row, -1]), 0.0, last_date, float("nan"), int(observed_days[row]), kind="naive",
+            )
+        self.fitted_locations.add(location)
+
+    def holdout_errors(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Mean absolute error over the last holdout days of a Holt fit on the days before
+        them, and of the naive forecast (last price before them). Rows too short for a
+        holdout get (-inf, inf) so Holt is kept.
+        """
+        holdout = min(FORECAST_HOLDOUT_DAYS, values.shape[1] - 3)
+        if holdout < 1 or not values.size:
+            return np.full(values.shape[0], -np.inf), np.full(values.shape[0], np.inf)
+        train, actual = values[:, :-holdout], values[:, -holdout:]
+        _, _, level, trend, _ = fit_holt(train)
+        steps = np.arange(1, holdout + 1)[None, :]
+        holt = np.mean(np.abs(level[:, None] + trend[:, None] * steps - actual), axis=1)
+        naive = np.mean(np.abs(train[:, -1:] - actual), axis=1)
+        return holt, naive
+
+    def fit_all(self, load_series: Callable[[str, int], Optional[PriceSeries]], locations: List[str]) -> int:
+        fitted = 0
+        for location in locations:
+            series = load_series(location, self.history_days)
+            if series is not None and series.values.size:
+                self.fit_series(location, series)
+                fitted += len(series.commodities)
+        return fitted
+
+    def observe(self, location: str, prices: List[dict], on: date):
+        """Incrementally update cached models with a new snapshot"""
+        for item in prices:
+            model = self.models.get((location, item["commodity"]))
+            if model is not None:
+                model.update(float(item["price"]), on)
+
+    def forecast(self, location: str, commodity: str, horizon: int, today: Optional[date] = None) -> Optional[dict]:
+        """
+        Forecast for the `horizon` days after today. When the last snapshot is older than
+        FORECAST_MAX_GAP_DAYS the trend is not extrapolated that far: the forecast is
+        flat at the last level, marked stale, and gives no advice.
+        """
+        model = self.models.get((location, commodity))
+        if model is None:
+            return None
+        today = today or date.today()
+        age = max(0, (today - model.last_date).days)
+        stale = age > FORECAST_MAX_GAP_DAYS
+        if stale:
+            current = model.level
+            values = np.full(horizon, model.level)
+        else:
+            current = model.level + model.trend * age
+            values = model.forecast(age + horizon)[age:]
+        change = (values[-1] - current) / current * 100 if current else 0.0
+        if stale:
+            advice = None
+        elif change >= DECISION_THRESHOLD_PERCENT:
+            advice = "wait"
+        elif change <= -DECISION_THRESHOLD_PERCENT:
+            advice = "sell_now"
+        else:
+            advice = "hold"
+        return {
+            "commodity": commodity,
+            "current_level": round(float(current), 2),
+            "trend_per_day": 0.0 if stale else round(model.trend, 2),
+            "last_observed": model.last_date.isoformat(),
+            "data_age_days": age,
+            "stale": stale,
+            "forecast": [
+                {"date": (today + timedelta(days=h + 1)).isoformat(), "price": round(float(v), 2)}
+                for h, v in enumerate(values)
+            ],
+            "expected_change_percent": round(float(change), 2),
+            "advice": advice,
+            "model": {
+                "type": model.kind,
+                "alpha": model.alpha,
+                "beta": model.beta,
+                "in_sample_mae": None if np.isnan(model.mae) else round(model.mae, 2),
+                "holdout_mae": None if np.isnan(model.holdout_mae) else round(model.holdout_mae, 2),
+                "observations": model.n_obs,
+            },
+        }
+
+    async def start(self, load_series: Callable[[str, int], Optional[PriceSeries]], locations: List[str]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(load_series, locations))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, load_series, locations):
+        while True:
+            try:
+                fitted = self.fit_all(load_series, locations)
+                logging.info(f"Fitted {fitted} price forecast models")
+            except Exception as e:
+                logging.error(f"Price forecast batch fit failed: {e}")
+            await asyncio.sleep(self.refit_interval)
+
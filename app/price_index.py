@@ -0,0 +1,148 @@
+"""
+Location Price Index
+Per-location indexes built once when a price list is loaded (mock data at startup,
+scraped data on each refresh): commodity ID -> rows, and one pre-sorted row order per
+(category, sort) pair. Filtered, sorted and paginated queries are then a dict lookup
+plus a bisect on the sort keys instead of a scan of the full list.
+"""
+import base64
+import binascii
+import json
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from app.commodity_catalog import catalog, normalize_name
+
+# Sort orders accepted by query(); "-" prefix means descending
+SORT_ORDERS = ("default", "price", "-price", "change", "-change", "commodity")
+
+# Fields a client may select (MarketPrice fields)
+PRICE_FIELDS = ("commodity", "commodity_id", "category", "price", "unit", "change", "status")
+
+UNCATEGORIZED = "Other"
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(sort: str, key: tuple) -> str:
+    raw = json.dumps([sort, list(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _key_types(sort: str) -> tuple:
+    """Element types of sort_key() for a sort order (see PriceIndex.sort_key)"""
+    if sort == "default":
+        return (int, str)
+    if sort == "commodity":
+        return (str,)
+    return ((int, float), str)
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise CursorError("Malformed cursor") from e
+    if cursor_sort != sort:
+        raise CursorError("Cursor was issued for a different sort order")
+    types = _key_types(sort)
+    # bool is an int subclass but never part of a key
+    if not isinstance(key, list) or len(key) != len(types) or any(
+        isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(key, types)
+    ):
+        raise CursorError("Malformed cursor")
+    return tuple(key)
+
+
+class PriceIndex:
+    def __init__(self, prices: List[dict]):
+        self.prices = prices
+        self.categories: List[str] = []
+        self._by_commodity: Dict[str, List[int]] = {}
+        self._category_keys: Dict[str, str] = {}
+        self._orders: Dict[Tuple[Optional[str], str], Tuple[List[tuple], List[int]]] = {}
+
+        rows_by_category: Dict[Optional[str], List[int]] = {None: []}
+        for row, item in enumerate(prices):
+            entry = catalog.get(item.get("commodity_id") or "")
+            category = entry["category"] if entry else UNCATEGORIZED
+            item.setdefault("category", category)
+            if item.get("commodity_id"):
+                self._by_commodity.setdefault(item["commodity_id"], []).append(row)
+            if category not in rows_by_category:
+                rows_by_category[category] = []
+                self.categories.append(category)
+                self._category_keys[normalize_name(category)] = category
+            rows_by_category[category].append(row)
+            rows_by_category[None].append(row)
+
+        for category, rows in rows_by_category.items():
+            for sort in SORT_ORDERS:
+                keyed = sorted((self.sort_key(row, sort), row) for row in rows)
+                self._orders[(category, sort)] = ([k for k, _ in keyed], [r for _, r in keyed])
+
+    def sort_key(self, row: int, sort: str) -> tuple:
+        # Ties break on the commodity name so cursors stay valid across refreshes;
+        # "default" keeps list order and carries the name so _resume can find it again
+        item = self.prices[row]
+        name = normalize_name(item["commodity"])
+        if sort == "default":
+            return (row, name)
+        if sort == "commodity":
+            return (name,)
+        descending = sort.startswith("-")
+        value = float(item[sort.lstrip("-")])
+        return (-value if descending else value, name)
+
+    def category(self, name: str) -> Optional[str]:
+        """Category by exact name or first word, case-insensitive ("grains" -> "Grains & Cereals")"""
+        key = normalize_name(name)
+        if key in self._category_keys:
+            return self._category_keys[key]
+        for category_key, category in self._category_keys.items():
+            if category_key.split()[0] == key:
+                return category
+        return None
+
+    def query(self, commodity_id: Optional[str] = None, category: Optional[str] = None,
+              sort: str = "default", cursor: Optional[str] = None,
+              limit: Optional[int] = None) -> Tuple[List[dict], int, Optional[str]]:
+        """Return (page, total matches, next cursor) for a filtered, sorted page"""
+        if commodity_id is not None:
+            rows = [
+                row for row in self._by_commodity.get(commodity_id, [])
+                if category is None or self.prices[row]["category"] == category
+            ]
+            keyed = sorted((self.sort_key(row, sort), row) for row in rows)
+            keys, rows = [k for k, _ in keyed], [r for _, r in keyed]
+        else:
+            keys, rows = self._orders.get((category, sort), ([], []))
+
+        start = 0
+        if cursor:
+            start = self._resume(keys, decode_cursor(cursor, sort), sort)
+        end = len(rows) if limit is None else min(start + limit, len(rows))
+        next_cursor = encode_cursor(sort, keys[end - 1]) if end < len(rows) else None
+        return [self.prices[row] for row in rows[start:end]], len(rows), next_cursor
+
+    @staticmethod
+    def _resume(keys: List[tuple], key: tuple, sort: str) -> int:
+        """Position after the cursor's row"""
+        start = bisect_right(keys, key)
+        if sort != "default" or (start and keys[start - 1] == key):
+            return start
+        # List order changed since the cursor was issued (a refresh): a row position
+        # means nothing now, so resume after the same commodity if it is still listed
+        for position, (_, name) in enumerate(keys):
+            if name == key[1]:
+                return position + 1
+        return start
+
+
+def project(prices: List[dict], fields: Optional[List[str]]) -> List[dict]:
+    if not fields:
+        return prices
+    return [{field: item.get(field) for field in fields} for item in prices]
@@ -0,0 +1,114 @@
+"""
+Cross-Market Price Matrix
+Commodity x location price matrix in a common unit (per quintal), with best/worst
+market and spread precomputed per commodity. Each refresh updates only the affected
+location's column and the summaries of the commodities it touched, so a comparison
+lookup is a single dict access.
+"""
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Multiplier converting a price per <unit> into a price per quintal (100 kg)
+UNIT_TO_QUINTAL = {
+    "quintal": 1.0,
+    "qtl": 1.0,
+    "kg": 100.0,
+    "ton": 0.1,
+    "tonne": 0.1,
+}
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_commodity(name: str) -> str:
+    """Canonical key for a commodity name: case-folded with collapsed whitespace"""
+    return _SPACES.sub(" ", name).strip().casefold()
+
+
+def price_per_quintal(price: float, unit: str) -> Optional[float]:
+    factor = UNIT_TO_QUINTAL.get(unit.strip().lower())
+    return None if factor is None else price * factor
+
+
+class PriceMatrix:
+    def __init__(self, capacity: int = 256):
+        self.locations: List[str] = []
+        self._location_col: Dict[str, int] = {}
+        self._commodity_row: Dict[str, int] = {}
+        self._row_keys: List[str] = []
+        self._display_names: Dict[str, str] = {}
+        self._values = np.full((capacity, 0), np.nan)
+        self._summaries: Dict[str, dict] = {}
+
+    def _column(self, location: str) -> int:
+        col = self._location_col.get(location)
+        if col is None:
+            col = len(self.locations)
+            self.locations.append(location)
+            self._location_col[location] = col
+            self._values = np.hstack([self._values, np.full((self._values.shape[0], 1), np.nan)])
+        return col
+
+    def _row(self, key: str) -> int:
+        row = self._commodity_row.get(key)
+        if row is None:
+            row = len(self._commodity_row)
+            if row >= self._values.shape[0]:
+                grown = np.full((self._values.shape[0] * 2, self._values.shape[1]), np.nan)
+                grown[:row] = self._values
+                self._values = grown
+            self._commodity_row[key] = row
+            self._row_keys.append(key)
+        return row
+
+    def update_location(self, location: str, prices: List[dict]):
+        """Replace one location's column with a fresh snapshot and re-summarize touched commodities"""
+        col = self._column(location)
+        touched = set()
+        previous_rows = np.flatnonzero(~np.isnan(self._values[:, col]))
+        self._values[:, col] = np.nan
+        for item in prices:
+            value = price_per_quintal(float(item["price"]), item.get("unit", "quintal"))
+            if value is None:
+                continue
+            # Catalog IDs merge aliases ("Tamatar", "Tomato"); untagged names fall back to the plain key
+            key = item.get("commodity_id") or normalize_commodity(item["commodity"])
+            self._display_names.setdefault(key, item["commodity"])
+            row = self._row(key)
+            self._values[row, col] = value
+            touched.add(row)
+        # Commodities that disappeared from this location also need new summaries
+        touched.update(previous_rows.tolist())
+        for row in touched:
+            self._summarize(self._row_keys[row], row)
+
+    def _summarize(self, key: str, row: int):
+        values = self._values[row, :len(self.locations)]
+        present = np.flatnonzero(~np.isnan(values))
+        if present.size == 0:
+            self._summaries.pop(key, None)
+            return
+        ordered = present[np.argsort(values[present])[::-1]]
+        best, worst = ordered[0], ordered[-1]
+        spread = values[best] - values[worst]
+        self._summaries[key] = {
+            "commodity": self._display_names[key],
+            "commodity_id": key,
+            "unit": "quintal",
+            "best_market": {"location": self.locations[best], "price": round(float(values[best]), 2)},
+            "worst_market": {"location": self.locations[worst], "price": round(float(values[worst]), 2)},
+            "spread": round(float(spread), 2),
+            "spread_percent": round(float(spread / values[worst] * 100), 2) if values[worst] else None,
+            "markets": [
+                {"location": self.locations[c], "price": round(float(values[c]), 2)} for c in ordered
+            ],
+        }
+
+    def compare(self, commodity: str) -> Optional[dict]:
+        """O(1) lookup of the precomputed comparison for one commodity (catalog ID or name)"""
+        return self._summaries.get(commodity) or self._summaries.get(normalize_commodity(commodity))
+
+    def all_comparisons(self) -> List[dict]:
+        return sorted(self._summaries.values(), key=lambda s: s["spread_percent"] or 0, reverse=True)
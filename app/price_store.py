@@ -0,0 +1,189 @@
+"""
+Market Price History Store
+Time-series store (SQLite) holding every scraped price snapshot, indexed on
+(location, commodity, date) so per-commodity range reads stay fast.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+MARKET_DB_PATH = os.getenv("MARKET_DB_PATH", "data/market_prices.db")
+
+# Changes smaller than this (percent) are reported as "stable"
+STABLE_THRESHOLD_PERCENT = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    location TEXT NOT NULL,
+    commodity TEXT NOT NULL,
+    date TEXT NOT NULL,
+    captured_at TEXT NOT NULL,
+    price REAL NOT NULL,
+    unit TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_price_location_commodity_date
+    ON price_snapshots (location, commodity, date, captured_at);
+"""
+
+
+def price_status(change: float) -> str:
+    if change >= STABLE_THRESHOLD_PERCENT:
+        return "up"
+    if change <= -STABLE_THRESHOLD_PERCENT:
+        return "down"
+    return "stable"
+
+
+class PriceStore:
+    """Thread-safe wrapper around a single SQLite connection"""
+
+    def __init__(self, path: str = MARKET_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and path != ":memory:":
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def version(self) -> tuple:
+        """
+        Changes whenever the stored data changes: local writes bump a counter and
+        commits from other connections (other workers) bump SQLite's data_version.
+        """
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return self._writes, data_version
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM price_snapshots LIMIT 1").fetchone() is None
+
+    def previous_prices(self, location: str, commodities: List[str]) -> Dict[str, float]:
+        """Latest stored price per commodity (the snapshot before the one being recorded)"""
+        result = {}
+        with self._lock:
+            for commodity in commodities:
+                row = self._conn.execute(
+                    "SELECT price FROM price_snapshots WHERE location = ? AND commodity = ? "
+                    "ORDER BY date DESC, captured_at DESC LIMIT 1",
+                    (location, commodity),
+                ).fetchone()
+                if row is not None:
+                    result[commodity] = row["price"]
+        return result
+
+    def record_snapshot(self, location: str, prices: List[dict], source: str,
+                        captured_at: Optional[datetime] = None) -> List[dict]:
+        """
+        Store a scraped snapshot and return the prices with change/status computed
+        against the previous stored snapshot of each commodity.
+        """
+        captured_at = captured_at or datetime.now(timezone.utc)
+        previous = self.previous_prices(location, [p["commodity"] for p in prices])
+
+        enriched = []
+        rows = []
+        for item in prices:
+            prev_price = previous.get(item["commodity"])
+            change = round((item["price"] - prev_price) / prev_price * 100, 1) if prev_price else 0.0
+            enriched.append({**item, "change": change, "status": price_status(change)})
+            rows.append((
+                location, item["commodity"], captured_at.date().isoformat(),
+                captured_at.isoformat(), item["price"], item["unit"], source,
+            ))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO price_snapshots (location, commodity, date, captured_at, price, unit, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._writes += 1
+        return enriched
+
+    def locations(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT location FROM price_snapshots").fetchall()
+        return [row["location"] for row in rows]
+
+    def last_captured(self, location: str) -> Optional[str]:
+        """ISO timestamp of the most recent snapshot for a location"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(captured_at) AS latest FROM price_snapshots WHERE location = ?", (location,)
+            ).fetchone()
+        return row["latest"] if row else None
+
+    def latest_date(self, location: str) -> Optional[date]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(date) AS latest FROM price_snapshots WHERE location = ?", (location,)
+            ).fetchone()
+        return date.fromisoformat(row["latest"]) if row and row["latest"] else None
+
+    def history(self, location: str, start: date, end: date,
+                commodity: Optional[str] = None) -> Dict[str, List[dict]]:
+        """
+        Daily closing prices per commodity in [start, end].
+        Uses the (location, commodity, date) index; the last snapshot of each day wins.
+        """
+        query = (
+            "SELECT commodity, date, price FROM price_snapshots "
+            "WHERE location = ? AND date BETWEEN ? AND ?"
+        )
+        params = [location, start.isoformat(), end.isoformat()]
+        if commodity is not None:
+            query += " AND commodity = ?"
+            params.append(commodity)
+        query += " ORDER BY commodity, date, captured_at"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        series: Dict[str, List[dict]] = {}
+        for row in rows:
+            points = series.setdefault(row["commodity"], [])
+            if points and points[-1]["date"] == row["date"]:
+                points[-1]["price"] = row["price"]
+            else:
+                points.append({"date": row["date"], "price": row["price"]})
+        return series
+
+    def seed_trends(self, trend_data: Dict[str, List[dict]], source: str = "seed"):
+        """Load the static weekly trend series so charts have history before the first scrape"""
+        rows = []
+        for location, trends in trend_data.items():
+            for trend in trends:
+                for point in trend["data"]:
+                    rows.append((
+                        location, trend["commodity"], point["date"],
+                        f"{point['date']}T00:00:00+00:00", point["price"], "quintal", source,
+                    ))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO price_snapshots (location, commodity, date, captured_at, price, unit, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._writes += 1
+        logging.info(f"Seeded price store with {len(rows)} trend points")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def window(latest: date, days: int) -> tuple:
+    """(start, end) dates covering the last `days` days up to `latest`"""
+    return latest - timedelta(days=days), latest
@@ -0,0 +1,54 @@
+"""
+Response Cache
+Keeps pre-serialized JSON bodies per (endpoint, key) together with the version of the
+data they were built from. Bodies are rebuilt only when that version changes and are
+served with a strong ETag so clients can revalidate with If-None-Match (304).
+"""
+import hashlib
+from typing import Callable, Dict, Hashable, Optional
+
+from fastapi import Request, Response
+
+
+class CachedBody:
+    __slots__ = ("version", "body", "etag")
+
+    def __init__(self, version: Hashable, body: bytes):
+        self.version = version
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class ResponseCache:
+    def __init__(self, cache_control: str = "no-cache"):
+        self.cache_control = cache_control
+        self._bodies: Dict[Hashable, CachedBody] = {}
+
+    def get(self, key: Hashable, version: Hashable, build: Callable[[], bytes]) -> CachedBody:
+        """Return the cached body for key, rebuilding it only if the data version changed"""
+        cached = self._bodies.get(key)
+        if cached is None or cached.version != version:
+            cached = CachedBody(version, build())
+            self._bodies[key] = cached
+        return cached
+
+    def respond(self, request: Request, cached: CachedBody) -> Response:
+        headers = {"ETag": cached.etag, "Cache-Control": self.cache_control}
+        if etag_matches(request.headers.get("if-none-match"), cached.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._bodies.clear()
+        else:
+            self._bodies.pop(key, None)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag == etag or tag == "W/" + etag for tag in candidates)
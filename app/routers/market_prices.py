@@ -1,14 +1,54 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
-import httpx
-import asyncio
-from bs4 import BeautifulSoup
-import re
+from typing import Dict, List, Optional
+import json
 import logging
+import re
+from datetime import datetime, timezone
+
+from app.commodity_catalog import catalog
+from app.market_cache import CacheUnavailable, StaleWhileRevalidateCache
+from app.market_scrapers import LOCATION_SOURCES, ScraperPool
+from app.market_refresher import MarketRefresher
+from app.price_analytics import PriceSeries, analysis_window, analyze
+from app.price_forecast import Forecaster
+from app.price_index import PRICE_FIELDS, SORT_ORDERS, CursorError, PriceIndex, project
+from app.price_matrix import PriceMatrix
+from app.price_store import PriceStore, price_status, window
+from app.response_cache import CachedBody, ResponseCache
 
 router = APIRouter()
 
+# Scraped prices keyed by (source, location); served from memory, refreshed in background
+price_cache = StaleWhileRevalidateCache()
+
+# Re-scrapes registered sources on a schedule; started in app lifespan
+refresher = MarketRefresher(price_cache)
+
+# Shared pooled HTTP client for all market scrapes; closed in app lifespan
+scraper_pool = ScraperPool()
+
+# Serialized response bodies per (endpoint, location, data version)
+response_cache = ResponseCache()
+
+# Cached forecast models per (location, commodity); batch-refit in app lifespan
+forecaster = Forecaster()
+
+# Commodity x location matrix for cross-market comparison; filled below from MOCK_DATA
+price_matrix = PriceMatrix()
+
+# Global price history store (singleton pattern)
+_price_store = None
+
+def get_price_store() -> PriceStore:
+    """Get or create the price history store, seeding it with TREND_DATA on first use"""
+    global _price_store
+    if _price_store is None:
+        _price_store = PriceStore()
+        if _price_store.is_empty():
+            _price_store.seed_trends(TREND_DATA)
+    return _price_store
+
 class PriceData(BaseModel):
     date: str
     price: float
@@ -19,6 +59,8 @@ class MarketPrice(BaseModel):
     unit: str
     change: float
     status: str
+    commodity_id: Optional[str] = None
+    category: Optional[str] = None
 
 class CommodityTrend(BaseModel):
     commodity: str
@@ -30,6 +72,10 @@ class MarketPricesResponse(BaseModel):
     location: str
     prices: List[MarketPrice]
     last_updated: str
+    stale: bool = False
+    source: str = "scraped"  # "mock" when the prices are the built-in sample data
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 class TrendResponse(BaseModel):
     location: str
@@ -151,6 +197,9 @@ MOCK_DATA = {
     ]
 }
 
+# MOCK_DATA is static, so its payloads are as old as the process
+MOCK_DATA_LOADED_AT = datetime.now(timezone.utc).isoformat()
+
 # Historical trend data for charts
 TREND_DATA = {
     "Punjab": [
@@ -299,135 +348,363 @@ TREND_DATA = {
     ]
 }
 
-async def scrape_punjab_prices() -> List[dict]:
-    """Scrape prices from Punjab vegetables price website"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://market.todaypricerates.com/Punjab-vegetables-price",
-                timeout=10.0,
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Failed to fetch data from source")
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Look for price tables or data containers
-            prices = []
-            
-            # Try to find price data in various possible structures
-            price_tables = soup.find_all(['table', 'div'], class_=re.compile(r'price|market|vegetable', re.I))
-            
-            for table in price_tables:
-                rows = table.find_all('tr') or table.find_all('div', class_=re.compile(r'row|item', re.I))
-                
-                for row in rows:
-                    cells = row.find_all(['td', 'th', 'div'])
-                    if len(cells) >= 2:
-                        try:
-                            commodity_text = cells[0].get_text(strip=True)
-                            price_text = cells[1].get_text(strip=True)
-                            
-                            # Extract price number
-                            price_match = re.search(r'[\d,]+', price_text.replace(',', ''))
-                            if price_match:
-                                price = float(price_match.group().replace(',', ''))
-                                
-                                # Determine unit
-                                unit = "quintal"
-                                if "kg" in price_text.lower():
-                                    unit = "kg"
-                                elif "ton" in price_text.lower():
-                                    unit = "ton"
-                                
-                                # Mock change percentage (in real implementation, this would be calculated)
-                                change = round((price * 0.02) * (1 if hash(commodity_text) % 2 == 0 else -1), 1)
-                                status = "up" if change > 0 else "down" if change < 0 else "stable"
-                                
-                                prices.append({
-                                    "commodity": commodity_text,
-                                    "price": price,
-                                    "unit": unit,
-                                    "change": change,
-                                    "status": status
-                                })
-                        except (ValueError, IndexError):
-                            continue
-            
-            # If no data found, return mock data
-            if not prices:
-                return MOCK_DATA["Punjab"]
-            
-            return prices[:10]  # Limit to 10 items
-            
-    except Exception as e:
-        logging.error(f"Error scraping Punjab prices: {e}")
-        return MOCK_DATA["Punjab"]
+def tag_commodities(prices: List[dict]) -> List[dict]:
+    """Attach the canonical catalog ID to each price item (None if the name is unknown)"""
+    for item in prices:
+        item["commodity_id"] = catalog.resolve(item["commodity"])
+    return prices
+
+def matching_commodities(commodity: str, names: List[str]) -> List[str]:
+    """Names (as stored) that resolve to the same catalog ID as the requested commodity"""
+    commodity_id = catalog.resolve(commodity)
+    if commodity_id is None:
+        return [name for name in names if name.casefold() == commodity.strip().casefold()]
+    return [name for name in names if catalog.resolve(name) == commodity_id]
+
+async def refresh_location_prices(location: str) -> PriceIndex:
+    """
+    Scrape a location over the shared scraper pool, store the snapshot and return an
+    index over the prices (with change/status vs. the previous snapshot).
+    Raises on failure so the cache can keep the last good result.
+    """
+    source, prices = await scraper_pool.scrape(location)
+    captured_at = datetime.now(timezone.utc)
+    enriched = tag_commodities(
+        get_price_store().record_snapshot(location, prices, source=source, captured_at=captured_at)
+    )
+    forecaster.observe(location, enriched, captured_at.date())
+    price_matrix.update_location(location, enriched)
+    return PriceIndex(enriched)
+
+def price_loader(location: str):
+    return lambda: refresh_location_prices(location)
+
+for _location in LOCATION_SOURCES:
+    refresher.register(("market", _location), price_loader(_location))
+
+# Query indexes over the mock price lists, built once at startup
+MOCK_INDEXES = {_location: PriceIndex(tag_commodities(_prices)) for _location, _prices in MOCK_DATA.items()}
+
+for _location, _prices in MOCK_DATA.items():
+    price_matrix.update_location(_location, _prices)
+
+# Words that make a message a price question; a crop name on its own is not one
+# ("pest on onion"). Devanagari words are matched without word boundaries.
+PRICE_QUERY = re.compile(
+    r"\b(?:prices?|rates?|bhaa?v|mandi|market|sell|selling|buy|cost|daam|keemat|kimat)\b|भाव|मंडी|दाम|कीमत|रेट"
+)
+
+def is_price_query(text: str) -> bool:
+    return PRICE_QUERY.search(text.lower()) is not None
+
+def commodity_price_reply(text: str, limit: int = 3) -> Optional[str]:
+    """Chatbot reply with cross-market prices for commodities mentioned in a message"""
+    lines = []
+    for commodity_id in catalog.find_in_text(text)[:limit]:
+        comparison = price_matrix.compare(commodity_id)
+        if comparison is None:
+            continue
+        best, worst = comparison["best_market"], comparison["worst_market"]
+        line = f"{catalog.display_name(commodity_id)}: ₹{best['price']:,.0f}/quintal in {best['location']}"
+        if worst["location"] != best["location"]:
+            line += f" (lowest ₹{worst['price']:,.0f} in {worst['location']})"
+        lines.append(line)
+    if not lines:
+        return None
+    return "💰 Market Prices:\n" + "\n".join(lines)
 
 @router.get("/market-prices", response_model=MarketPricesResponse)
 async def get_market_prices(
+    request: Request,
     location: str = Query(..., description="Location/State name"),
-    use_real_data: bool = Query(False, description="Whether to use real scraped data")
+    use_real_data: bool = Query(False, description="Whether to use real scraped data"),
+    commodity: Optional[str] = Query(None, description="Commodity name or alias (any language)"),
+    category: Optional[str] = Query(None, description="Commodity category, e.g. 'vegetables'"),
+    sort: str = Query("default", description="default, price, -price, change, -change or commodity"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Page size (all matches if omitted)"),
+    fields: Optional[str] = Query(None, description="Comma-separated price fields to return")
 ):
     """
-    Get market prices for a specific location
+    Get market prices for a specific location, optionally filtered, sorted, paginated
+    and projected to a subset of fields (served from per-location indexes).
+    Bodies are serialized once per data version and served with an ETag (304 on match).
     """
     try:
         # Normalize location name
         location_key = location.title()
         
-        # If Punjab and real data requested, try to scrape
-        if location_key == "Punjab" and use_real_data:
-            prices_data = await scrape_punjab_prices()
+        commodity_id = None
+        if commodity:
+            commodity_id = catalog.resolve(commodity)
+            if commodity_id is None:
+                raise HTTPException(status_code=404, detail=f"Unknown commodity: {commodity}")
+        if sort not in SORT_ORDERS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORT_ORDERS)}")
+        selected_fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        if selected_fields:
+            unknown = [f for f in selected_fields if f not in PRICE_FIELDS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        
+        stale = False
+        source = "mock"
+        last_updated = MOCK_DATA_LOADED_AT
+        version = ("mock",)
+        
+        # If real data requested, serve the cached scrape (refreshed in background)
+        if location_key in LOCATION_SOURCES and use_real_data:
+            try:
+                entry = await price_cache.get(("market", location_key), price_loader(location_key))
+                index = entry.value
+                stale = entry.stale
+                source = "scraped"
+                last_updated = datetime.fromtimestamp(entry.fetched_at, timezone.utc).isoformat()
+                version = ("scraped", entry.fetched_at, stale)
+            except Exception as e:
+                # Nothing has ever been scraped successfully for this key: sample data,
+                # flagged as such (a retry runs in the background, see price_cache)
+                if not isinstance(e, CacheUnavailable):
+                    logging.error(f"Error scraping {location_key} prices: {e}")
+                index = MOCK_INDEXES.get(location_key, MOCK_INDEXES["Punjab"])
+                stale = True
+                version = ("fallback",)
         else:
             # Use mock data for other locations or when real data not requested
-            prices_data = MOCK_DATA.get(location_key, MOCK_DATA["Punjab"])
+            index = MOCK_INDEXES.get(location_key, MOCK_INDEXES["Punjab"])
+        
+        category_name = None
+        if category:
+            category_name = index.category(category)
+            if category_name is None:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unknown category: {category}. Available: {', '.join(index.categories)}"
+                )
+        try:
+            page, total, next_cursor = index.query(commodity_id, category_name, sort, cursor, limit)
+        except CursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Convert to MarketPrice objects
-        prices = [MarketPrice(**price) for price in prices_data]
+        def build() -> bytes:
+            if selected_fields:
+                return json.dumps({
+                    "location": location_key,
+                    "prices": project(page, selected_fields),
+                    "last_updated": last_updated,
+                    "stale": stale,
+                    "source": source,
+                    "total": total,
+                    "next_cursor": next_cursor,
+                }, ensure_ascii=False, separators=(",", ":")).encode()
+            return MarketPricesResponse(
+                location=location_key,
+                prices=[MarketPrice(**price) for price in page],
+                last_updated=last_updated,
+                stale=stale,
+                source=source,
+                total=total,
+                next_cursor=next_cursor
+            ).model_dump_json().encode()
         
-        return MarketPricesResponse(
-            location=location_key,
-            prices=prices,
-            last_updated=str(asyncio.get_event_loop().time())
-        )
+        # Only the unfiltered list of a known location is cached, so arbitrary
+        # input (locations, cursors, field lists) can't grow the cache
+        filtered = any((commodity_id, category_name, sort != "default", cursor, limit, selected_fields))
+        if location_key in MOCK_DATA and not filtered:
+            cached = response_cache.get(("market-prices", location_key, version[0]), version, build)
+        else:
+            cached = CachedBody(version, build())
+        return response_cache.respond(request, cached)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error fetching market prices for {location}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch market prices: {str(e)}")
 
+# Chart colors for commodities, taken from the static trend series
+TREND_COLORS = {
+    trend["commodity"]: trend["color"]
+    for trends in TREND_DATA.values()
+    for trend in trends
+}
+FALLBACK_COLORS = ["#10B981", "#EF4444", "#F59E0B", "#3B82F6", "#8B5CF6", "#EC4899", "#14B8A6"]
+
+def trend_color(commodity: str) -> str:
+    if commodity in TREND_COLORS:
+        return TREND_COLORS[commodity]
+    return FALLBACK_COLORS[sum(map(ord, commodity)) % len(FALLBACK_COLORS)]
+
+def trend_direction(points: List[dict]) -> str:
+    """Overall direction of a series, using the same threshold as snapshot status"""
+    if len(points) < 2 or not points[0]["price"]:
+        return "stable"
+    change = (points[-1]["price"] - points[0]["price"]) / points[0]["price"] * 100
+    return price_status(change)
+
 @router.get("/market-prices/trends", response_model=TrendResponse)
 async def get_price_trends(
+    request: Request,
     location: str = Query(..., description="Location/State name"),
-    days: int = Query(7, description="Number of days for trend data")
+    days: int = Query(7, ge=1, le=730, description="Number of days for trend data")
 ):
     """
-    Get price trend data for charts
+    Get price trend data for charts over the last `days` days of stored history
+    (pre-serialized, ETag-aware)
     """
     try:
         # Normalize location name
         location_key = location.title()
         
-        # Get trend data for the location
-        trends_data = TREND_DATA.get(location_key, TREND_DATA["Punjab"])
+        store = get_price_store()
         
-        # Convert to CommodityTrend objects
-        trends = [CommodityTrend(**trend) for trend in trends_data]
+        def build() -> bytes:
+            # Read the trend window from the price history store
+            key = location_key
+            latest = store.latest_date(key)
+            if latest is None:
+                key = "Punjab"
+                latest = store.latest_date(key)
+            
+            trends = []
+            if latest is not None:
+                start, end = window(latest, days)
+                for commodity, points in store.history(key, start, end).items():
+                    trends.append(CommodityTrend(
+                        commodity=commodity,
+                        data=[PriceData(**point) for point in points],
+                        color=trend_color(commodity),
+                        trend=trend_direction(points)
+                    ))
+            
+            return TrendResponse(
+                location=location_key,
+                trends=trends,
+                last_updated=store.last_captured(key) or MOCK_DATA_LOADED_AT
+            ).model_dump_json().encode()
         
-        return TrendResponse(
-            location=location_key,
-            trends=trends,
-            last_updated=str(asyncio.get_event_loop().time())
-        )
+        if location_key in MOCK_DATA:
+            cached = response_cache.get(("trends", location_key, days), store.version(), build)
+        else:
+            cached = CachedBody(None, build())
+        return response_cache.respond(request, cached)
         
     except Exception as e:
         logging.error(f"Error fetching price trends for {location}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch price trends: {str(e)}")
 
+# Array-backed series per (location, days), rebuilt when the store version changes
+_series_cache: Dict[tuple, tuple] = {}
+
+def get_price_series(location_key: str, days: int) -> Optional[PriceSeries]:
+    store = get_price_store()
+    version = store.version()
+    cached = _series_cache.get((location_key, days))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    latest = store.latest_date(location_key)
+    if latest is None:
+        return None
+    start, end = analysis_window(latest, days)
+    series = PriceSeries.from_history(store.history(location_key, start, end), start, end)
+    _series_cache[(location_key, days)] = (version, series)
+    return series
+
+@router.get("/market-prices/analytics")
+async def get_price_analytics(
+    location: str = Query(..., description="Location/State name"),
+    days: int = Query(90, ge=2, le=730, description="Days of history to analyze"),
+    commodity: Optional[str] = Query(None, description="Limit to one commodity"),
+    sma: int = Query(7, ge=1, description="Simple moving average window (days)"),
+    ema: int = Query(14, ge=1, description="Exponential moving average span (days)"),
+    volatility: int = Query(14, ge=2, description="Rolling volatility window (days)"),
+    windows: str = Query("1,7,30", description="Comma-separated % change windows (days)")
+):
+    """
+    Moving averages, volatility, % change and monthly seasonal indices for every
+    commodity of a location, computed in one vectorized pass over the price history
+    """
+    try:
+        location_key = location.title()
+        if location_key not in MOCK_DATA:
+            location_key = "Punjab"
+        try:
+            change_windows = [int(w) for w in windows.split(",") if w.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="windows must be comma-separated integers")
+        # A w-day change needs w + 1 days of history
+        if any(w < 1 or w >= days for w in change_windows):
+            raise HTTPException(status_code=400, detail=f"windows must be between 1 and {days - 1} days")
+
+        series = get_price_series(location_key, days)
+        if series is None:
+            return {"location": location_key, "days": days, "analytics": []}
+        if commodity:
+            series = series.select(matching_commodities(commodity, series.commodities))
+        
+        return {
+            "location": location_key,
+            "days": days,
+            "start_date": str(series.dates[0]),
+            "end_date": str(series.dates[-1]),
+            "analytics": analyze(series, sma, ema, volatility, change_windows)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error computing price analytics for {location}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compute price analytics: {str(e)}")
+
+@router.get("/market-prices/forecast")
+async def get_price_forecast(
+    location: str = Query(..., description="Location/State name"),
+    commodity: Optional[str] = Query(None, description="Limit to one commodity"),
+    horizon: int = Query(7, ge=1, le=30, description="Days ahead to forecast")
+):
+    """
+    Short-horizon price forecast from cached models, with a sell-now / wait hint
+    """
+    try:
+        location_key = location.title()
+        if location_key not in MOCK_DATA:
+            location_key = "Punjab"
+        
+        # Models are normally fitted by the background batch job; fit on first use otherwise
+        if location_key not in forecaster.fitted_locations:
+            series = get_price_series(location_key, forecaster.history_days)
+            if series is not None:
+                forecaster.fit_series(location_key, series)
+        
+        commodities = sorted(c for (loc, c) in forecaster.models if loc == location_key)
+        if commodity:
+            commodities = matching_commodities(commodity, commodities)
+        forecasts = [f for f in (forecaster.forecast(location_key, c, horizon) for c in commodities) if f]
+        if commodity and not forecasts:
+            raise HTTPException(status_code=404, detail=f"No price history for {commodity} in {location_key}")
+        
+        return {"location": location_key, "horizon_days": horizon, "forecasts": forecasts}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error forecasting prices for {location}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to forecast prices: {str(e)}")
+
+@router.get("/market-prices/compare")
+async def compare_markets(
+    commodity: Optional[str] = Query(None, description="Commodity to compare across locations")
+):
+    """
+    Best/worst market and price spread for a commodity across all locations
+    (prices normalized to per quintal). Without a commodity, returns every
+    commodity sorted by spread.
+    """
+    if commodity:
+        comparison = price_matrix.compare(catalog.resolve(commodity) or commodity)
+        if comparison is None:
+            raise HTTPException(status_code=404, detail=f"No prices found for {commodity}")
+        return comparison
+    return {"locations": price_matrix.locations, "comparisons": price_matrix.all_comparisons()}
+
 @router.get("/market-prices/locations")
 async def get_available_locations():
     """
@@ -435,5 +712,6 @@ async def get_available_locations():
     """
     return {
         "locations": list(MOCK_DATA.keys()),
+        "categories": catalog.categories,
         "default_location": "Punjab"
     }
\ No newline at end of file
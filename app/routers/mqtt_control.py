@@ -2,13 +2,17 @@
 MQTT Relay Control Router
 Handles commands to control motor, HV generator, and HV auto mode via MQTT
 """
+import asyncio
+import threading
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from paho.mqtt import client as mqtt_client
 import os
 from dotenv import load_dotenv
 
+from app.mqtt_scheduler import CommandScheduler
+
 load_dotenv()
 
 router = APIRouter()
@@ -21,25 +25,48 @@ CLIENT_ID = "fastapi-mqtt-control"
 
 # Global MQTT client (singleton pattern)
 _mqtt_client = None
+# Commands publish from worker threads; only one of them may (re)connect
+_mqtt_lock = threading.Lock()
 
 def get_mqtt_client():
     """Get or create MQTT client singleton"""
     global _mqtt_client
-    if _mqtt_client is None or not _mqtt_client.is_connected():
-        try:
-            client = mqtt_client.Client(CLIENT_ID)
-            client.connect(BROKER, PORT, keepalive=60)
-            client.loop_start()
-            _mqtt_client = client
-            print(f"✅ MQTT client connected for relay control")
-        except Exception as e:
-            print(f"❌ Failed to connect MQTT client: {e}")
-            raise HTTPException(status_code=500, detail=f"MQTT connection failed: {str(e)}")
-    return _mqtt_client
+    with _mqtt_lock:
+        if _mqtt_client is None or not _mqtt_client.is_connected():
+            try:
+                client = mqtt_client.Client(CLIENT_ID)
+                client.connect(BROKER, PORT, keepalive=60)
+                client.loop_start()
+                _mqtt_client = client
+                print(f"✅ MQTT client connected for relay control")
+            except Exception as e:
+                print(f"❌ Failed to connect MQTT client: {e}")
+                raise HTTPException(status_code=500, detail=f"MQTT connection failed: {str(e)}")
+        return _mqtt_client
+
+def publish_command(command: str):
+    """Publish a raw relay command to the device topic (blocking; the scheduler runs it in a thread)"""
+    client = get_mqtt_client()
+    result = client.publish(TOPIC_PUB, command)
+    if result.rc != mqtt_client.MQTT_ERR_SUCCESS:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to publish MQTT command. Return code: {result.rc}"
+        )
+
+# Debounces/holds relay commands and runs timed schedules; started in app lifespan
+scheduler = CommandScheduler(publish=publish_command)
 
 class RelayCommand(BaseModel):
     command: str  # "motor:on", "motor:off", "hv:on", "hv:off", "hv_auto:on", "hv_auto:off"
 
+class ScheduleRequest(BaseModel):
+    device: str  # "motor", "hv", "hv_auto"
+    start_time: str  # "HH:MM" - device turned on
+    end_time: Optional[str] = None  # "HH:MM" - device turned off
+    days: Optional[List[int]] = None  # 0=Mon ... 6=Sun, None = every day
+    recurring: bool = True
+
 @router.post("/control")
 async def control_relay(command: RelayCommand):
     """
@@ -64,24 +91,23 @@ async def control_relay(command: RelayCommand):
                 detail=f"Invalid command. Valid commands: {', '.join(valid_commands)}"
             )
         
-        # Get MQTT client
-        client = get_mqtt_client()
-        
-        # Publish command
-        result = client.publish(TOPIC_PUB, command.command)
-        
-        if result.rc == mqtt_client.MQTT_ERR_SUCCESS:
-            return {
-                "success": True,
-                "message": f"Command '{command.command}' sent successfully",
-                "command": command.command,
-                "topic": TOPIC_PUB
-            }
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to publish MQTT command. Return code: {result.rc}"
-            )
+        # Route through the scheduler so redundant toggles are collapsed and
+        # minimum on/off durations are respected
+        outcome = await scheduler.submit(command.command)
+        messages = {
+            "sent": f"Command '{command.command}' sent successfully",
+            "collapsed": f"Command '{command.command}' collapsed (already applied)",
+            "deferred": f"Command '{command.command}' deferred until minimum duration elapses",
+            "cancelled": f"Command '{command.command}' cancelled pending '{outcome.get('cancelled')}'",
+        }
+        return {
+            "success": True,
+            "message": messages[outcome["action"]],
+            "command": command.command,
+            "topic": TOPIC_PUB,
+            "action": outcome["action"],
+            "fire_at": outcome.get("fire_at")
+        }
             
     except HTTPException:
         raise
@@ -95,14 +121,15 @@ async def control_relay(command: RelayCommand):
 async def get_mqtt_status():
     """Get MQTT connection status"""
     try:
-        client = get_mqtt_client()
+        client = await asyncio.to_thread(get_mqtt_client)
         is_connected = client.is_connected()
         return {
             "connected": is_connected,
             "broker": BROKER,
             "port": PORT,
             "topic": TOPIC_PUB,
-            "client_id": CLIENT_ID
+            "client_id": CLIENT_ID,
+            "devices": scheduler.device_states()
         }
     except Exception as e:
         return {
@@ -113,3 +140,32 @@ async def get_mqtt_status():
             "topic": TOPIC_PUB
         }
 
+@router.get("/schedules")
+async def list_schedules():
+    """List relay schedules with their next run time"""
+    return {"schedules": scheduler.list_schedules()}
+
+@router.post("/schedules")
+async def create_schedule(request: ScheduleRequest):
+    """
+    Create a relay schedule, e.g. irrigate daily:
+    {"device": "motor", "start_time": "06:00", "end_time": "06:20"}
+    """
+    try:
+        schedule = scheduler.add_schedule(
+            device=request.device,
+            start_time=request.start_time,
+            end_time=request.end_time,
+            days=request.days,
+            recurring=request.recurring
+        )
+        return {"success": True, "schedule": schedule}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/schedules/{schedule_id}")
+async def delete_schedule(schedule_id: str):
+    """Delete a relay schedule"""
+    if not scheduler.remove_schedule(schedule_id):
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return {"success": True, "deleted": schedule_id}
@@ -1,76 +1,123 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from typing import List, Dict, Any
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from typing import List, Dict, Any, Optional
 import base64
 import json
+import os
+
+from app.image_cache import ImageResultCache
+from app.image_executor import MicroBatcher
+from app.image_upload import stage_upload
+from app.pest_catalog import pest_catalog
+from app.pest_vision import PEST_MODEL_VERSION, detect_pests_batch, detect_pests_tiled
 
 router = APIRouter()
 
+# Concurrent uploads are detected together: a batch goes to a worker when this many
+# are waiting, or this long after the first one arrived (the added latency ceiling)
+PEST_BATCH_SIZE = int(os.getenv("PEST_BATCH_SIZE", "16"))
+PEST_BATCH_WAIT_MS = float(os.getenv("PEST_BATCH_WAIT_MS", "10"))
+
+detector = MicroBatcher(detect_pests_batch, max_batch=PEST_BATCH_SIZE, max_wait=PEST_BATCH_WAIT_MS / 1000)
+
+# Detections keyed by image content hash + model and catalog version (resent photos skip
+# decoding; results embed catalog text, so editing the catalog invalidates them too)
+RESULT_VERSION = f"{PEST_MODEL_VERSION}+{pest_catalog.version}"
+detection_cache = ImageResultCache("pest", RESULT_VERSION)
+tiled_detection_cache = ImageResultCache("pest-tiled", RESULT_VERSION)
+
+# "whole": the photo is resized to one model input (close-ups of a leaf);
+# "tiled": overlapping full-detail tiles over the leaf area (field photos, small insects)
+DETECTION_MODES = ("whole", "tiled")
+
 @router.post("/detect")
-async def detect_pest(file: UploadFile = File(...)):
+async def detect_pest(file: UploadFile = File(...), mode: str = Form("whole")):
     """Detect pests from uploaded image"""
     try:
-        # Read image file
-        contents = await file.read()
+        if mode not in DETECTION_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}'; use one of {', '.join(DETECTION_MODES)}")
+        
+        # Stream the upload to a temp file (size-capped, hashed on the way)
+        async with await stage_upload(file) as upload:
+            if mode == "tiled":
+                # One photo is already a batch of tiles; runs in the shared process pool on a miss
+                result = await tiled_detection_cache.get_or_compute(upload.sha256, upload.path, detect_pests_tiled)
+            else:
+                # Cached by content hash; on a miss the photo joins the next detection batch,
+                # decoded and run through the model in the shared process pool
+                result = await detection_cache.get_or_compute(upload.sha256, upload.path, detector.submit)
         
-        # Mock pest detection result
         mock_result = {
-            "detected_pests": [
-                {
-                    "name": "Aphids",
-                    "confidence": 0.85,
-                    "description": "Small sap-sucking insects",
-                    "treatment": "Use neem oil spray or insecticidal soap",
-                    "severity": "Medium"
-                }
-            ],
-            "recommendations": [
-                "Apply neem oil treatment",
-                "Monitor plant health daily",
-                "Consider introducing beneficial insects"
-            ],
-            "image_processed": True
+            "detected_pests": result["detected_pests"],
+            "recommendations": result["recommendations"],
+            "plant_status": result["plant_status"],
+            "image_processed": True,
+            "mode": mode,
+            "model_version": result["model_version"]
         }
+        if "tiles" in result:
+            mock_result["tiles"] = result["tiles"]
         
         return mock_result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/pests")
-async def list_pests():
-    """List all known pests"""
+async def list_pests(
+    crop: Optional[str] = Query(None, description="Crop name, or its market name in any language"),
+    symptoms: Optional[str] = Query(None, description="What the plant shows, e.g. 'yellow curled leaves, sticky'"),
+    pest_type: Optional[str] = Query(None, alias="type", description="insect, fungus, virus, bacterium, mite, nematode, ..."),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Max pests to return (all matches if omitted)")
+):
+    """List known pests, optionally for one crop, of one type, or ranked by matching symptoms"""
     try:
-        pests = [
-            {
-                "id": 1,
-                "name": "Aphids",
-                "description": "Small sap-sucking insects",
-                "common_crops": ["Tomato", "Pepper", "Cabbage"],
-                "treatment": "Neem oil, insecticidal soap"
-            },
-            {
-                "id": 2,
-                "name": "Whiteflies",
-                "description": "Small white flying insects",
-                "common_crops": ["Tomato", "Cucumber", "Eggplant"],
-                "treatment": "Yellow sticky traps, neem oil"
-            }
-        ]
-        return {"pests": pests}
+        crop_key = None
+        if crop:
+            crop_key = pest_catalog.crop_key(crop)
+            if crop_key is None:
+                raise HTTPException(status_code=404, detail=f"No pests listed for crop: {crop}")
+        if pest_type and pest_type not in pest_catalog.types:
+            raise HTTPException(status_code=400, detail=f"Unknown type: {pest_type}. Available: {', '.join(pest_catalog.types)}")
+        
+        if symptoms:
+            matches = pest_catalog.search_symptoms(symptoms, crop_key, pest_type)
+            pests = [
+                {**pest_catalog.summary(pest_id), "score": score, "matched_symptoms": words}
+                for pest_id, score, words in matches[:limit]
+            ]
+            total = len(matches)
+        else:
+            if crop_key:
+                pest_ids = pest_catalog.for_crop(crop_key)
+                if pest_type:
+                    pest_ids = [p for p in pest_ids if pest_catalog.get(p)["type"] == pest_type]
+            elif pest_type:
+                pest_ids = pest_catalog.of_type(pest_type)
+            else:
+                pest_ids = list(pest_catalog.entries)
+            pests = [pest_catalog.summary(pest_id) for pest_id in pest_ids[:limit]]
+            total = len(pest_ids)
+        
+        return {
+            "pests": pests,
+            "total": total,
+            "crop": pest_catalog.crop_name(crop_key) if crop_key else None,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/pest/{pest_name}")
 async def get_pest_info(pest_name: str):
-    """Get detailed information about a specific pest"""
+    """Get detailed information about a specific pest (by ID, name or local name)"""
     try:
-        pest_info = {
-            "name": pest_name,
-            "description": "Detailed pest information",
-            "lifecycle": "Egg -> Nymph -> Adult",
-            "damage_symptoms": "Yellowing leaves, stunted growth",
-            "prevention": "Regular monitoring, proper spacing",
-            "treatment": "Organic pesticides, beneficial insects"
-        }
-        return pest_info
+        pest_id = pest_catalog.resolve(pest_name)
+        if pest_id is None:
+            raise HTTPException(status_code=404, detail=f"Unknown pest: {pest_name}")
+        return pest_catalog.get(pest_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,12 +1,35 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
+import asyncio
 import base64
 import json
-import random
+import os
+import shutil
+import tempfile
+import time
 from datetime import datetime
 
+import numpy as np
+
+from app.image_cache import ImageResultCache
+from app.image_executor import image_executor, run_image_task
+from app.image_upload import (
+    MAX_BATCH_IMAGES, MAX_BATCH_UPLOAD_BYTES, UPLOAD_TMP_DIR, StagedUpload, extract_zip_images, stage_upload,
+)
+from app.soil_recommendations import crop_suitability, encode_state, soil_advice
+from app.soil_vision import SOIL_MODEL_VERSION, SOIL_TYPES, analyze_soil_batch, analyze_soil_image
+
 router = APIRouter()
 
+# Analyses keyed by image content hash + model version (resent photos skip decoding)
+analysis_cache = ImageResultCache("soil", SOIL_MODEL_VERSION)
+
+# Images per worker task in batch analysis (decoded one by one, featurized in small stacks)
+SOIL_BATCH_CHUNK = int(os.getenv("SOIL_BATCH_CHUNK", "16"))
+# pH histogram bin edges for survey summaries
+PH_HISTOGRAM_EDGES = np.arange(5.0, 8.01, 0.5)
+
 @router.post("/analyze")
 async def analyze_soil(
     file: UploadFile = File(...),
@@ -15,55 +38,18 @@ async def analyze_soil(
 ):
     """Analyze soil from uploaded image with comprehensive recommendations"""
     try:
-        # Read image file
-        contents = await file.read()
-        
-        # Simulate AI analysis based on image characteristics
-        # In a real implementation, this would use computer vision models
-        image_size = len(contents)
-        
-        # Generate realistic soil analysis based on image characteristics
-        soil_types = ["Sandy Loam", "Clay Loam", "Silty Clay", "Sandy Clay", "Loamy Sand", "Silt Loam"]
-        soil_type = random.choice(soil_types)
-        
-        # Generate pH based on soil type
-        ph_ranges = {
-            "Sandy Loam": (6.0, 7.5),
-            "Clay Loam": (5.5, 7.0),
-            "Silty Clay": (6.5, 8.0),
-            "Sandy Clay": (5.0, 6.5),
-            "Loamy Sand": (6.2, 7.8),
-            "Silt Loam": (6.0, 7.2)
-        }
-        
-        ph_min, ph_max = ph_ranges.get(soil_type, (6.0, 7.0))
-        ph_level = round(random.uniform(ph_min, ph_max), 1)
-        
-        # Generate nutrient levels
-        nutrients = {
-            "nitrogen": random.choice(["Low", "Medium", "High"]),
-            "phosphorus": random.choice(["Low", "Medium", "High"]),
-            "potassium": random.choice(["Low", "Medium", "High"]),
-            "organic_matter": random.choice(["Poor", "Fair", "Good", "Excellent"]),
-            "calcium": random.choice(["Low", "Medium", "High"]),
-            "magnesium": random.choice(["Low", "Medium", "High"]),
-            "sulfur": random.choice(["Low", "Medium", "High"])
-        }
+        # Stream the upload to a temp file (size-capped, hashed on the way)
+        async with await stage_upload(file) as upload:
+            # Deterministic image analysis (Munsell-like color + texture features -> classifier),
+            # cached by content hash and run in the shared process pool on a miss
+            analysis = await analysis_cache.get_or_compute(upload.sha256, upload.path, analyze_soil_image)
         
-        # Generate detailed recommendations
-        recommendations = generate_soil_recommendations(soil_type, ph_level, nutrients, crop_type)
+        soil_type = analysis["soil_type"]
+        ph_level = analysis["ph_level"]
+        nutrients = analysis["nutrients"]
         
-        # Generate crop suitability
-        crop_suitability = generate_crop_suitability(soil_type, ph_level, nutrients)
-        
-        # Generate fertilizer recommendations
-        fertilizer_recommendations = generate_fertilizer_recommendations(nutrients, soil_type)
-        
-        # Generate pest and disease prevention
-        pest_prevention = generate_pest_prevention_recommendations(soil_type, nutrients)
-        
-        # Generate cultivation methods
-        cultivation_methods = generate_cultivation_methods(soil_type, nutrients)
+        # Recommendations are precompiled per soil state (type, pH band, nutrient levels)
+        advice = soil_advice(encode_state(soil_type, ph_level, nutrients))
         
         mock_result = {
             "analysis_id": f"SOIL_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
@@ -72,320 +58,161 @@ async def analyze_soil(
             "crop_type": crop_type or "General",
             "soil_type": soil_type,
             "ph_level": ph_level,
-            "ph_status": get_ph_status(ph_level),
+            "ph_status": advice["ph_status"],
             "nutrients": nutrients,
-            "soil_health_score": calculate_soil_health_score(nutrients, ph_level),
-            "recommendations": recommendations,
-            "crop_suitability": crop_suitability,
-            "fertilizer_recommendations": fertilizer_recommendations,
-            "pest_prevention": pest_prevention,
-            "cultivation_methods": cultivation_methods,
-            "irrigation_needs": get_irrigation_needs(soil_type),
+            "soil_health_score": advice["soil_health_score"],
+            "recommendations": advice["recommendations"],
+            "crop_suitability": crop_suitability(soil_type, ph_level),
+            "fertilizer_recommendations": advice["fertilizer_recommendations"],
+            "pest_prevention": advice["pest_prevention"],
+            "cultivation_methods": advice["cultivation_methods"],
+            "irrigation_needs": advice["irrigation_needs"],
+            "soil_color": analysis["color"],
             "image_processed": True,
-            "confidence_score": round(random.uniform(85, 95), 1)
+            "confidence_score": analysis["confidence_score"],
+            "model_version": analysis["model_version"]
         }
         
         return mock_result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_ph_status(ph_level: float) -> str:
-    """Determine pH status"""
-    if ph_level < 6.0:
-        return "Acidic"
-    elif ph_level > 8.0:
-        return "Alkaline"
-    else:
-        return "Neutral"
+@router.post("/analyze/batch")
+async def analyze_soil_batch_upload(
+    files: List[UploadFile] = File([]),
+    archive: Optional[UploadFile] = File(None),
+    location: Optional[str] = Form(None)
+):
+    """
+    Analyze a field survey: many soil photos as repeated `files` fields and/or one zip
+    `archive`. Streams NDJSON: one {"type": "image"} line per photo as its analysis
+    completes (in completion order, with its upload `index`), then a {"type": "summary"}
+    line with the soil-type distribution and pH histogram.
+    """
+    if len(files) > MAX_BATCH_IMAGES:
+        raise HTTPException(status_code=413, detail=f"More than {MAX_BATCH_IMAGES} images in one batch")
 
-def calculate_soil_health_score(nutrients: Dict, ph_level: float) -> int:
-    """Calculate overall soil health score"""
-    score = 0
-    
-    # pH score (0-30 points)
-    if 6.0 <= ph_level <= 7.5:
-        score += 30
-    elif 5.5 <= ph_level <= 8.0:
-        score += 20
-    else:
-        score += 10
-    
-    # Nutrient scores (0-10 points each)
-    nutrient_scores = {"Low": 3, "Medium": 7, "High": 10}
-    organic_scores = {"Poor": 2, "Fair": 5, "Good": 8, "Excellent": 10}
-    
-    for nutrient, level in nutrients.items():
-        if nutrient == "organic_matter":
-            score += organic_scores.get(level, 5)
-        else:
-            score += nutrient_scores.get(level, 5)
-    
-    return min(score, 100)
+    directory = tempfile.mkdtemp(prefix="survey-", dir=UPLOAD_TMP_DIR)
+    try:
+        uploads: List[StagedUpload] = []
+        for file in files:
+            uploads.append(await stage_upload(file, directory=directory))
+        if archive is not None:
+            bundle = await stage_upload(archive, max_bytes=MAX_BATCH_UPLOAD_BYTES, directory=directory)
+            uploads.extend(await asyncio.to_thread(
+                extract_zip_images, bundle.path, directory, MAX_BATCH_IMAGES - len(uploads)))
+            bundle.discard()
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No images in the upload")
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
 
-def generate_soil_recommendations(soil_type: str, ph_level: float, nutrients: Dict, crop_type: Optional[str]) -> List[Dict]:
-    """Generate comprehensive soil recommendations"""
-    recommendations = []
-    
-    # pH recommendations
-    if ph_level < 6.0:
-        recommendations.append({
-            "category": "pH Management",
-            "priority": "High",
-            "recommendation": "Soil is acidic. Add lime to raise pH",
-            "action": f"Apply 2-4 kg of agricultural lime per 100 sq m",
-            "timeline": "Apply 2-4 weeks before planting"
-        })
-    elif ph_level > 8.0:
-        recommendations.append({
-            "category": "pH Management", 
-            "priority": "High",
-            "recommendation": "Soil is alkaline. Add sulfur to lower pH",
-            "action": f"Apply 1-2 kg of elemental sulfur per 100 sq m",
-            "timeline": "Apply 3-6 months before planting"
-        })
-    
-    # Nutrient recommendations
-    for nutrient, level in nutrients.items():
-        if level == "Low":
-            recommendations.append({
-                "category": f"{nutrient.title()} Management",
-                "priority": "High",
-                "recommendation": f"{nutrient.title()} levels are low",
-                "action": f"Apply {nutrient}-rich fertilizer or organic amendments",
-                "timeline": "Apply before planting and during growth season"
-            })
-    
-    # Soil type specific recommendations
-    if "Clay" in soil_type:
-        recommendations.append({
-            "category": "Soil Structure",
-            "priority": "Medium",
-            "recommendation": "Improve drainage and aeration",
-            "action": "Add organic matter and sand to improve structure",
-            "timeline": "Apply annually during off-season"
-        })
-    elif "Sandy" in soil_type:
-        recommendations.append({
-            "category": "Water Retention",
-            "priority": "Medium", 
-            "recommendation": "Improve water retention",
-            "action": "Add compost and organic matter to increase water holding capacity",
-            "timeline": "Apply before each planting season"
-        })
-    
-    return recommendations
+    return StreamingResponse(stream_survey(uploads, directory, location), media_type="application/x-ndjson")
 
-def generate_crop_suitability(soil_type: str, ph_level: float, nutrients: Dict) -> List[Dict]:
-    """Generate crop suitability recommendations"""
-    crops = []
-    
-    # Define crop preferences
-    crop_preferences = {
-        "Sandy Loam": ["Carrots", "Potatoes", "Sweet Potatoes", "Radishes", "Onions"],
-        "Clay Loam": ["Rice", "Wheat", "Corn", "Soybeans", "Cotton"],
-        "Silty Clay": ["Rice", "Wheat", "Barley", "Oats", "Rye"],
-        "Sandy Clay": ["Peanuts", "Sweet Potatoes", "Watermelons", "Cantaloupes"],
-        "Loamy Sand": ["Tomatoes", "Peppers", "Eggplant", "Squash", "Cucumbers"],
-        "Silt Loam": ["Lettuce", "Spinach", "Broccoli", "Cabbage", "Cauliflower"]
-    }
-    
-    suitable_crops = crop_preferences.get(soil_type, ["Tomatoes", "Peppers", "Lettuce"])
-    
-    for crop in suitable_crops[:5]:  # Top 5 crops
-        suitability_score = random.randint(75, 95)
-        crops.append({
-            "crop_name": crop,
-            "suitability_score": suitability_score,
-            "suitability_level": "Excellent" if suitability_score >= 90 else "Good" if suitability_score >= 80 else "Fair",
-            "reason": f"Well-suited for {soil_type} soil with pH {ph_level}",
-            "planting_season": random.choice(["Spring", "Summer", "Fall", "Year-round"]),
-            "expected_yield": f"{random.randint(80, 120)}% of optimal"
-        })
-    
-    return crops
+async def stream_survey(uploads: List[StagedUpload], directory: str, location: Optional[str]):
+    """NDJSON lines for a staged batch; removes the staged files when done or disconnected"""
+    started = time.perf_counter()
+    analyses: List[Optional[Dict]] = [None] * len(uploads)
+    tasks: List[asyncio.Task] = []
+    try:
+        # Cache hits go out first; the rest is analyzed once per distinct photo
+        by_hash: Dict[str, List[int]] = {}
+        for index, upload in enumerate(uploads):
+            cached = analysis_cache.lookup(upload.sha256)
+            if cached is not None:
+                analyses[index] = cached
+                yield survey_line(index, upload, cached, cached=True)
+            else:
+                by_hash.setdefault(upload.sha256, []).append(index)
 
-def generate_fertilizer_recommendations(nutrients: Dict, soil_type: str) -> List[Dict]:
-    """Generate fertilizer recommendations"""
-    fertilizers = []
-    
-    # NPK recommendations based on nutrient levels
-    if nutrients["nitrogen"] == "Low":
-        fertilizers.append({
-            "type": "Nitrogen Fertilizer",
-            "product": "Urea (46-0-0) or Ammonium Nitrate (34-0-0)",
-            "application_rate": "50-75 kg per hectare",
-            "timing": "Split application: 50% at planting, 50% during growth",
-            "method": "Broadcast or side-dress",
-            "cost_estimate": "₹800-1200 per hectare"
-        })
-    
-    if nutrients["phosphorus"] == "Low":
-        fertilizers.append({
-            "type": "Phosphorus Fertilizer", 
-            "product": "DAP (18-46-0) or Superphosphate (0-20-0)",
-            "application_rate": "40-60 kg per hectare",
-            "timing": "Apply at planting or before planting",
-            "method": "Band placement near seeds",
-            "cost_estimate": "₹600-900 per hectare"
-        })
-    
-    if nutrients["potassium"] == "Low":
-        fertilizers.append({
-            "type": "Potassium Fertilizer",
-            "product": "Muriate of Potash (0-0-60) or Sulphate of Potash (0-0-50)",
-            "application_rate": "30-50 kg per hectare", 
-            "timing": "Apply at planting",
-            "method": "Broadcast and incorporate",
-            "cost_estimate": "₹400-700 per hectare"
-        })
-    
-    # Organic recommendations
-    if nutrients["organic_matter"] in ["Poor", "Fair"]:
-        fertilizers.append({
-            "type": "Organic Matter",
-            "product": "Compost, Farmyard Manure, or Green Manure",
-            "application_rate": "10-15 tons per hectare",
-            "timing": "Apply 2-4 weeks before planting",
-            "method": "Spread evenly and incorporate",
-            "cost_estimate": "₹2000-4000 per hectare"
-        })
-    
-    return fertilizers
+        # Chunks go to the shared image pool, at most one per worker at a time so single
+        # /analyze requests still get through during a large survey
+        limit = asyncio.Semaphore(max(1, image_executor.workers))
+        pending = list(by_hash)
 
-def generate_pest_prevention_recommendations(soil_type: str, nutrients: Dict) -> List[Dict]:
-    """Generate pest and disease prevention recommendations"""
-    prevention = []
-    
-    # General soil health recommendations
-    prevention.append({
-        "category": "Soil Health",
-        "recommendation": "Maintain balanced soil nutrients",
-        "action": "Regular soil testing and balanced fertilization",
-        "benefit": "Healthy plants resist pests and diseases better"
-    })
-    
-    # pH-related pest prevention
-    if nutrients.get("ph_level", 7) < 6.0:
-        prevention.append({
-            "category": "pH Management",
-            "recommendation": "Correct acidic soil",
-            "action": "Apply lime to raise pH to 6.5-7.0",
-            "benefit": "Reduces fungal diseases and improves nutrient availability"
-        })
-    
-    # Soil type specific recommendations
-    if "Clay" in soil_type:
-        prevention.append({
-            "category": "Drainage",
-            "recommendation": "Improve soil drainage",
-            "action": "Add organic matter and create raised beds",
-            "benefit": "Prevents root rot and fungal diseases"
-        })
-    
-    # Organic matter recommendations
-    if nutrients["organic_matter"] in ["Poor", "Fair"]:
-        prevention.append({
-            "category": "Organic Matter",
-            "recommendation": "Increase organic matter content",
-            "action": "Add compost, manure, or cover crops",
-            "benefit": "Improves soil structure and beneficial microorganism activity"
-        })
-    
-    # Crop rotation recommendations
-    prevention.append({
-        "category": "Crop Rotation",
-        "recommendation": "Practice crop rotation",
-        "action": "Rotate crops from different families every 2-3 years",
-        "benefit": "Breaks pest and disease cycles naturally"
-    })
-    
-    return prevention
+        async def analyze_chunk(hashes: List[str]):
+            async with limit:
+                paths = [uploads[by_hash[h][0]].path for h in hashes]
+                try:
+                    return hashes, await run_image_task(analyze_soil_batch, paths)
+                except HTTPException as e:
+                    return hashes, [{"error": e.detail}] * len(hashes)
+
+        # Small enough that every worker gets a share, large enough to amortize the round trip
+        size = max(1, min(SOIL_BATCH_CHUNK, -(-len(pending) // max(1, image_executor.workers))))
+        tasks = [asyncio.create_task(analyze_chunk(pending[i:i + size])) for i in range(0, len(pending), size)]
+        for next_done in asyncio.as_completed(tasks):
+            hashes, results = await next_done
+            for content_hash, result in zip(hashes, results):
+                if "error" not in result:
+                    analysis_cache.store(content_hash, result)
+                for index in by_hash[content_hash]:
+                    analyses[index] = result
+                    yield survey_line(index, uploads[index], result, cached=False)
 
-def generate_cultivation_methods(soil_type: str, nutrients: Dict) -> List[Dict]:
-    """Generate cultivation method recommendations"""
-    methods = []
-    
-    # Tillage recommendations
-    if "Clay" in soil_type:
-        methods.append({
-            "method": "Deep Tillage",
-            "description": "Deep plowing to break up compacted clay layers",
-            "timing": "During dry season when soil is workable",
-            "depth": "15-20 cm",
-            "frequency": "Once per year before planting"
+        summary = summarize_survey([a for a in analyses if a is not None])
+        summary.update({
+            "type": "summary",
+            "location": location or "Unknown",
+            "model_version": SOIL_MODEL_VERSION,
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
         })
+        yield json.dumps(summary) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def survey_line(index: int, upload: StagedUpload, analysis: Dict, cached: bool) -> str:
+    """One NDJSON line for an analyzed (or unreadable) survey photo"""
+    line = {"type": "image", "index": index, "filename": upload.filename}
+    if "error" in analysis:
+        line.update({"status": "error", "detail": analysis["error"]})
     else:
-        methods.append({
-            "method": "Shallow Tillage",
-            "description": "Light cultivation to prepare seedbed",
-            "timing": "1-2 weeks before planting",
-            "depth": "8-12 cm", 
-            "frequency": "Before each planting"
-        })
-    
-    # Planting recommendations
-    methods.append({
-        "method": "Seedbed Preparation",
-        "description": "Create fine, well-drained seedbed",
-        "timing": "After tillage, before planting",
-        "depth": "2-3 cm for most crops",
-        "frequency": "Before each planting"
-    })
-    
-    # Mulching recommendations
-    if "Sandy" in soil_type:
-        methods.append({
-            "method": "Mulching",
-            "description": "Apply organic mulch to conserve moisture",
-            "timing": "After planting and emergence",
-            "depth": "5-8 cm layer",
-            "frequency": "Maintain throughout growing season"
+        advice = soil_advice(encode_state(analysis["soil_type"], analysis["ph_level"], analysis["nutrients"]))
+        line.update({
+            "status": "ok",
+            "soil_type": analysis["soil_type"],
+            "ph_level": analysis["ph_level"],
+            "ph_status": advice["ph_status"],
+            "nutrients": analysis["nutrients"],
+            "soil_health_score": advice["soil_health_score"],
+            "soil_color": analysis["color"],
+            "confidence_score": analysis["confidence_score"],
+            "cached": cached,
         })
-    
-    return methods
+    return json.dumps(line) + "\n"
 
-def get_irrigation_needs(soil_type: str) -> Dict:
-    """Get irrigation recommendations based on soil type"""
-    irrigation_needs = {
-        "Sandy Loam": {
-            "frequency": "Every 2-3 days",
-            "amount": "15-20 mm per application",
-            "method": "Drip irrigation or frequent light watering",
-            "total_seasonal": "400-600 mm"
+def summarize_survey(analyses: List[Dict]) -> Dict:
+    """Survey-level aggregate: soil-type distribution, pH histogram and averages"""
+    ok = [a for a in analyses if "error" not in a]
+    counts = {soil_type: 0 for soil_type in SOIL_TYPES}
+    for analysis in ok:
+        counts[analysis["soil_type"]] += 1
+    ph = np.array([a["ph_level"] for a in ok], dtype=float)
+    histogram, edges = np.histogram(np.clip(ph, PH_HISTOGRAM_EDGES[0], PH_HISTOGRAM_EDGES[-1]),
+                                    bins=PH_HISTOGRAM_EDGES)
+    return {
+        "images": len(analyses),
+        "analyzed": len(ok),
+        "failed": len(analyses) - len(ok),
+        "soil_type_distribution": {
+            soil_type: {"count": count, "percent": round(100.0 * count / len(ok), 1) if ok else 0.0}
+            for soil_type, count in sorted(counts.items(), key=lambda item: -item[1]) if count
         },
-        "Clay Loam": {
-            "frequency": "Every 5-7 days", 
-            "amount": "25-30 mm per application",
-            "method": "Flood irrigation or sprinkler",
-            "total_seasonal": "300-500 mm"
-        },
-        "Silty Clay": {
-            "frequency": "Every 4-6 days",
-            "amount": "20-25 mm per application", 
-            "method": "Sprinkler or flood irrigation",
-            "total_seasonal": "350-550 mm"
-        },
-        "Sandy Clay": {
-            "frequency": "Every 3-4 days",
-            "amount": "18-22 mm per application",
-            "method": "Drip irrigation preferred",
-            "total_seasonal": "450-650 mm"
-        },
-        "Loamy Sand": {
-            "frequency": "Every 2-3 days",
-            "amount": "15-20 mm per application",
-            "method": "Drip irrigation or frequent watering",
-            "total_seasonal": "400-600 mm"
-        },
-        "Silt Loam": {
-            "frequency": "Every 4-5 days",
-            "amount": "20-25 mm per application",
-            "method": "Sprinkler irrigation",
-            "total_seasonal": "350-500 mm"
-        }
+        "dominant_soil_type": max(counts, key=counts.get) if ok else None,
+        "ph_histogram": [
+            {"range": f"{low:.1f}-{high:.1f}", "count": int(count)}
+            for low, high, count in zip(edges[:-1], edges[1:], histogram)
+        ],
+        "average_ph": round(float(ph.mean()), 2) if ok else None,
+        "average_soil_health_score": round(float(np.mean([
+            soil_advice(encode_state(a["soil_type"], a["ph_level"], a["nutrients"]))["soil_health_score"] for a in ok
+        ])), 1) if ok else None,
     }
-    
-    return irrigation_needs.get(soil_type, irrigation_needs["Sandy Loam"])
 
 @router.get("/types")
 async def list_soil_types():
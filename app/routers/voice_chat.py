@@ -4,6 +4,8 @@ import requests
 import json
 from datetime import datetime
 
+from app.routers.market_prices import commodity_price_reply, is_price_query
+
 router = APIRouter()
 
 @router.post("/send-message")
@@ -36,7 +38,6 @@ def generate_whatsapp_response(voice_text: str) -> str:
     """Generate WhatsApp bot response based on voice input"""
     text_lower = voice_text.lower()
     
-    
     # Weather queries
     if any(word in text_lower for word in ["weather", "temperature", "rain", "sunny", "cloudy"]):
         return "🌤️ Weather Update: Current temperature is 28°C with partly cloudy skies. Good conditions for crop growth. Consider light irrigation if soil is dry."
@@ -49,9 +50,9 @@ def generate_whatsapp_response(voice_text: str) -> str:
     elif any(word in text_lower for word in ["crop", "plant", "seed", "harvest"]):
         return "🌾 Crop Advisory: Based on current season, consider planting tomatoes, peppers, or leafy vegetables. Ensure proper irrigation and pest monitoring."
     
-    # Market price queries
-    elif any(word in text_lower for word in ["price", "market", "sell", "buy", "cost"]):
-        return "💰 Market Prices: Current wheat price: ₹2,200/quintal, Rice: ₹3,100/quintal, Tomatoes: ₹45/kg. Check our website for detailed price trends and forecasts."
+    # Market price queries (commodity prices when a crop is named)
+    elif is_price_query(voice_text):
+        return commodity_price_reply(voice_text) or "💰 Market Prices: Current wheat price: ₹2,200/quintal, Rice: ₹3,100/quintal, Tomatoes: ₹45/kg. Check our website for detailed price trends and forecasts."
     
     # Pest and disease queries
     elif any(word in text_lower for word in ["pest", "disease", "bug", "insect", "fungus"]):
@@ -1,65 +1,56 @@
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from pydantic import BaseModel
 import os
-import requests
 import json
+import asyncio
+import logging
 from urllib.parse import quote
 from dotenv import load_dotenv
-from collections import deque
+from collections import Counter, defaultdict, deque
 from datetime import datetime
 
+from app.routers.market_prices import commodity_price_reply, is_price_query
+from app.message_dedup import seen_messages
+from app.whatsapp_client import WhatsAppNotConfigured, WhatsAppSendError, format_phone, whatsapp_client
+from app.whatsapp_outbox import TierLimitExceeded, normalize_recipients, outbox
+from app.whatsapp_pipeline import PipelineFull, ReplyPipeline
+
 load_dotenv()
 
 router = APIRouter()
 
 # In-memory store for recent WhatsApp replies (resets on restart)
 recent_replies = deque(maxlen=50)
+# Delivery status updates received for our sent messages, by status
+delivery_statuses: Counter = Counter()
 
 # Pydantic model for send-whatsapp request
 class SendWhatsAppRequest(BaseModel):
     message: str
 
+class BroadcastRequest(BaseModel):
+    recipients: List[str]
+    # Free-form text only reaches farmers who messaged us in the last 24 hours;
+    # others need an approved template
+    message: Optional[str] = None
+    template: Optional[str] = None
+    language: str = "en"
+    parameters: List[str] = []
+
 async def send_whatsapp_message(phone_number: str, message: str) -> bool:
     """Send message to WhatsApp using WhatsApp Business API"""
     try:
-        # WhatsApp Business API configuration
-        access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
-        phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
-        
-        if not access_token or not phone_number_id:
-            print("WhatsApp API credentials not configured")
-            return False
-        
-        # Format phone number (remove + and spaces)
-        formatted_phone = phone_number.replace("+", "").replace(" ", "").replace("-", "")
-        
-        url = f"https://graph.facebook.com/v18.0/{phone_number_id}/messages"
-        
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "messaging_product": "whatsapp",
-            "to": formatted_phone,
-            "type": "text",
-            "text": {
-                "body": message
-            }
-        }
-        
-        response = requests.post(url, headers=headers, json=data)
-        
-        if response.status_code == 200:
-            print(f"Message sent successfully to {phone_number}")
-            return True
-        else:
-            print(f"Failed to send message: {response.status_code} - {response.text}")
-            return False
-            
+        await whatsapp_client.send_text(phone_number, message)
+        print(f"Message sent successfully to {phone_number}")
+        return True
+    except WhatsAppNotConfigured:
+        print("WhatsApp API credentials not configured")
+        return False
+    except WhatsAppSendError as e:
+        print(f"Failed to send message: {e}")
+        return False
     except Exception as e:
         print(f"Error sending WhatsApp message: {str(e)}")
         return False
@@ -84,48 +75,106 @@ async def verify_webhook(request: Request) -> JSONResponse:
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def webhook_events(payload: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Every message and status update in a webhook payload, across all entries and changes"""
+    messages, statuses = [], []
+    for entry in payload.get("entry") or []:
+        for change in (entry.get("changes") or []) if isinstance(entry, dict) else []:
+            value = change.get("value") if isinstance(change, dict) else None
+            if not isinstance(value, dict):
+                continue
+            messages.extend(m for m in value.get("messages") or [] if isinstance(m, dict))
+            statuses.extend(st for st in value.get("statuses") or [] if isinstance(st, dict))
+    return messages, statuses
+
+def record_statuses(statuses: List[Dict[str, Any]]):
+    """Count delivery status updates for our sent messages (sent, delivered, read, failed)"""
+    for status in statuses:
+        delivery_statuses[status.get("status", "unknown")] += 1
+        if status.get("status") == "failed":
+            errors = status.get("errors") or [{}]
+            print(f"WhatsApp message to {status.get('recipient_id')} failed: {errors[0].get('title', 'unknown error')}")
+
+def message_content(message: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    text = (message.get("text", {}) or {}).get("body") if message.get("type") == "text" else None
+    image = message.get("image") if message.get("type") == "image" else None
+    return text, image
+
+async def send_replies(from_wa: Optional[str], replies: List[str]):
+    """Send one sender's replies in the order their messages arrived"""
+    for reply in replies:
+        # Send message to WhatsApp if we have a phone number
+        if from_wa:
+            # Format phone number for WhatsApp
+            formatted_phone = f"+{from_wa}" if not from_wa.startswith("+") else from_wa
+            await send_whatsapp_message(formatted_phone, reply)
+        
+        recent_replies.appendleft({
+            "to": from_wa,
+            "message": reply,
+            "type": "text",
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        })
+
+async def handle_incoming_batch(messages: List[Dict[str, Any]]):
+    """Reply to a batch of incoming messages (runs on a pipeline worker, after the webhook has returned)"""
+    # Classify each distinct message once: at market hours many farmers ask the same thing
+    classified: Dict[Tuple[Optional[str], bool], str] = {}
+    by_sender: Dict[Optional[str], List[str]] = defaultdict(list)
+    for message in messages:
+        text, image = message_content(message)
+        key = (text, image is not None)
+        if key not in classified:
+            classified[key] = await generate_advisory_response(text=text, image=image)
+        by_sender[message.get("from")].append(classified[key])
+    
+    # Different senders concurrently (paced by the client's send-rate limiter), each in order
+    await asyncio.gather(*(send_replies(from_wa, replies) for from_wa, replies in by_sender.items()))
+
+# Replies are generated and sent in the background so Meta gets its 200 right away
+pipeline = ReplyPipeline(handle_incoming_batch)
+
 @router.post("/whatsapp")
 async def whatsapp_webhook(request: Request) -> JSONResponse:
-    """Handle incoming WhatsApp messages"""
+    """Handle incoming WhatsApp messages: validate, queue for the reply workers, acknowledge"""
     try:
-        payload: Dict[str, Any] = await request.json()
-        
-        # Process the webhook payload
-        entries = payload.get("entry", [])
-        changes = entries[0].get("changes", []) if entries else []
-        value = changes[0].get("value", {}) if changes else {}
-        messages = value.get("messages", [])
-        
-        response_messages = []
-        
-        if messages:
-            for message in messages:
-                from_wa = message.get("from")
-                text = (message.get("text", {}) or {}).get("body") if message.get("type") == "text" else None
-                image = message.get("image") if message.get("type") == "image" else None
-                
-                # Generate response based on message content
-                reply = await generate_advisory_response(text=text, image=image)
-                
-                # Send message to WhatsApp if we have a phone number
-                if from_wa:
-                    # Format phone number for WhatsApp
-                    formatted_phone = f"+{from_wa}" if not from_wa.startswith("+") else from_wa
-                    await send_whatsapp_message(formatted_phone, reply)
-                
-                reply_obj = {
-                    "to": from_wa,
-                    "message": reply,
-                    "type": "text",
-                    "timestamp": datetime.utcnow().isoformat() + "Z"
-                }
-                response_messages.append(reply_obj)
-                recent_replies.appendleft(reply_obj)
-        
-        return JSONResponse({"status": "received", "replies": response_messages})
-        
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Webhook payload must be a JSON object")
+    
+    # Meta batches several entries and changes into one delivery at busy times
+    messages, statuses = webhook_events(payload)
+    
+    # Drop redeliveries of messages and status updates already handled
+    keyed = [(m["id"], m) for m in messages if m.get("id")]
+    keyed += [(f"{st['id']}:{st.get('status')}", st) for st in statuses if st.get("id")]
+    try:
+        fresh = await seen_messages.claim([key for key, _ in keyed]) if keyed else []
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        # Without the store a duplicate reply is better than a lost message
+        logging.warning(f"WhatsApp dedup store unavailable, processing all messages: {e}")
+        keyed, fresh = [], []
+    claimed = [key for (key, _), new in zip(keyed, fresh) if new]
+    duplicates = {id(event) for (_, event), new in zip(keyed, fresh) if not new}
+    new_messages = [m for m in messages if id(m) not in duplicates]
+    new_statuses = [st for st in statuses if id(st) not in duplicates]
+    
+    try:
+        queued = pipeline.submit(new_messages) if new_messages else 0
+    except PipelineFull as e:
+        # Unclaim so Meta's redelivery is processed, by which time the workers have caught up
+        await seen_messages.release(claimed)
+        raise HTTPException(status_code=503, detail=f"Busy, retry later: {e}")
+    record_statuses(new_statuses)
+    
+    return JSONResponse({
+        "status": "received",
+        "queued": queued,
+        "statuses": len(new_statuses),
+        "duplicates": len(duplicates)
+    })
 
 async def generate_advisory_response(text: Optional[str] = None, image: Optional[Dict[str, Any]] = None) -> str:
     """Generate advisory response based on user input"""
@@ -152,9 +201,9 @@ async def generate_advisory_response(text: Optional[str] = None, image: Optional
             elif any(word in text_lower for word in ["soil", "fertilizer", "nutrient", "ph", "compost", "manure"]):
                 return "🌱 Soil Analysis: I can analyze your soil and recommend fertilizers! Share a photo of your soil sample for analysis. I'll check pH, nutrients, and suggest improvements."
             
-            # Market price queries
-            elif any(word in text_lower for word in ["price", "market", "sell", "buy", "cost", "tomato", "onion", "potato"]):
-                return "💰 Market Prices: Current rates - Tomato: ₹45/kg, Onion: ₹38/kg, Potato: ₹25/kg. Prices are updated daily from major markets. Which crop are you interested in?"
+            # Market price queries (commodity names in any supported language/spelling)
+            elif is_price_query(text):
+                return commodity_price_reply(text) or "💰 Market Prices: Current rates - Tomato: ₹45/kg, Onion: ₹38/kg, Potato: ₹25/kg. Prices are updated daily from major markets. Which crop are you interested in?"
             
             # General help
             elif "help" in text_lower:
@@ -235,7 +284,8 @@ async def get_webhook_status():
             "Pest detection",
             "Soil analysis",
             "Market prices"
-        ]
+        ],
+        "delivery_statuses": dict(delivery_statuses)
     }
 
 @router.get("/whatsapp/recent")
@@ -261,61 +311,84 @@ async def send_whatsapp(request: SendWhatsAppRequest):
         # Add "kissan" prefix (if text is empty, message will be just "kissan")
         message = f"kissan {text}".strip() if text else "kissan"
         
-        # Get WhatsApp API credentials
-        access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
-        phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
         target_phone = "7670997498"  # Fixed phone number
         
-        if not access_token or not phone_number_id:
+        if not whatsapp_client.configured:
             raise HTTPException(
                 status_code=500,
                 detail="WhatsApp API credentials not configured. Please set WHATSAPP_ACCESS_TOKEN and WHATSAPP_PHONE_NUMBER_ID"
             )
         
         # Format phone number (remove +, spaces, ensure starts with country code)
-        formatted_phone = target_phone.replace("+", "").replace(" ", "").replace("-", "")
+        formatted_phone = format_phone(target_phone)
         if not formatted_phone.startswith("91"):
             formatted_phone = "91" + formatted_phone
         
-        # WhatsApp Cloud API endpoint
-        api_url = f"https://graph.facebook.com/v18.0/{phone_number_id}/messages"
+        # Send through the shared Cloud API client (pooled, retries throttling and 5xx)
+        try:
+            response_data = await whatsapp_client.send_text(formatted_phone, message)
+        except WhatsAppSendError as e:
+            raise HTTPException(status_code=e.status_code or 502, detail=str(e))
         
-        # Request body as specified
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": formatted_phone,
-            "type": "text",
-            "text": {
-                "body": message
-            }
-        }
-        
-        # Send to WhatsApp Cloud API
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
+        return {
+            "success": True,
+            "message": "Message sent to WhatsApp successfully",
+            "message_id": response_data.get("messages", [{}])[0].get("id"),
+            "sent_to": formatted_phone,
+            "message_text": message
         }
-        
-        response = requests.post(api_url, headers=headers, json=payload)
-        response_data = response.json()
-        
-        if response.status_code == 200:
-            return {
-                "success": True,
-                "message": "Message sent to WhatsApp successfully",
-                "message_id": response_data.get("messages", [{}])[0].get("id"),
-                "sent_to": formatted_phone,
-                "message_text": message
-            }
-        else:
-            error_msg = response_data.get("error", {}).get("message", "Unknown error")
-            error_code = response_data.get("error", {}).get("code", "N/A")
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"WhatsApp API error: {error_msg} (Code: {error_code})"
-            )
             
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send WhatsApp message: {str(e)}")
+
+def broadcast_message(request: BroadcastRequest) -> Dict[str, Any]:
+    """Graph API message object for a broadcast: approved template or plain text"""
+    if request.template:
+        template: Dict[str, Any] = {"name": request.template, "language": {"code": request.language}}
+        if request.parameters:
+            template["components"] = [{
+                "type": "body",
+                "parameters": [{"type": "text", "text": value} for value in request.parameters]
+            }]
+        return {"type": "template", "template": template}
+    return {"type": "text", "text": {"body": request.message.strip()}}
+
+@router.post("/whatsapp/broadcast", status_code=202)
+async def create_broadcast(request: BroadcastRequest):
+    """
+    Queue one message (price alert, weather warning) for many farmers.
+    Sent in the background at the API rate limit; follow it with GET /whatsapp/broadcast/{broadcast_id}
+    """
+    if bool(request.message and request.message.strip()) == bool(request.template):
+        raise HTTPException(status_code=400, detail="Provide either message or template")
+    if not whatsapp_client.configured:
+        raise HTTPException(
+            status_code=500,
+            detail="WhatsApp API credentials not configured. Please set WHATSAPP_ACCESS_TOKEN and WHATSAPP_PHONE_NUMBER_ID"
+        )
+    
+    recipients, invalid, repeated = normalize_recipients(request.recipients)
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No valid recipient phone numbers")
+    
+    try:
+        broadcast_id = await outbox.broadcast(recipients, broadcast_message(request))
+    except TierLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    return {
+        "broadcast_id": broadcast_id,
+        "queued": len(recipients),
+        "invalid": invalid,
+        "duplicates": repeated
+    }
+
+@router.get("/whatsapp/broadcast/{broadcast_id}")
+async def get_broadcast(broadcast_id: str):
+    """Progress of a broadcast: counts by state, send rate and estimated time left"""
+    progress = await outbox.progress(broadcast_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Broadcast '{broadcast_id}' not found")
+    return progress
@@ -0,0 +1,391 @@
+"""
+Soil Recommendation Tables
+The advice returned by /api/soil/analyze (pH status, health score, recommendations,
+fertilizer, pest prevention, cultivation, irrigation, crop suitability) depends only
+on the soil type, a pH band and the nutrient levels. The rules are compiled into
+lookup tables at import time; a soil state is encoded as one small int and the
+assembled advice for each state is memoized, so a request does a table lookup
+instead of rebuilding the rule dicts.
+"""
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from app.soil_vision import SOIL_TYPES
+
+# pH bands, split wherever a rule changes: status (6.0 / 8.0), health score
+# (5.5 / 6.0 / 7.5 / 8.0) and the crop suitability penalty (6.0-7.5)
+PH_BANDS = ["< 5.5", "5.5-6.0", "6.0-7.5", "7.5-8.0", "> 8.0"]
+PH_STATUS = ["Acidic", "Acidic", "Neutral", "Neutral", "Alkaline"]
+PH_POINTS = [10, 20, 30, 20, 10]
+
+# Nutrients in response order (organic matter is graded separately)
+NUTRIENTS = ["nitrogen", "phosphorus", "potassium", "calcium", "magnesium", "sulfur"]
+NUTRIENT_LEVELS = ["Low", "Medium", "High"]
+ORGANIC_LEVELS = ["Poor", "Fair", "Good", "Excellent"]
+NUTRIENT_POINTS = [3, 7, 10]
+ORGANIC_POINTS = [2, 5, 8, 10]
+
+# State = soil type x pH band x 3^6 nutrient levels x organic level, mixed radix
+STATE_COUNT = len(SOIL_TYPES) * len(PH_BANDS) * len(NUTRIENT_LEVELS) ** len(NUTRIENTS) * len(ORGANIC_LEVELS)
+
+_SOIL_INDEX = {name: i for i, name in enumerate(SOIL_TYPES)}
+_NUTRIENT_INDEX = {level: i for i, level in enumerate(NUTRIENT_LEVELS)}
+_ORGANIC_INDEX = {level: i for i, level in enumerate(ORGANIC_LEVELS)}
+
+
+def ph_band(ph_level: float) -> int:
+    """Index into PH_BANDS"""
+    if ph_level < 5.5:
+        return 0
+    if ph_level < 6.0:
+        return 1
+    if ph_level <= 7.5:
+        return 2
+    if ph_level <= 8.0:
+        return 3
+    return 4
+
+
+def encode_state(soil_type: str, ph_level: float, nutrients: Dict[str, str]) -> int:
+    """Compact soil state for the lookup tables; raises KeyError for unknown types or levels"""
+    state = _SOIL_INDEX[soil_type] * len(PH_BANDS) + ph_band(ph_level)
+    for nutrient in NUTRIENTS:
+        state = state * len(NUTRIENT_LEVELS) + _NUTRIENT_INDEX[nutrients[nutrient]]
+    return state * len(ORGANIC_LEVELS) + _ORGANIC_INDEX[nutrients["organic_matter"]]
+
+
+def decode_state(state: int) -> Tuple[int, int, Tuple[int, ...], int]:
+    """(soil type index, pH band, nutrient level indices in NUTRIENTS order, organic level index)"""
+    state, organic = divmod(state, len(ORGANIC_LEVELS))
+    levels = []
+    for _ in NUTRIENTS:
+        state, level = divmod(state, len(NUTRIENT_LEVELS))
+        levels.append(level)
+    soil, band = divmod(state, len(PH_BANDS))
+    return soil, band, tuple(reversed(levels)), organic
+
+
+# --- Rules ---
+
+CROP_PREFERENCES = {
+    "Sandy Loam": ["Carrots", "Potatoes", "Sweet Potatoes", "Radishes", "Onions"],
+    "Clay Loam": ["Rice", "Wheat", "Corn", "Soybeans", "Cotton"],
+    "Silty Clay": ["Rice", "Wheat", "Barley", "Oats", "Rye"],
+    "Sandy Clay": ["Peanuts", "Sweet Potatoes", "Watermelons", "Cantaloupes"],
+    "Loamy Sand": ["Tomatoes", "Peppers", "Eggplant", "Squash", "Cucumbers"],
+    "Silt Loam": ["Lettuce", "Spinach", "Broccoli", "Cabbage", "Cauliflower"]
+}
+
+# Main planting season per crop
+PLANTING_SEASONS = {
+    "Carrots": "Fall", "Potatoes": "Fall", "Sweet Potatoes": "Summer", "Radishes": "Fall",
+    "Onions": "Fall", "Rice": "Summer", "Wheat": "Fall", "Corn": "Summer", "Soybeans": "Summer",
+    "Cotton": "Summer", "Barley": "Fall", "Oats": "Fall", "Rye": "Fall", "Peanuts": "Summer",
+    "Watermelons": "Spring", "Cantaloupes": "Spring", "Tomatoes": "Year-round",
+    "Peppers": "Year-round", "Eggplant": "Year-round", "Squash": "Spring", "Cucumbers": "Spring",
+    "Lettuce": "Fall", "Spinach": "Fall", "Broccoli": "Fall", "Cabbage": "Fall", "Cauliflower": "Fall"
+}
+
+PH_RECOMMENDATIONS = {
+    "Acidic": {
+        "category": "pH Management",
+        "priority": "High",
+        "recommendation": "Soil is acidic. Add lime to raise pH",
+        "action": "Apply 2-4 kg of agricultural lime per 100 sq m",
+        "timeline": "Apply 2-4 weeks before planting"
+    },
+    "Alkaline": {
+        "category": "pH Management",
+        "priority": "High",
+        "recommendation": "Soil is alkaline. Add sulfur to lower pH",
+        "action": "Apply 1-2 kg of elemental sulfur per 100 sq m",
+        "timeline": "Apply 3-6 months before planting"
+    },
+}
+
+TEXTURE_RECOMMENDATIONS = {
+    "Clay": {
+        "category": "Soil Structure",
+        "priority": "Medium",
+        "recommendation": "Improve drainage and aeration",
+        "action": "Add organic matter and sand to improve structure",
+        "timeline": "Apply annually during off-season"
+    },
+    "Sandy": {
+        "category": "Water Retention",
+        "priority": "Medium",
+        "recommendation": "Improve water retention",
+        "action": "Add compost and organic matter to increase water holding capacity",
+        "timeline": "Apply before each planting season"
+    },
+}
+
+FERTILIZERS = {
+    "nitrogen": {
+        "type": "Nitrogen Fertilizer",
+        "product": "Urea (46-0-0) or Ammonium Nitrate (34-0-0)",
+        "application_rate": "50-75 kg per hectare",
+        "timing": "Split application: 50% at planting, 50% during growth",
+        "method": "Broadcast or side-dress",
+        "cost_estimate": "₹800-1200 per hectare"
+    },
+    "phosphorus": {
+        "type": "Phosphorus Fertilizer",
+        "product": "DAP (18-46-0) or Superphosphate (0-20-0)",
+        "application_rate": "40-60 kg per hectare",
+        "timing": "Apply at planting or before planting",
+        "method": "Band placement near seeds",
+        "cost_estimate": "₹600-900 per hectare"
+    },
+    "potassium": {
+        "type": "Potassium Fertilizer",
+        "product": "Muriate of Potash (0-0-60) or Sulphate of Potash (0-0-50)",
+        "application_rate": "30-50 kg per hectare",
+        "timing": "Apply at planting",
+        "method": "Broadcast and incorporate",
+        "cost_estimate": "₹400-700 per hectare"
+    },
+    "organic_matter": {
+        "type": "Organic Matter",
+        "product": "Compost, Farmyard Manure, or Green Manure",
+        "application_rate": "10-15 tons per hectare",
+        "timing": "Apply 2-4 weeks before planting",
+        "method": "Spread evenly and incorporate",
+        "cost_estimate": "₹2000-4000 per hectare"
+    },
+}
+
+PREVENTION = {
+    "soil_health": {
+        "category": "Soil Health",
+        "recommendation": "Maintain balanced soil nutrients",
+        "action": "Regular soil testing and balanced fertilization",
+        "benefit": "Healthy plants resist pests and diseases better"
+    },
+    "acidic": {
+        "category": "pH Management",
+        "recommendation": "Correct acidic soil",
+        "action": "Apply lime to raise pH to 6.5-7.0",
+        "benefit": "Reduces fungal diseases and improves nutrient availability"
+    },
+    "clay": {
+        "category": "Drainage",
+        "recommendation": "Improve soil drainage",
+        "action": "Add organic matter and create raised beds",
+        "benefit": "Prevents root rot and fungal diseases"
+    },
+    "organic_matter": {
+        "category": "Organic Matter",
+        "recommendation": "Increase organic matter content",
+        "action": "Add compost, manure, or cover crops",
+        "benefit": "Improves soil structure and beneficial microorganism activity"
+    },
+    "rotation": {
+        "category": "Crop Rotation",
+        "recommendation": "Practice crop rotation",
+        "action": "Rotate crops from different families every 2-3 years",
+        "benefit": "Breaks pest and disease cycles naturally"
+    },
+}
+
+CULTIVATION = {
+    "deep_tillage": {
+        "method": "Deep Tillage",
+        "description": "Deep plowing to break up compacted clay layers",
+        "timing": "During dry season when soil is workable",
+        "depth": "15-20 cm",
+        "frequency": "Once per year before planting"
+    },
+    "shallow_tillage": {
+        "method": "Shallow Tillage",
+        "description": "Light cultivation to prepare seedbed",
+        "timing": "1-2 weeks before planting",
+        "depth": "8-12 cm",
+        "frequency": "Before each planting"
+    },
+    "seedbed": {
+        "method": "Seedbed Preparation",
+        "description": "Create fine, well-drained seedbed",
+        "timing": "After tillage, before planting",
+        "depth": "2-3 cm for most crops",
+        "frequency": "Before each planting"
+    },
+    "mulching": {
+        "method": "Mulching",
+        "description": "Apply organic mulch to conserve moisture",
+        "timing": "After planting and emergence",
+        "depth": "5-8 cm layer",
+        "frequency": "Maintain throughout growing season"
+    },
+}
+
+IRRIGATION = {
+    "Sandy Loam": {
+        "frequency": "Every 2-3 days",
+        "amount": "15-20 mm per application",
+        "method": "Drip irrigation or frequent light watering",
+        "total_seasonal": "400-600 mm"
+    },
+    "Clay Loam": {
+        "frequency": "Every 5-7 days",
+        "amount": "25-30 mm per application",
+        "method": "Flood irrigation or sprinkler",
+        "total_seasonal": "300-500 mm"
+    },
+    "Silty Clay": {
+        "frequency": "Every 4-6 days",
+        "amount": "20-25 mm per application",
+        "method": "Sprinkler or flood irrigation",
+        "total_seasonal": "350-550 mm"
+    },
+    "Sandy Clay": {
+        "frequency": "Every 3-4 days",
+        "amount": "18-22 mm per application",
+        "method": "Drip irrigation preferred",
+        "total_seasonal": "450-650 mm"
+    },
+    "Loamy Sand": {
+        "frequency": "Every 2-3 days",
+        "amount": "15-20 mm per application",
+        "method": "Drip irrigation or frequent watering",
+        "total_seasonal": "400-600 mm"
+    },
+    "Silt Loam": {
+        "frequency": "Every 4-5 days",
+        "amount": "20-25 mm per application",
+        "method": "Sprinkler irrigation",
+        "total_seasonal": "350-500 mm"
+    }
+}
+
+
+# --- Compiled tables (each indexed by the part of the state it depends on) ---
+
+def _texture(soil_type: str) -> str:
+    return "Clay" if "Clay" in soil_type else "Sandy" if "Sandy" in soil_type else ""
+
+
+def _low_nutrient_recommendation(nutrient: str) -> Dict:
+    return {
+        "category": f"{nutrient.title()} Management",
+        "priority": "High",
+        "recommendation": f"{nutrient.title()} levels are low",
+        "action": f"Apply {nutrient}-rich fertilizer or organic amendments",
+        "timeline": "Apply before planting and during growth season"
+    }
+
+
+def _compile_fertilizers() -> List[Tuple[Dict, ...]]:
+    """Indexed by a bitmask of low N/P/K (bit 0 = nitrogen) * 2 + organic matter Poor/Fair"""
+    table = []
+    for mask in range(8):
+        for poor_organic in (False, True):
+            items = [FERTILIZERS[n] for bit, n in enumerate(["nitrogen", "phosphorus", "potassium"]) if mask >> bit & 1]
+            if poor_organic:
+                items.append(FERTILIZERS["organic_matter"])
+            table.append(tuple(items))
+    return table
+
+
+def _compile_prevention() -> List[Tuple[Dict, ...]]:
+    """Indexed by (acidic * 2 + clay) * 2 + organic matter Poor/Fair"""
+    table = []
+    for acidic in (False, True):
+        for clay in (False, True):
+            for poor_organic in (False, True):
+                items = [PREVENTION["soil_health"]]
+                if acidic:
+                    items.append(PREVENTION["acidic"])
+                if clay:
+                    items.append(PREVENTION["clay"])
+                if poor_organic:
+                    items.append(PREVENTION["organic_matter"])
+                items.append(PREVENTION["rotation"])
+                table.append(tuple(items))
+    return table
+
+
+def _compile_cultivation() -> List[Tuple[Dict, ...]]:
+    """Indexed by soil type"""
+    table = []
+    for soil_type in SOIL_TYPES:
+        texture = _texture(soil_type)
+        items = [CULTIVATION["deep_tillage" if texture == "Clay" else "shallow_tillage"], CULTIVATION["seedbed"]]
+        if "Sandy" in soil_type:
+            items.append(CULTIVATION["mulching"])
+        table.append(tuple(items))
+    return table
+
+
+def _compile_crops() -> List[Tuple[Tuple, ...]]:
+    """Indexed by soil type * 2 + pH outside 6.0-7.5; rows of (crop, score, level, season, yield)"""
+    table = []
+    for soil_type in SOIL_TYPES:
+        for penalty in (0, 6):
+            rows = []
+            # Crops are listed best-first; pH outside 6.0-7.5 costs a few points for all of them
+            for rank, crop in enumerate(CROP_PREFERENCES[soil_type][:5]):  # Top 5 crops
+                score = max(75, 95 - 4 * rank - penalty)
+                level = "Excellent" if score >= 90 else "Good" if score >= 80 else "Fair"
+                rows.append((crop, score, level, PLANTING_SEASONS.get(crop, "Year-round"), f"{score + 15}% of optimal"))
+            table.append(tuple(rows))
+    return table
+
+
+_LOW_NUTRIENT_RECOMMENDATIONS = [_low_nutrient_recommendation(n) for n in NUTRIENTS]
+_TEXTURE_BY_SOIL = [TEXTURE_RECOMMENDATIONS.get(_texture(soil_type)) for soil_type in SOIL_TYPES]
+_CLAY_BY_SOIL = ["Clay" in soil_type for soil_type in SOIL_TYPES]
+_FERTILIZER_TABLE = _compile_fertilizers()
+_PREVENTION_TABLE = _compile_prevention()
+_CULTIVATION_TABLE = _compile_cultivation()
+_IRRIGATION_TABLE = [IRRIGATION[soil_type] for soil_type in SOIL_TYPES]
+_CROP_TABLE = _compile_crops()
+
+
+@lru_cache(maxsize=4096)
+def soil_advice(state: int) -> Dict:
+    """
+    Everything in the soil analysis response except crop suitability, for an encoded
+    state. Memoized: the returned dict and its lists are shared and must not be modified.
+    """
+    soil, band, levels, organic = decode_state(state)
+    status = PH_STATUS[band]
+    low = [i for i, level in enumerate(levels) if level == 0]
+    poor_organic = organic <= 1
+
+    recommendations = []
+    if status in PH_RECOMMENDATIONS:
+        recommendations.append(PH_RECOMMENDATIONS[status])
+    recommendations.extend(_LOW_NUTRIENT_RECOMMENDATIONS[i] for i in low)
+    if _TEXTURE_BY_SOIL[soil] is not None:
+        recommendations.append(_TEXTURE_BY_SOIL[soil])
+
+    npk_mask = sum(1 << i for i in low if i < 3)
+    health = PH_POINTS[band] + sum(NUTRIENT_POINTS[level] for level in levels) + ORGANIC_POINTS[organic]
+
+    return {
+        "ph_status": status,
+        "soil_health_score": min(health, 100),
+        "recommendations": recommendations,
+        "fertilizer_recommendations": list(_FERTILIZER_TABLE[npk_mask * 2 + poor_organic]),
+        "pest_prevention": list(_PREVENTION_TABLE[((status == "Acidic") * 2 + _CLAY_BY_SOIL[soil]) * 2 + poor_organic]),
+        "cultivation_methods": list(_CULTIVATION_TABLE[soil]),
+        "irrigation_needs": _IRRIGATION_TABLE[soil],
+    }
+
+
+@lru_cache(maxsize=1024)
+def crop_suitability(soil_type: str, ph_level: float) -> List[Dict]:
+    """Top crops for the soil, best first (memoized per soil type and 0.1 pH step; shared, don't modify)"""
+    rows = _CROP_TABLE[_SOIL_INDEX[soil_type] * 2 + (ph_band(ph_level) != 2)]
+    return [
+        {
+            "crop_name": crop,
+            "suitability_score": score,
+            "suitability_level": level,
+            "reason": f"Well-suited for {soil_type} soil with pH {ph_level}",
+            "planting_season": season,
+            "expected_yield": expected_yield
+        }
+        for crop, score, level, season, expected_yield in rows
+    ]
@@ -0,0 +1,268 @@
+"""
+Soil Image Analysis
+Deterministic feature extraction and classification for soil photos (Pillow + NumPy,
+CPU only). The photo is downscaled to a small working size, converted to CIE Lab and
+summarized as Munsell-like hue/value/chroma plus texture statistics; a linear
+classifier with embedded weights then predicts soil type, pH and nutrient levels.
+The same image always yields the same result.
+"""
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from app.image_upload import open_working_image
+
+# Bumped whenever features or weights change, so cached results can be invalidated
+SOIL_MODEL_VERSION = "soil-lab-1"
+
+# Longest side (pixels) of the working image
+WORKING_SIZE = 192
+
+# Images featurized as one stack in analyze_soil_batch; larger stacks fall out of CPU cache
+FEATURE_STACK_SIZE = 8
+
+SOIL_TYPES = ["Sandy Loam", "Clay Loam", "Silty Clay", "Sandy Clay", "Loamy Sand", "Silt Loam"]
+
+# Typical pH range per soil type; predictions are kept inside it
+PH_RANGES = {
+    "Sandy Loam": (6.0, 7.5),
+    "Clay Loam": (5.5, 7.0),
+    "Silty Clay": (6.5, 8.0),
+    "Sandy Clay": (5.0, 6.5),
+    "Loamy Sand": (6.2, 7.8),
+    "Silt Loam": (6.0, 7.2),
+}
+
+FEATURE_NAMES = [
+    "value",            # Munsell-like value (0-10), from L*
+    "chroma",           # Munsell-like chroma, from C*ab
+    "hue",              # Munsell hue index (0-100, 5R = 5, 5YR = 15, 5Y = 25 ...)
+    "value_std",        # spread of lightness across the photo
+    "fine_gradient",    # mean |dL*| between neighbouring pixels (grain visibility)
+    "grain_ratio",      # fine-scale / coarse-scale gradient energy
+    "entropy",          # lightness histogram entropy (bits)
+    "dark_fraction",    # share of pixels with L* < 30
+]
+
+# Feature standardization (mean, scale) for typical field photos of soil
+FEATURE_MEAN = np.array([4.7, 4.0, 17.0, 0.65, 3.4, 0.86, 2.7, 0.2])
+FEATURE_SCALE = np.array([1.6, 2.5, 5.0, 0.25, 1.9, 0.2, 0.5, 0.35])
+
+# Latent texture axes (sand, clay, silt) as weights over standardized features:
+# sand is pale and grainy, clay dark, red/saturated and smooth, silt mid-toned, dull and smooth
+LATENT_WEIGHTS = np.array([
+    #  value  chroma  hue   v_std  grad   grain  entr   dark
+    [0.90, -0.10, 0.20, 0.30, 1.00, 0.80, 0.20, -0.40],   # sand
+    [-0.80, 0.60, -0.40, -0.20, -0.90, -0.50, -0.10, 0.60],   # clay
+    [0.20, -0.70, 0.10, -0.40, -0.60, -0.60, -0.30, -0.20],   # silt
+])
+
+# Soil types as mixtures of the latent axes (same order as SOIL_TYPES)
+CLASS_MIX = np.array([
+    [0.8, 0.0, 0.2],   # Sandy Loam
+    [0.0, 0.8, 0.2],   # Clay Loam
+    [0.0, 0.6, 0.7],   # Silty Clay
+    [0.6, 0.6, 0.0],   # Sandy Clay
+    [1.3, 0.0, 0.0],   # Loamy Sand
+    [0.0, 0.0, 1.0],   # Silt Loam
+])
+CLASS_BIAS = np.array([0.2, 0.1, -0.1, -0.2, -0.8, 0.1])
+CLASS_WEIGHTS = CLASS_MIX @ LATENT_WEIGHTS
+SOFTMAX_TEMPERATURE = 0.6
+
+# pH shift (units) per standard deviation: pale/calcareous soils read alkaline,
+# red (iron oxide) and dark (organic) soils acidic
+PH_WEIGHTS = np.array([0.35, -0.30, 0.10, 0.0, 0.0, 0.0, 0.0, -0.20])
+
+# Nutrient indices as weights over [standardized features..., clay prob, pH - 6.5]
+NUTRIENT_WEIGHTS = {
+    "organic_matter": np.array([-0.9, 0.0, -0.2, 0.0, 0.0, 0.0, 0.0, 0.5, 0.0, 0.0]),
+    "nitrogen": np.array([-0.7, 0.0, 0.0, 0.0, -0.2, 0.0, 0.0, 0.4, 0.2, 0.0]),
+    "phosphorus": np.array([-0.3, 0.0, 0.0, 0.0, 0.0, 0.0, 0.2, 0.2, 0.0, -0.8]),
+    "potassium": np.array([-0.2, 0.2, 0.0, 0.0, -0.4, -0.2, 0.0, 0.0, 1.2, 0.0]),
+    "calcium": np.array([0.3, -0.2, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.4, 1.0]),
+    "magnesium": np.array([0.0, 0.0, 0.0, 0.0, -0.3, 0.0, 0.0, 0.0, 0.8, 0.5]),
+    "sulfur": np.array([-0.5, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.3, 0.3, -0.3]),
+}
+NUTRIENT_THRESHOLDS = (-0.5, 0.5)
+ORGANIC_THRESHOLDS = (-0.75, 0.0, 0.75)
+
+# CIE Lab hue angle (degrees) of the Munsell principal hues, for hue notation
+MUNSELL_FAMILIES = ["R", "YR", "Y", "GY", "G", "BG", "B", "PB", "P", "RP"]
+MUNSELL_LAB_ANGLES = np.array([24.0, 58.0, 92.0, 116.0, 163.0, 195.0, 234.0, 282.0, 318.0, 351.0])
+
+
+def load_image(source: Union[bytes, str], size: int = WORKING_SIZE) -> np.ndarray:
+    """Decode (bytes or file path) at most size x size; returns float32 RGB in [0, 1]"""
+    return np.asarray(open_working_image(source, size), dtype=np.float32) / 255.0
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """sRGB (D65) in [0, 1] -> CIE Lab, any leading shape"""
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([
+        [0.4124 / 0.95047, 0.2126, 0.0193 / 1.08883],
+        [0.3576 / 0.95047, 0.7152, 0.1192 / 1.08883],
+        [0.1805 / 0.95047, 0.0722, 0.9505 / 1.08883],
+    ], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    L = 116.0 * f[..., 1] - 16.0
+    a = 500.0 * (f[..., 0] - f[..., 1])
+    b = 200.0 * (f[..., 1] - f[..., 2])
+    return np.stack([L, a, b], axis=-1)
+
+
+def munsell_hue_index(lab_angle):
+    """Lab hue angle(s) -> Munsell hue index on a 0-100 circle (5R = 5, 5YR = 15, ...)"""
+    angles = np.append(MUNSELL_LAB_ANGLES, MUNSELL_LAB_ANGLES[0] + 360.0)
+    centers = np.arange(5.0, 115.0, 10.0)
+    angle = np.where(lab_angle >= angles[0], lab_angle, lab_angle + 360.0)
+    return np.interp(angle, angles, centers) % 100.0
+
+
+def munsell_notation(hue: float, value: float, chroma: float) -> str:
+    """e.g. '7.5YR 4/3'"""
+    family = int(hue // 10) % 10
+    step = round((hue % 10) / 2.5) * 2.5
+    if step == 0:
+        step, family = 10.0, (family - 1) % 10
+    return f"{step:g}{MUNSELL_FAMILIES[family]} {value:.0f}/{chroma:.0f}"
+
+
+def _mean_abs_diff(L: np.ndarray) -> np.ndarray:
+    """Mean |dL| between vertical and horizontal neighbours, per image of an (N, H, W) stack"""
+    return (np.abs(np.diff(L, axis=1)).mean(axis=(1, 2)) + np.abs(np.diff(L, axis=2)).mean(axis=(1, 2))) / 2.0
+
+
+def extract_features_batch(rgb: np.ndarray) -> np.ndarray:
+    """Feature matrix (N x FEATURE_NAMES) for a stack of same-size working images (N, H, W, 3)"""
+    n = rgb.shape[0]
+    lab = rgb_to_lab(rgb)
+    L = lab[..., 0]
+    a_mean, b_mean = lab[..., 1].mean(axis=(1, 2)), lab[..., 2].mean(axis=(1, 2))
+
+    value = L.mean(axis=(1, 2)) / 10.0
+    chroma = np.hypot(a_mean, b_mean) / 5.0
+    hue = munsell_hue_index(np.degrees(np.arctan2(b_mean, a_mean)) % 360.0)
+    value_std = L.std(axis=(1, 2)) / 10.0
+
+    fine = _mean_abs_diff(L)
+    h, w = (L.shape[1] // 2) * 2, (L.shape[2] // 2) * 2
+    coarse = _mean_abs_diff(L[:, :h, :w].reshape(n, h // 2, 2, w // 2, 2).mean(axis=(2, 4)))
+    grain_ratio = np.where(coarse > 1e-6, fine / np.maximum(coarse, 1e-6), 1.0)
+
+    # Lightness histograms of all images at once: offset each image's bins by 25 * index
+    bins = np.clip(L, 0, 99.99).astype(np.int32).reshape(n, -1) // 4 + 25 * np.arange(n)[:, None]
+    p = np.bincount(bins.ravel(), minlength=25 * n).reshape(n, 25) / bins.shape[1]
+    entropy = -(p * np.log2(np.where(p > 0, p, 1.0))).sum(axis=1)
+    dark_fraction = (L < 30.0).mean(axis=(1, 2))
+
+    return np.stack([value, chroma, hue, value_std, fine, grain_ratio, entropy, dark_fraction],
+                    axis=1).astype(np.float64)
+
+
+def extract_features(rgb: np.ndarray) -> np.ndarray:
+    """Feature vector (FEATURE_NAMES order) for one working-size RGB image"""
+    return extract_features_batch(rgb[None])[0]
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def _levels(scores: np.ndarray, thresholds: Tuple[float, ...], labels: List[str]) -> List[str]:
+    return [labels[i] for i in np.searchsorted(thresholds, scores)]
+
+
+def classify_batch(features: np.ndarray) -> List[Dict]:
+    """Soil type, pH and nutrient levels for each row of a feature matrix"""
+    z = (features - FEATURE_MEAN) / FEATURE_SCALE
+    probabilities = _softmax((z @ CLASS_WEIGHTS.T + CLASS_BIAS) / SOFTMAX_TEMPERATURE)
+    best = np.argmax(probabilities, axis=1)
+
+    bounds = np.array([PH_RANGES[name] for name in SOIL_TYPES])[best]
+    ph_levels = np.clip(bounds.mean(axis=1) + z @ PH_WEIGHTS, bounds[:, 0], bounds[:, 1])
+
+    clay = probabilities[:, [1, 2, 3]].sum(axis=1)
+    inputs = np.column_stack([z, (clay - 0.5) * 2.0, ph_levels - 6.5])
+    levels = {}
+    for nutrient in ["nitrogen", "phosphorus", "potassium", "organic_matter", "calcium", "magnesium", "sulfur"]:
+        scores = inputs @ NUTRIENT_WEIGHTS[nutrient]
+        if nutrient == "organic_matter":
+            levels[nutrient] = _levels(scores, ORGANIC_THRESHOLDS, ["Poor", "Fair", "Good", "Excellent"])
+        else:
+            levels[nutrient] = _levels(scores, NUTRIENT_THRESHOLDS, ["Low", "Medium", "High"])
+
+    return [
+        {
+            "soil_type": SOIL_TYPES[best[i]],
+            "ph_level": round(float(ph_levels[i]), 1),
+            "nutrients": {nutrient: values[i] for nutrient, values in levels.items()},
+            "confidence_score": round(float(probabilities[i, best[i]]) * 100, 1),
+            "probabilities": {name: round(float(p), 3) for name, p in zip(SOIL_TYPES, probabilities[i])},
+        }
+        for i in range(len(features))
+    ]
+
+
+def classify(features: np.ndarray) -> Dict:
+    """Soil type, pH and nutrient levels from a feature vector"""
+    return classify_batch(features[None])[0]
+
+
+def _describe(features: np.ndarray, result: Dict) -> Dict:
+    value, chroma, hue = features[0], features[1], features[2]
+    result["color"] = {
+        "munsell": munsell_notation(hue, value, chroma),
+        "hue": round(float(hue), 1),
+        "value": round(float(value), 2),
+        "chroma": round(float(chroma), 2),
+    }
+    result["features"] = {name: round(float(v), 4) for name, v in zip(FEATURE_NAMES, features)}
+    result["model_version"] = SOIL_MODEL_VERSION
+    return result
+
+
+def analyze_soil_image(source: Union[bytes, str]) -> Dict:
+    """Full pipeline for one encoded image (bytes or file path): decode, features, classification"""
+    features = extract_features(load_image(source))
+    return _describe(features, classify(features))
+
+
+def analyze_soil_batch(sources: List[Union[bytes, str]]) -> List[Dict]:
+    """
+    analyze_soil_image for many images in one call. Images are decoded one by one and
+    stacked by working size (photos from one phone share it); every FEATURE_STACK_SIZE
+    images of a size are featurized and classified as one tensor. Decoding dominates,
+    so this is only modestly faster per core than one call per image. Unreadable images
+    get {"error": ...} in their slot.
+    """
+    results: List[Dict] = [{} for _ in sources]
+    groups: Dict[Tuple[int, ...], List[Tuple[int, np.ndarray]]] = {}
+
+    def flush(members: List[Tuple[int, np.ndarray]]):
+        features = extract_features_batch(np.stack([rgb for _, rgb in members]))
+        for (i, _), row, result in zip(members, features, classify_batch(features)):
+            results[i] = _describe(row, result)
+
+    for i, source in enumerate(sources):
+        try:
+            rgb = load_image(source)
+        except Image.DecompressionBombError:
+            results[i] = {"error": "Image has too many pixels"}
+            continue
+        except OSError:  # PIL.UnidentifiedImageError or a truncated file
+            results[i] = {"error": "Could not read image"}
+            continue
+        members = groups.setdefault(rgb.shape, [])
+        members.append((i, rgb))
+        if len(members) == FEATURE_STACK_SIZE:
+            flush(members)
+            members.clear()
+
+    for members in groups.values():
+        if members:
+            flush(members)
+    return results
@@ -0,0 +1,225 @@
+"""
+WhatsApp Cloud API Client
+One shared async client for every Graph API send: pooled keep-alive connections
+(HTTP/2 when h2 is installed), explicit timeouts, and retry with exponential backoff
+and jitter on 429, 5xx, Graph throttling errors and failed connects. Every send
+attempt takes a token from one shared rate limiter, so concurrent senders together
+stay under the phone number's throughput limit. Created and closed in the app
+lifespan. Set WHATSAPP_API_BASE to send to a local Graph API stub.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 in httpx
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+WHATSAPP_API_BASE = os.getenv("WHATSAPP_API_BASE", "https://graph.facebook.com")
+WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v18.0")
+WHATSAPP_SEND_RETRIES = int(os.getenv("WHATSAPP_SEND_RETRIES", "3"))
+WHATSAPP_SEND_BACKOFF = float(os.getenv("WHATSAPP_SEND_BACKOFF_SECONDS", "0.5"))
+WHATSAPP_SEND_TIMEOUT = float(os.getenv("WHATSAPP_SEND_TIMEOUT_SECONDS", "10"))
+WHATSAPP_MAX_CONNECTIONS = int(os.getenv("WHATSAPP_MAX_CONNECTIONS", "20"))
+# Cloud API throughput per business phone number (80 messages/s by default); 0 disables
+WHATSAPP_SEND_RATE = float(os.getenv("WHATSAPP_SEND_RATE", "80"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Graph API throttling can also come back as HTTP 400 with one of these error codes
+RETRY_ERROR_CODES = {4, 80007, 130429, 131056}
+# Failures where the request never reached the API, so resending can't duplicate a message.
+# Read timeouts are not retried: the message may already have been delivered.
+RETRY_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class WhatsAppSendError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None, error_code=None,
+                 retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+        # Whether a later resend may succeed, and when the API asked us to come back
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class WhatsAppNotConfigured(WhatsAppSendError):
+    pass
+
+
+def format_phone(phone_number: str) -> str:
+    """Graph API recipient format: digits only, no '+', spaces or dashes"""
+    return phone_number.replace("+", "").replace(" ", "").replace("-", "")
+
+
+def _retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(float(response.headers["Retry-After"]), 30.0)
+    return None
+
+
+def _error_details(response: httpx.Response):
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return response.text[:200] or "Unknown error", "N/A"
+    return error.get("message", "Unknown error"), error.get("code", "N/A")
+
+
+class SendRateLimiter:
+    """
+    Token bucket: rate sends per second with bursts of up to burst (a tenth of a
+    second's worth by default, so no one-second window goes far over rate). Callers
+    reserve a token and sleep until it is due, so waiters are served in arrival order
+    without a lock.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate / 10)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waited = 0.0
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        delay = self._reserve()
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+
+class WhatsAppClient:
+    def __init__(self, base_url: str = WHATSAPP_API_BASE, api_version: str = WHATSAPP_API_VERSION,
+                 retries: int = WHATSAPP_SEND_RETRIES, backoff: float = WHATSAPP_SEND_BACKOFF,
+                 timeout: float = WHATSAPP_SEND_TIMEOUT, max_connections: int = WHATSAPP_MAX_CONNECTIONS,
+                 rate: float = WHATSAPP_SEND_RATE):
+        self.base_url = base_url.rstrip("/")
+        self.api_version = api_version
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.limiter = SendRateLimiter(rate)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.sent = self.failed = self.retried = 0
+
+    async def start(self):
+        """Create the connection pool now rather than on the first send"""
+        if self._client is None:
+            self._client = self._open()
+
+    async def stop(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    def _open(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=HAS_HTTP2,
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = self._open()
+        return self._client
+
+    @staticmethod
+    def credentials():
+        """(access token, phone number ID) from the environment; read per send so .env edits apply"""
+        return os.getenv("WHATSAPP_ACCESS_TOKEN"), os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+
+    @property
+    def configured(self) -> bool:
+        return all(self.credentials())
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        retry_after = _retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        return self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+
+    async def send_text(self, to: str, body: str, retries: Optional[int] = None) -> dict:
+        """
+        Send a text message; returns the Graph API response body. Raises
+        WhatsAppNotConfigured without credentials and WhatsAppSendError when the API
+        rejects the message or still fails after the retries.
+        """
+        return await self.send(to, {"type": "text", "text": {"body": body}}, retries)
+
+    async def send(self, to: str, message: dict, retries: Optional[int] = None) -> dict:
+        """
+        Send any message object ({"type": "text", "text": ...}, {"type": "template",
+        "template": ...}). retries overrides the client's retry count; callers that
+        schedule their own retries pass 0.
+        """
+        access_token, phone_number_id = self.credentials()
+        if not access_token or not phone_number_id:
+            raise WhatsAppNotConfigured(
+                "WhatsApp API credentials not configured. Please set WHATSAPP_ACCESS_TOKEN and WHATSAPP_PHONE_NUMBER_ID"
+            )
+        payload = {"messaging_product": "whatsapp", "to": format_phone(to), **message}
+        url = f"/{self.api_version}/{phone_number_id}/messages"
+        headers = {"Authorization": f"Bearer {access_token}"}
+        retries = self.retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            response = None
+            await self.limiter.acquire()
+            try:
+                response = await self.client.post(url, headers=headers, json=payload)
+                if response.status_code == 200:
+                    self.sent += 1
+                    return response.json()
+                reason, error_code = _error_details(response)
+                retryable = response.status_code in RETRY_STATUS_CODES or error_code in RETRY_ERROR_CODES
+                error = WhatsAppSendError(f"WhatsApp API error: {reason} (Code: {error_code})",
+                                          response.status_code, error_code, retryable, _retry_after(response))
+            except RETRY_TRANSPORT_ERRORS as e:
+                retryable = True
+                error = WhatsAppSendError(f"Could not reach WhatsApp API: {e or e.__class__.__name__}",
+                                          retryable=True)
+            except httpx.HTTPError as e:
+                retryable = False
+                error = WhatsAppSendError(f"WhatsApp API request failed: {e or e.__class__.__name__}")
+            if not retryable or attempt == retries:
+                self.failed += 1
+                raise error
+            self.retried += 1
+            delay = self._retry_delay(attempt, response)
+            logging.warning(f"WhatsApp send to {payload['to']} failed ({error}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "configured": self.configured,
+            "http2": HAS_HTTP2,
+            "rate_per_second": self.limiter.rate,
+            "rate_limited_seconds": round(self.limiter.waited, 2),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+whatsapp_client = WhatsAppClient()
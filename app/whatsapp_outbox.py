@@ -0,0 +1,412 @@
+"""
+WhatsApp Outbox
+Durable queue (SQLite) for outbound messages that don't answer a farmer directly:
+price alerts, weather warnings and other broadcasts to many subscribers. A broadcast
+is expanded into one row per recipient; a dispatcher claims due rows and a fixed
+number of workers send them through the shared WhatsApp client, whose rate limiter
+keeps the total at the phone number's throughput limit. Failed sends that may
+succeed later are rescheduled with backoff instead of being retried inline, and the
+queue survives restarts: shutdown requeues claimed rows and waits for sends in
+flight, and rows a crash leaves mid-send are sent again (at least once).
+
+The messaging tier (unique users a business may start conversations with per 24
+hours) is checked when a broadcast is queued, so one that can't go out in full is
+refused up front rather than failing part way through.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.whatsapp_client import WhatsAppClient, WhatsAppSendError, format_phone, whatsapp_client
+
+WHATSAPP_OUTBOX_PATH = os.getenv("WHATSAPP_OUTBOX_PATH", "data/whatsapp_outbox.db")
+# Sends in flight at once; at the default 80/s and ~300 ms per send about 24 are busy
+WHATSAPP_OUTBOX_CONCURRENCY = int(os.getenv("WHATSAPP_OUTBOX_CONCURRENCY", "32"))
+WHATSAPP_OUTBOX_MAX_ATTEMPTS = int(os.getenv("WHATSAPP_OUTBOX_MAX_ATTEMPTS", "5"))
+WHATSAPP_OUTBOX_BACKOFF = float(os.getenv("WHATSAPP_OUTBOX_BACKOFF_SECONDS", "2"))
+# Unique recipients per rolling 24 hours allowed by the number's messaging tier
+# (250, 1000, 10000 or 100000); 0 for unlimited
+WHATSAPP_MESSAGING_TIER = int(os.getenv("WHATSAPP_MESSAGING_TIER", "1000"))
+# Sent and failed rows are kept this long for progress reports and the tier count
+WHATSAPP_OUTBOX_RETENTION_DAYS = float(os.getenv("WHATSAPP_OUTBOX_RETENTION_DAYS", "7"))
+# How long shutdown waits for sends already on the wire
+WHATSAPP_OUTBOX_DRAIN_TIMEOUT = float(os.getenv("WHATSAPP_OUTBOX_DRAIN_TIMEOUT_SECONDS", "5"))
+
+TIER_WINDOW_SECONDS = 24 * 3600
+PRUNE_INTERVAL_SECONDS = 3600
+DISPATCH_RETRY_SECONDS = 1.0
+MAX_RETRY_DELAY = 300.0
+PHONE_PATTERN = re.compile(r"^\d{8,15}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    total INTEGER NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    broadcast_id TEXT,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    sent_at REAL,
+    message_id TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_broadcast ON outbox (broadcast_id, status);
+CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox (sent_at);
+"""
+
+# Row states: queued (waiting or scheduled for retry), sending, sent, failed
+STATUSES = ("queued", "sending", "sent", "failed")
+
+
+class TierLimitExceeded(Exception):
+    pass
+
+
+def normalize_recipients(recipients: List[str]) -> Tuple[List[str], List[str], int]:
+    """(valid numbers in order without repeats, invalid entries, repeats dropped)"""
+    valid, invalid, seen = [], [], set()
+    for recipient in recipients:
+        number = format_phone(str(recipient).strip())
+        if not PHONE_PATTERN.match(number):
+            invalid.append(recipient)
+        elif number not in seen:
+            seen.add(number)
+            valid.append(number)
+    return valid, invalid, len(recipients) - len(valid) - len(invalid)
+
+
+class OutboxStore:
+    """Thread-safe wrapper around a single SQLite connection"""
+
+    def __init__(self, path: str = WHATSAPP_OUTBOX_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and path != ":memory:":
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add_broadcast(self, broadcast_id: str, recipients: List[str], message: dict, now: float, tier: int = 0):
+        """
+        Queue one row per recipient. With a tier, the tier count and the insert share one
+        write transaction, so concurrent broadcasts (from any process) can't both fit
+        into the same remaining allowance; raises TierLimitExceeded instead.
+        """
+        encoded = json.dumps(message)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if tier > 0:
+                in_window = self._recipients_in_window(now - TIER_WINDOW_SECONDS)
+                if in_window + len(recipients) > tier:
+                    raise TierLimitExceeded(
+                        f"{len(recipients)} recipients would exceed the messaging tier of {tier} users per 24 "
+                        f"hours ({max(0, tier - in_window)} left)"
+                    )
+            self._conn.execute(
+                "INSERT INTO broadcasts (id, created_at, total, message) VALUES (?, ?, ?, ?)",
+                (broadcast_id, now, len(recipients), encoded),
+            )
+            self._conn.executemany(
+                "INSERT INTO outbox (broadcast_id, recipient, message, status, next_attempt_at) "
+                "VALUES (?, ?, ?, 'queued', ?)",
+                ((broadcast_id, recipient, encoded, now) for recipient in recipients),
+            )
+
+    def claim_due(self, limit: int, now: float) -> List[sqlite3.Row]:
+        """Mark up to limit due rows as sending and return them, oldest first"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, recipient, message, attempts FROM outbox "
+                "WHERE status = 'queued' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            self._conn.executemany("UPDATE outbox SET status = 'sending' WHERE id = ?", ((row["id"],) for row in rows))
+        return rows
+
+    def record(self, results: List[tuple]):
+        """Apply (status, attempts, next_attempt_at, sent_at, message_id, error, row id) updates"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, sent_at = ?, "
+                "message_id = ?, error = ? WHERE id = ?",
+                results,
+            )
+
+    def requeue_sending(self) -> int:
+        """Rows left in sending by a crash go back to the queue"""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending'").rowcount
+
+    def requeue(self, row_ids: List[int]):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE outbox SET status = 'queued' WHERE id = ?", ((row_id,) for row_id in row_ids))
+
+    def prune(self, before: float) -> int:
+        """Delete finished rows (and emptied broadcasts) last touched before the given time"""
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND next_attempt_at < ?", (before,)
+            ).rowcount
+            self._conn.execute("DELETE FROM broadcasts WHERE id NOT IN (SELECT DISTINCT broadcast_id FROM outbox "
+                               "WHERE broadcast_id IS NOT NULL)")
+        return deleted
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'queued'").fetchone()
+        return row[0]
+
+    def counts(self, broadcast_id: Optional[str] = None) -> Dict[str, int]:
+        query = "SELECT status, COUNT(*) FROM outbox"
+        args: tuple = ()
+        if broadcast_id is not None:
+            query += " WHERE broadcast_id = ?"
+            args = (broadcast_id,)
+        with self._lock:
+            found = dict(self._conn.execute(query + " GROUP BY status", args).fetchall())
+        return {status: found.get(status, 0) for status in STATUSES}
+
+    def broadcast(self, broadcast_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT b.id, b.created_at, b.total, MAX(o.sent_at) AS last_sent "
+                "FROM broadcasts b LEFT JOIN outbox o ON o.broadcast_id = b.id WHERE b.id = ? GROUP BY b.id",
+                (broadcast_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def _recipients_in_window(self, since: float) -> int:
+        """Unique recipients messaged since the given time or still waiting to be (caller holds the lock)"""
+        return self._conn.execute(
+            "SELECT COUNT(DISTINCT recipient) FROM outbox WHERE sent_at >= ? OR status IN ('queued', 'sending')",
+            (since,),
+        ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboundQueue:
+    def __init__(self, path: str = WHATSAPP_OUTBOX_PATH, client: WhatsAppClient = whatsapp_client,
+                 concurrency: int = WHATSAPP_OUTBOX_CONCURRENCY, max_attempts: int = WHATSAPP_OUTBOX_MAX_ATTEMPTS,
+                 backoff: float = WHATSAPP_OUTBOX_BACKOFF, tier: int = WHATSAPP_MESSAGING_TIER):
+        self.path = path
+        self.client = client
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.tier = tier
+        self.retention = WHATSAPP_OUTBOX_RETENTION_DAYS * 86400
+        self._pruned_at = 0.0
+        self._store: Optional[OutboxStore] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._workers: List[asyncio.Task] = []
+        self.in_flight = 0
+        self._results: List[tuple] = []
+        self._recent_sends: deque = deque()
+        self.sent = self.failed = self.retried = 0
+        self.dispatch_errors = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def store(self) -> OutboxStore:
+        if self._store is None:
+            self._store = OutboxStore(self.path)
+        return self._store
+
+    async def start(self):
+        if self._dispatcher is not None:
+            return
+        requeued = await asyncio.to_thread(self.store.requeue_sending)
+        if requeued:
+            logging.warning(f"WhatsApp outbox: {requeued} messages interrupted mid-send will be sent again")
+        # Claimed rows waiting for a worker; kept short so a restart strands few of them
+        self._queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Requeue claimed rows no worker has started, let sends in flight finish, then stop"""
+        if self._dispatcher is None:
+            return
+        dispatcher, self._dispatcher = self._dispatcher, None
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+        unstarted = []
+        while not self._queue.empty():
+            unstarted.append(self._queue.get_nowait()["id"])
+        await asyncio.to_thread(self.store.requeue, unstarted)
+        deadline = time.monotonic() + WHATSAPP_OUTBOX_DRAIN_TIMEOUT
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Sends cut off by the timeout stay in sending and are requeued on the next start
+        await self._flush()
+        if self._store is not None:
+            store, self._store = self._store, None
+            store.close()
+
+    async def broadcast(self, recipients: List[str], message: dict) -> str:
+        """
+        Queue message for every recipient; returns the broadcast ID. Raises
+        TierLimitExceeded if the recipients would take the number past its messaging tier.
+        """
+        broadcast_id = uuid.uuid4().hex[:12]
+        await asyncio.to_thread(self.store.add_broadcast, broadcast_id, recipients, message, time.time(), self.tier)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return broadcast_id
+
+    async def _dispatch(self):
+        """Keep the worker queue topped up with due rows and write results back in batches"""
+        while True:
+            try:
+                await self._dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. database locked or disk full: keep the dispatcher alive and try again
+                self.dispatch_errors += 1
+                self.last_error = str(e)
+                logging.error(f"WhatsApp outbox dispatch failed, retrying: {e}")
+                await asyncio.sleep(DISPATCH_RETRY_SECONDS)
+
+    async def _dispatch_once(self):
+        await self._flush()
+        free = self._queue.maxsize - self._queue.qsize()
+        rows = await asyncio.to_thread(self.store.claim_due, free, time.time()) if free else []
+        for row in rows:
+            self._queue.put_nowait(row)
+        if rows or not free:
+            # Come back once the workers have taken some of them
+            await asyncio.sleep(0.05)
+            return
+        if time.time() - self._pruned_at > PRUNE_INTERVAL_SECONDS:
+            self._pruned_at = time.time()
+            await asyncio.to_thread(self.store.prune, self._pruned_at - self.retention)
+        next_due = await asyncio.to_thread(self.store.next_due)
+        timeout = min(1.0, max(0.05, next_due - time.time())) if next_due else 1.0
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _flush(self):
+        if self._results:
+            results, self._results = self._results, []
+            try:
+                await asyncio.to_thread(self.store.record, results)
+            except BaseException:
+                # Keep them for the next flush rather than leaving the rows in sending
+                self._results[:0] = results
+                raise
+
+    def _retry_delay(self, attempts: int, error: WhatsAppSendError) -> float:
+        if error.retry_after is not None:
+            return error.retry_after
+        return min(MAX_RETRY_DELAY, self.backoff * 2 ** (attempts - 1) + random.uniform(0, self.backoff))
+
+    async def _work(self):
+        while True:
+            row = await self._queue.get()
+            attempts = row["attempts"] + 1
+            self.in_flight += 1
+            try:
+                response = await self.client.send(row["recipient"], json.loads(row["message"]), retries=0)
+                now = time.time()
+                message_id = (response.get("messages") or [{}])[0].get("id")
+                self._results.append(("sent", attempts, now, now, message_id, None, row["id"]))
+                self.sent += 1
+                self._recent_sends.append(time.monotonic())
+            except WhatsAppSendError as e:
+                if e.retryable and attempts < self.max_attempts:
+                    self.retried += 1
+                    retry_at = time.time() + self._retry_delay(attempts, e)
+                    self._results.append(("queued", attempts, retry_at, None, None, str(e), row["id"]))
+                else:
+                    self.failed += 1
+                    self._results.append(("failed", attempts, time.time(), None, None, str(e), row["id"]))
+            except Exception as e:
+                logging.error(f"WhatsApp outbox send {row['id']} to {row['recipient']} failed: {e}")
+                self.failed += 1
+                self._results.append(("failed", attempts, time.time(), None, None, str(e), row["id"]))
+            finally:
+                self.in_flight -= 1
+
+    def throughput(self, window: float = 10.0) -> float:
+        """Messages sent per second over the last window seconds"""
+        cutoff = time.monotonic() - window
+        while self._recent_sends and self._recent_sends[0] < cutoff:
+            self._recent_sends.popleft()
+        return round(len(self._recent_sends) / window, 1)
+
+    async def progress(self, broadcast_id: str) -> Optional[dict]:
+        await self._flush()
+        info = await asyncio.to_thread(self.store.broadcast, broadcast_id)
+        if info is None:
+            return None
+        counts = await asyncio.to_thread(self.store.counts, broadcast_id)
+        done = counts["sent"] + counts["failed"]
+        remaining = info["total"] - done
+        # Rate since the broadcast was queued, so waiting behind another one shows in the ETA
+        until = info["last_sent"] if not remaining and info["last_sent"] else time.time()
+        elapsed = until - info["created_at"]
+        rate = counts["sent"] / elapsed if elapsed > 0 else 0.0
+        return {
+            "broadcast_id": broadcast_id,
+            "created_at": datetime.fromtimestamp(info["created_at"], timezone.utc).isoformat(),
+            "total": info["total"],
+            **counts,
+            "progress_percent": round(100 * done / info["total"], 1) if info["total"] else 100.0,
+            "messages_per_second": round(rate, 1),
+            "eta_seconds": round(remaining / rate, 1) if rate and remaining else (0.0 if not remaining else None),
+            "complete": remaining == 0,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "running": self._dispatcher is not None,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "claimed_waiting": self._queue.qsize() if self._queue is not None else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dispatch_errors": self.dispatch_errors,
+            "last_error": self.last_error,
+            "messages_per_second": self.throughput(),
+            "rate_limit_per_second": self.client.limiter.rate,
+            "messaging_tier": self.tier or "unlimited",
+        }
+
+
+outbox = OutboundQueue()
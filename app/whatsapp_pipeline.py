@@ -0,0 +1,120 @@
+"""
+WhatsApp Reply Pipeline
+Background workers that turn incoming webhook messages into replies and send them,
+so the webhook only validates, enqueues and acknowledges. Each worker owns a bounded
+queue and messages are sharded by sender, so one farmer's messages are answered in
+the order they arrived while different farmers are served concurrently. A worker
+takes whatever has queued up (up to a batch size) and hands it to the handler as one
+batch, so bursts are classified together. When the
+queues are full the webhook is told to refuse the delivery (Meta redelivers later)
+rather than letting the backlog grow without limit.
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+WHATSAPP_WORKERS = int(os.getenv("WHATSAPP_WORKERS", "32"))
+WHATSAPP_BATCH_SIZE = int(os.getenv("WHATSAPP_BATCH_SIZE", "32"))
+# Messages waiting per worker before deliveries are refused
+WHATSAPP_QUEUE_LIMIT = int(os.getenv("WHATSAPP_QUEUE_LIMIT", "200"))
+# How long shutdown waits for queued messages to be answered
+WHATSAPP_DRAIN_TIMEOUT = float(os.getenv("WHATSAPP_DRAIN_TIMEOUT_SECONDS", "10"))
+
+
+class PipelineFull(Exception):
+    pass
+
+
+class ReplyPipeline:
+    def __init__(self, handler: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+                 workers: int = WHATSAPP_WORKERS, queue_limit: int = WHATSAPP_QUEUE_LIMIT,
+                 batch_size: int = WHATSAPP_BATCH_SIZE, drain_timeout: float = WHATSAPP_DRAIN_TIMEOUT):
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_limit = queue_limit
+        self.drain_timeout = drain_timeout
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self.enqueued = self.processed = self.errors = self.rejected = self.batches = 0
+        self.max_wait = 0.0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_limit) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def stop(self):
+        """Finish queued messages (up to drain_timeout), then stop the workers"""
+        if not self._tasks:
+            return
+        tasks, self._tasks = self._tasks, []
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"WhatsApp pipeline stopped with {self.backlog} messages unanswered")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _shard(self, sender: Optional[str]) -> int:
+        return zlib.crc32((sender or "").encode()) % len(self._queues)
+
+    def submit(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        Queue messages for background handling, all or none: raises PipelineFull if any
+        sender's queue lacks room, so a refused delivery can be redelivered whole.
+        """
+        if not self._tasks:
+            raise PipelineFull("WhatsApp pipeline is not running")
+        shards = [self._shard(message.get("from")) for message in messages]
+        for shard, count in Counter(shards).items():
+            queue = self._queues[shard]
+            if count > self.queue_limit - queue.qsize():
+                self.rejected += len(messages)
+                raise PipelineFull(f"{queue.qsize()} messages already waiting for this worker")
+        now = time.perf_counter()
+        for shard, message in zip(shards, messages):
+            self._queues[shard].put_nowait((now, message))
+        self.enqueued += len(messages)
+        return len(messages)
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self.max_wait = max(self.max_wait, time.perf_counter() - batch[0][0])
+            messages = [message for _, message in batch]
+            try:
+                await self.handler(messages)
+                self.processed += len(messages)
+            except Exception as e:
+                self.errors += len(messages)
+                logging.error(f"WhatsApp batch of {len(messages)} messages failed: {e}")
+            finally:
+                self.batches += 1
+                for _ in batch:
+                    queue.task_done()
+
+    @property
+    def backlog(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "backlog": self.backlog,
+            "queue_limit": self.queue_limit,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "mean_batch_size": round((self.processed + self.errors) / self.batches, 2) if self.batches else 0,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "max_wait_seconds": round(self.max_wait, 3),
+        }
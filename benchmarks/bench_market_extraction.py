@@ -0,0 +1,81 @@
+"""
+Benchmark: market price HTML extraction
+Compares the original scrape_punjab_prices parsing path (html.parser + regex
+find_all over the whole document) against the compiled SiteSpec extractors,
+using the pages in fixtures/market/. Those pages are synthetic, built to mimic the
+todaypricerates layout, so the speedups are indicative until real captures are
+checked in.
+
+Usage: python benchmarks/bench_market_extraction.py [iterations]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bs4 import BeautifulSoup
+
+from app.market_extraction import EXTRACTORS, SITE_SPECS
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "..", "fixtures", "market")
+
+
+def legacy_extract(content: bytes) -> list:
+    """Parsing path of scrape_punjab_prices before the extraction engine"""
+    soup = BeautifulSoup(content, 'html.parser')
+    prices = []
+    price_tables = soup.find_all(['table', 'div'], class_=re.compile(r'price|market|vegetable', re.I))
+    for table in price_tables:
+        rows = table.find_all('tr') or table.find_all('div', class_=re.compile(r'row|item', re.I))
+        for row in rows:
+            cells = row.find_all(['td', 'th', 'div'])
+            if len(cells) >= 2:
+                try:
+                    commodity_text = cells[0].get_text(strip=True)
+                    price_text = cells[1].get_text(strip=True)
+                    price_match = re.search(r'[\d,]+', price_text.replace(',', ''))
+                    if price_match:
+                        price = float(price_match.group().replace(',', ''))
+                        unit = "quintal"
+                        if "kg" in price_text.lower():
+                            unit = "kg"
+                        elif "ton" in price_text.lower():
+                            unit = "ton"
+                        prices.append({"commodity": commodity_text, "price": price, "unit": unit})
+                except (ValueError, IndexError):
+                    continue
+    return prices
+
+
+def bench(label: str, fn, pages: list, iterations: int):
+    rows = sum(len(fn(content)) for content in pages)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for content in pages:
+            fn(content)
+    elapsed = time.perf_counter() - start
+    per_page_ms = elapsed / (iterations * len(pages)) * 1000
+    print(f"{label:<10} {per_page_ms:8.3f} ms/page   rows/pass={rows}")
+    return per_page_ms
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    pages = []
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+                pages.append(f.read())
+    print(f"{len(pages)} synthetic fixture page(s), {iterations} iterations")
+
+    spec = SITE_SPECS["todaypricerates"]
+    baseline = bench("legacy", legacy_extract, pages, iterations)
+    for backend, extractor in EXTRACTORS.items():
+        per_page = bench(backend, lambda content, e=extractor: e(content, spec), pages, iterations)
+        print(f"{'':<10} {baseline / per_page:8.1f}x faster than legacy")
+
+
+if __name__ == "__main__":
+    main()
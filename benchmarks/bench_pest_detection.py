@@ -0,0 +1,232 @@
+"""
+Benchmark: pest detection
+Checks app/pest_vision.py on synthetic leaf photos (one per symptom kind), then
+measures latency and throughput at batch sizes 1, 8 and 32: first the batched forward
+pass alone (decode included), then end to end through the micro-batching scheduler
+with that many concurrent requests against the image executor (IMAGE_WORKERS).
+Finally compares whole-image and tiled detection on synthetic 4000x3000 field photos
+(small insects and lesions on scattered leaves), and shows tiled compute following
+the leaf area of the frame.
+
+Usage: python benchmarks/bench_pest_detection.py [width] [height] [requests]
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.image_executor import MicroBatcher, image_executor
+from app.pest_vision import detect_pests, detect_pests_batch, detect_pests_tiled
+
+BACKGROUND = (70, 75, 85)
+LEAF = (60, 130, 50)
+SOIL = (125, 100, 75)
+BATCH_SIZES = [1, 8, 32]
+FIELD_SIZE = (4000, 3000)
+LEAF_SHARES = [0.1, 0.3, 0.6, 0.9]
+
+
+def _disc(mask: np.ndarray, cy: float, cx: float, radius: float):
+    y0, y1 = max(0, int(cy - radius)), min(mask.shape[0], int(cy + radius) + 2)
+    x0, x1 = max(0, int(cx - radius)), min(mask.shape[1], int(cx + radius) + 2)
+    if y0 >= y1 or x0 >= x1:
+        return
+    y, x = np.ogrid[y0:y1, x0:x1]
+    mask[y0:y1, x0:x1] |= (y - cy) ** 2 + (x - cx) ** 2 <= radius ** 2
+
+
+def _paint(rgb: np.ndarray, leaf: np.ndarray, kind: str, rng, scale: float):
+    """Paint the symptoms of the given kind onto the leaf pixels of rgb"""
+    height, width = leaf.shape
+    leaf_y, leaf_x = np.nonzero(leaf)
+
+    def on_leaf():
+        i = rng.integers(len(leaf_y))
+        return leaf_y[i], leaf_x[i]
+
+    def disc(cy, cx, r, color):
+        mask = np.zeros_like(leaf)
+        _disc(mask, cy, cx, r)
+        rgb[mask & leaf] = color
+
+    def spots(count, radius, color, halo=None):
+        for _ in range(count):
+            cy, cx = on_leaf()
+            r = radius * rng.uniform(0.7, 1.3)
+            if halo is not None:
+                disc(cy, cx, r * 1.5, halo)
+            disc(cy, cx, r, color)
+
+    if kind == "aphids":
+        for _ in range(6):
+            cy, cx = on_leaf()
+            for _ in range(40):
+                disc(cy + rng.normal(0, 60 * scale), cx + rng.normal(0, 60 * scale), 6 * scale, (30, 45, 20))
+    elif kind == "whitefly":
+        spots(160, 7 * scale, (240, 240, 235))
+    elif kind == "powdery mildew":
+        blotch = rng.normal(0, 1, (height // 100 + 1, width // 100 + 1)).repeat(100, 0).repeat(100, 1)[:height, :width]
+        powder = leaf & (blotch > 0.3)
+        rgb[powder] = 0.25 * rgb[powder] + 0.75 * np.array([225, 228, 220])
+    elif kind == "leaf spot":
+        spots(30, 35 * scale, (95, 60, 30), halo=(170, 160, 50))
+    elif kind == "rust":
+        spots(250, 8 * scale, (215, 110, 25))
+    elif kind == "leaf miner":
+        for _ in range(6):
+            cy, cx = on_leaf()
+            angle = rng.uniform(0, 2 * np.pi)
+            for _ in range(160):
+                angle += rng.normal(0, 0.25)
+                cy, cx = cy + 6 * scale * np.sin(angle), cx + 6 * scale * np.cos(angle)
+                disc(cy, cx, 5 * scale, (185, 200, 140))
+    elif kind == "caterpillar":
+        spots(12, 60 * scale, BACKGROUND)
+
+
+def _leaf_texture(rng, height: int, width: int) -> np.ndarray:
+    return 1 + 0.06 * rng.normal(0, 1, (height // 8 + 1, width // 8 + 1)).repeat(8, 0).repeat(8, 1)[:height, :width]
+
+
+def _jpeg(rgb: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=88)
+    return buffer.getvalue()
+
+
+def synthetic_leaf(kind: str, width: int, height: int, seed: int = 3) -> bytes:
+    """A leaf filling most of the frame, with the symptoms of the given kind painted on"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:height, :width]
+    leaf = ((y - height / 2) / (height * 0.46)) ** 2 + ((x - width / 2) / (width * 0.47)) ** 2 <= 1
+    rgb = np.empty((height, width, 3))
+    rgb[:] = BACKGROUND
+    rgb[leaf] = np.array(LEAF)[None, :] * _leaf_texture(rng, height, width)[leaf][:, None]
+    # Patches are sized for the leaf, not the frame
+    _paint(rgb, leaf, kind, rng, width / 1600)
+    return _jpeg(rgb)
+
+
+def synthetic_field(kind: str, width: int, height: int, leaf_share: float, seed: int = 5) -> bytes:
+    """
+    A field photo: soil with scattered leaves covering about leaf_share of the frame,
+    and insects/lesions at field scale (a few pixels once downscaled for the model)
+    """
+    rng = np.random.default_rng(seed)
+    soil = 1 + 0.1 * rng.normal(0, 1, (height // 4 + 1, width // 4 + 1)).repeat(4, 0).repeat(4, 1)[:height, :width]
+    rgb = np.array(SOIL, dtype=float)[None, None, :] * soil[..., None]
+    leaf = np.zeros((height, width), dtype=bool)
+    while leaf.mean() < leaf_share:
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        ry, rx = rng.uniform(0.04, 0.08) * height, rng.uniform(0.06, 0.12) * width
+        y0, y1 = max(0, int(cy - ry)), min(height, int(cy + ry) + 1)
+        x0, x1 = max(0, int(cx - rx)), min(width, int(cx + rx) + 1)
+        y, x = np.ogrid[y0:y1, x0:x1]
+        leaf[y0:y1, x0:x1] |= ((y - cy) / ry) ** 2 + ((x - cx) / rx) ** 2 <= 1
+    rgb[leaf] = np.array(LEAF)[None, :] * _leaf_texture(rng, height, width)[leaf][:, None]
+    if kind != "healthy":
+        _paint(rgb, leaf, kind, rng, width / 4000)
+    return _jpeg(rgb)
+
+
+KINDS = {
+    "healthy": None,
+    "aphids": "Aphids",
+    "whitefly": "Whitefly",
+    "powdery mildew": "Powdery Mildew",
+    "leaf spot": "Leaf Spot",
+    "rust": "Rust",
+    "leaf miner": "Leaf Miner",
+    "caterpillar": "Caterpillar",
+}
+
+
+async def scheduler_run(photos, max_batch: int, requests: int):
+    """requests concurrent detections (max_batch at a time) through a MicroBatcher"""
+    batcher = MicroBatcher(detect_pests_batch, max_batch=max_batch, max_wait=0.01)
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await batcher.submit(photos[i % len(photos)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for offset in range(0, requests, max_batch):
+        await asyncio.gather(*(one(i) for i in range(offset, min(offset + max_batch, requests))))
+    return time.perf_counter() - start, latencies, batcher.stats()
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1600
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1200
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+
+    photos = []
+    for kind, expected in KINDS.items():
+        data = synthetic_leaf(kind, width, height)
+        photos.append(data)
+        result = detect_pests(data)
+        found = [p["name"] for p in result["detected_pests"]]
+        top = max(result["probabilities"], key=result["probabilities"].get)
+        mark = "ok" if (found[:1] == [expected] if expected else not found) else "MISS"
+        print(f"{kind:15s} -> {top:15s} {result['probabilities'][top]:.2f}  detected {found}  [{mark}]")
+
+    print("\nbatched forward pass (decode + features + classifier), 32 photos")
+    photo_set = [photos[i % len(photos)] for i in range(32)]
+    for size in BATCH_SIZES:
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for offset in range(0, len(photo_set), size):
+                detect_pests_batch(photo_set[offset:offset + size])
+            times.append(time.perf_counter() - start)
+        per_image = float(np.median(times)) / len(photo_set)
+        print(f"batch {size:2d}: {per_image * size * 1000:7.1f} ms per batch, {per_image * 1000:5.1f} ms per image, "
+              f"{1 / per_image:6.1f} images/s")
+
+    print(f"\nmicro-batching scheduler, {requests} requests, {image_executor.workers} workers")
+    image_executor.start()
+    try:
+        for size in BATCH_SIZES:
+            elapsed, latencies, stats = asyncio.run(scheduler_run(photos, size, requests))
+            print(f"max batch {size:2d}: {requests / elapsed:6.1f} images/s, latency p50 "
+                  f"{np.percentile(latencies, 50) * 1000:6.1f} ms p95 {np.percentile(latencies, 95) * 1000:6.1f} ms, "
+                  f"mean batch {stats['mean_batch_size']}")
+    finally:
+        asyncio.run(image_executor.stop())
+
+    print(f"\nfield photos {FIELD_SIZE[0]}x{FIELD_SIZE[1]}, 35% leaf: whole image vs tiled")
+    for kind, expected in KINDS.items():
+        data = synthetic_field(kind, *FIELD_SIZE, leaf_share=0.35)
+        line = f"{kind:15s}"
+        for name, detect in (("whole", detect_pests), ("tiled", detect_pests_tiled)):
+            start = time.perf_counter()
+            result = detect(data)
+            elapsed = time.perf_counter() - start
+            found = [p["name"] for p in result["detected_pests"]]
+            mark = "ok" if (expected in found if expected else not found) else "MISS"
+            line += f"  {name} {elapsed * 1000:5.0f} ms {str(found):28s} [{mark:4s}]"
+        print(line)
+
+    print("\ntiled detection vs leaf area (healthy field photo)")
+    for share in LEAF_SHARES:
+        data = synthetic_field("healthy", *FIELD_SIZE, leaf_share=share)
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            result = detect_pests_tiled(data)
+            times.append(time.perf_counter() - start)
+        tiles = result["tiles"]
+        print(f"leaf {share:.0%}: {tiles['analyzed']:3d}/{tiles['total']} tiles analyzed, "
+              f"{float(np.median(times)) * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
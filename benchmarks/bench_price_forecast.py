@@ -0,0 +1,81 @@
+"""
+Benchmark: price forecast backtest
+Rolling-origin backtest of the forecaster in app/price_forecast.py (Holt, or the
+naive forecast where Holt loses on the holdout) against pure Holt and a naive
+last-price forecast, on synthetic daily series (trend + seasonality + noise)
+sized like production (40 commodities x 10 states). Reports accuracy (MAPE),
+batch fit time and per-commodity forecast evaluation time.
+
+Usage: python benchmarks/bench_price_forecast.py [days] [horizon]
+"""
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.price_analytics import PriceSeries
+from app.price_forecast import Forecaster, fit_holt
+
+N_SERIES = 400
+ORIGINS = 8
+
+
+def synthetic_prices(n_series: int, n_days: int, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_days)[None, :]
+    base = rng.uniform(500, 10000, (n_series, 1))
+    drift = rng.normal(0, 0.0005, (n_series, 1))
+    season = 0.08 * np.sin(2 * np.pi * (t + rng.uniform(0, 365, (n_series, 1))) / 365)
+    walk = np.cumsum(rng.normal(0, 0.01, (n_series, n_days)), axis=1)
+    return base * np.exp(drift * t + season + walk)
+
+
+def mape(actual: np.ndarray, predicted: np.ndarray) -> float:
+    return float(np.mean(np.abs(predicted - actual) / actual) * 100)
+
+
+def main():
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    horizon = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    values = synthetic_prices(N_SERIES, n_days)
+    commodities = [f"commodity-{i}" for i in range(N_SERIES)]
+    start = np.datetime64(date(2024, 1, 1), "D")
+
+    holt_errors, naive_errors, chosen_errors, naive_share, fit_times = [], [], [], [], []
+    for k in range(ORIGINS, 0, -1):
+        origin = n_days - horizon * k
+        train = values[:, :origin]
+        actual = values[:, origin:origin + horizon]
+        series = PriceSeries(commodities, np.arange(start, start + origin), train)
+
+        forecaster = Forecaster()
+        t0 = time.perf_counter()
+        forecaster.fit_series("bench", series)
+        fit_times.append(time.perf_counter() - t0)
+
+        models = [forecaster.models[("bench", c)] for c in commodities]
+        chosen_errors.append(mape(actual, np.array([m.forecast(horizon) for m in models])))
+        naive_share.append(np.mean([m.kind == "naive" for m in models]))
+        _, _, level, trend, _ = fit_holt(train)
+        holt_errors.append(mape(actual, level[:, None] + trend[:, None] * np.arange(1, horizon + 1)[None, :]))
+        naive_errors.append(mape(actual, np.repeat(train[:, -1:], horizon, axis=1)))
+
+    t0 = time.perf_counter()
+    for c in commodities:
+        forecaster.forecast("bench", c, horizon, today=date(2024, 1, 1) + np.timedelta64(origin, "D").item())
+    eval_us = (time.perf_counter() - t0) / len(commodities) * 1e6
+
+    print(f"{N_SERIES} series x {n_days} days, horizon {horizon}, {ORIGINS} rolling origins")
+    print(f"Holt MAPE      {np.mean(holt_errors):6.2f} %")
+    print(f"Naive MAPE     {np.mean(naive_errors):6.2f} %")
+    print(f"Served MAPE    {np.mean(chosen_errors):6.2f} %  (naive chosen for {np.mean(naive_share):.0%} of series)")
+    print(f"Batch fit      {np.mean(fit_times) * 1000:8.1f} ms for {N_SERIES} series")
+    print(f"Forecast eval  {eval_us:8.1f} us per commodity")
+
+
+if __name__ == "__main__":
+    main()
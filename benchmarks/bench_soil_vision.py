@@ -0,0 +1,103 @@
+"""
+Benchmark: soil image analysis
+Times app/soil_vision.py end to end (JPEG decode + downscale, features,
+classification) on synthetic phone-sized soil photos of distinct soil kinds, and
+checks that repeated runs on the same bytes give identical results. Then compares the
+throughput (images/s on one core) of a field survey analyzed one photo at a time with
+analyze_soil_batch (stacked tensors), and splits the per-image cost into decode and
+features + classification, single versus stacked. Decode dominates and is the same in
+both paths, so the batch gain per core is bounded by the feature share.
+
+Usage: python benchmarks/bench_soil_vision.py [width] [height] [repeats]
+"""
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.soil_vision import (FEATURE_STACK_SIZE, analyze_soil_batch, analyze_soil_image, classify_batch,
+                             extract_features_batch, load_image)
+
+# name: (base RGB, grain size in pixels, grain contrast)
+SOIL_KINDS = {
+    "pale sand": ((196, 170, 128), 12, 0.30),
+    "sandy loam": ((160, 128, 92), 14, 0.22),
+    "red clay": ((140, 70, 45), 40, 0.08),
+    "black cotton soil": ((58, 52, 48), 40, 0.10),
+    "grey silt": ((125, 115, 104), 30, 0.06),
+}
+
+
+def _noise(rng, scale: int, width: int, height: int) -> np.ndarray:
+    small = rng.normal(0, 1, (height // scale + 1, width // scale + 1, 1))
+    return np.repeat(np.repeat(small, scale, axis=0), scale, axis=1)[:height, :width]
+
+
+def synthetic_soil(base, grain: int, contrast: float, width: int, height: int, seed: int = 7) -> bytes:
+    """Grains plus clods/shadows at a coarser scale and a lighting gradient"""
+    rng = np.random.default_rng(seed)
+    texture = contrast * _noise(rng, grain, width, height) + 0.12 * _noise(rng, 90, width, height)
+    shading = np.linspace(0.9, 1.1, width)[None, :, None]
+    rgb = np.clip(np.array(base, dtype=float)[None, None, :] * (1 + texture) * shading, 0, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(rgb.astype(np.uint8)).save(buffer, format="JPEG", quality=88)
+    return buffer.getvalue()
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    for name, (base, grain, contrast) in SOIL_KINDS.items():
+        data = synthetic_soil(base, grain, contrast, width, height)
+        first = analyze_soil_image(data)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = analyze_soil_image(data)
+            times.append(time.perf_counter() - start)
+            assert result == first, "analysis is not deterministic"
+        print(
+            f"{name:18s} {len(data) / 1e6:5.1f} MB  {np.median(times) * 1000:6.1f} ms  "
+            f"{first['soil_type']:11s} pH {first['ph_level']:.1f}  {first['color']['munsell']:10s} "
+            f"conf {first['confidence_score']:.1f}  OM {first['nutrients']['organic_matter']}"
+        )
+
+    survey = [synthetic_soil(base, grain, contrast, width, height, seed=seed)
+              for seed in range(8) for base, grain, contrast in SOIL_KINDS.values()]
+    one_by_one = [analyze_soil_image(data) for data in survey]
+    assert analyze_soil_batch(survey) == one_by_one, "batch results differ from single-image results"
+    sequential = best_of(repeats, lambda: [analyze_soil_image(data) for data in survey])
+    batch = best_of(repeats, lambda: analyze_soil_batch(survey))
+
+    decode = best_of(repeats, lambda: [load_image(data) for data in survey])
+    stack = np.stack([load_image(data) for data in survey])
+    single = best_of(repeats, lambda: [classify_batch(extract_features_batch(rgb[None])) for rgb in stack])
+    stacked = best_of(repeats, lambda: [classify_batch(extract_features_batch(stack[i:i + FEATURE_STACK_SIZE]))
+                                        for i in range(0, len(stack), FEATURE_STACK_SIZE)])
+
+    n = len(survey)
+    print(f"survey of {n}: decode {decode / n * 1000:.1f} ms/image, features + classification "
+          f"{single / n * 1000:.2f} ms/image single, {stacked / n * 1000:.2f} ms/image "
+          f"stacked by {FEATURE_STACK_SIZE} ({single / stacked:.2f}x)")
+    print(f"throughput: one by one {n / sequential:.1f} images/s, batch {n / batch:.1f} images/s "
+          f"({sequential / batch:.2f}x)")
+
+
+def best_of(repeats: int, run) -> float:
+    """Fastest wall time of several runs, in seconds"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+if __name__ == "__main__":
+    main()
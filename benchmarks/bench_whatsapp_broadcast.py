@@ -0,0 +1,97 @@
+"""
+Benchmark: WhatsApp broadcast
+Queues a broadcast to many recipients in a temporary outbox (app/whatsapp_outbox.py)
+and sends it to the local Graph API stub from bench_whatsapp_send.py, which answers
+a share of sends with 429/500. Prints progress as the endpoint reports it, then the
+achieved rate against the send-rate limit, the busiest second, retries and failures.
+Halfway through, the outbox is stopped and started again to show the queue survives
+a restart.
+
+Usage: python benchmarks/bench_whatsapp_broadcast.py [recipients] [rate_per_second] [latency_ms]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_whatsapp_send import PHONE_NUMBER_ID, serve_stub, stub_state
+
+FAILURE_RATE = 0.01
+
+
+def peak_rate() -> int:
+    """Most sends the stub accepted in any one-second window"""
+    times = sorted(t for _, _, t in stub_state["messages"])
+    peak, first = 0, 0
+    for last, t in enumerate(times):
+        while t - times[first] >= 1.0:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 80
+    stub_state["latency"] = (float(sys.argv[3]) if len(sys.argv) > 3 else 300) / 1000
+    os.environ.setdefault("WHATSAPP_ACCESS_TOKEN", "stub-token")
+    os.environ.setdefault("WHATSAPP_PHONE_NUMBER_ID", PHONE_NUMBER_ID)
+    base_url = serve_stub()
+    random.seed(5)
+    stub_state["failure_rate"] = FAILURE_RATE
+
+    from app.whatsapp_client import WhatsAppClient
+    from app.whatsapp_outbox import WHATSAPP_OUTBOX_CONCURRENCY, OutboundQueue, normalize_recipients
+
+    numbers, _, _ = normalize_recipients([f"9197{i:08d}" for i in range(recipients)])
+    message = {"type": "template", "template": {"name": "price_alert", "language": {"code": "hi"}}}
+    print(f"broadcast to {len(numbers)} recipients, send rate limit {rate:.0f}/s, stub latency "
+          f"{stub_state['latency'] * 1000:.0f} ms, {FAILURE_RATE:.0%} of sends answered 429/500")
+
+    async def bench(path: str):
+        # Plain-http stub means HTTP/1.1: one connection per send in flight
+        client = WhatsAppClient(base_url=base_url, rate=rate, max_connections=WHATSAPP_OUTBOX_CONCURRENCY)
+        outbox = OutboundQueue(path=path, client=client, tier=0, backoff=0.5)
+        await outbox.start()
+        start = time.perf_counter()
+        broadcast_id = await outbox.broadcast(numbers, message)
+        print(f"queued in {(time.perf_counter() - start) * 1000:.0f} ms")
+        restarted = False
+        while True:
+            await asyncio.sleep(5)
+            progress = await outbox.progress(broadcast_id)
+            print(f"{time.perf_counter() - start:6.1f} s: {progress['progress_percent']:5.1f}% sent {progress['sent']}, "
+                  f"queued {progress['queued']}, failed {progress['failed']}, "
+                  f"{progress['messages_per_second']:5.1f}/s, eta {progress['eta_seconds']} s")
+            if progress["complete"]:
+                break
+            if not restarted and progress["progress_percent"] >= 50:
+                restarted = True
+                await outbox.stop()
+                await outbox.start()
+                print("outbox restarted")
+        elapsed = time.perf_counter() - start
+        stats = outbox.stats()
+        await outbox.stop()
+        await client.stop()
+        return progress, elapsed, stats
+
+    with tempfile.TemporaryDirectory() as directory:
+        progress, elapsed, stats = asyncio.run(bench(os.path.join(directory, "outbox.db")))
+
+    per_recipient = Counter(to for to, _, _ in stub_state["messages"])
+    print(f"\ndone in {elapsed:.1f} s: {progress['sent']} sent, {progress['failed']} failed, "
+          f"{progress['messages_per_second']:.1f}/s against a limit of {rate:.0f}/s, "
+          f"busiest second {peak_rate()} sends")
+    print(f"{stats['retried']} sends rescheduled after 429/500, {stub_state['calls']} API calls, "
+          f"{sum(1 for n in per_recipient.values() if n > 1)} recipients messaged twice (restart), "
+          f"{len(numbers) - len(per_recipient)} never reached")
+
+
+if __name__ == "__main__":
+    main()
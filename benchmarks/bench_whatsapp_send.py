@@ -0,0 +1,143 @@
+"""
+Benchmark: WhatsApp sends
+Serves a local Graph API stub (fixed latency per send, optional injected 429/500
+responses) and points app/whatsapp_client.py at it. Compares the old blocking
+requests.post per send, called from the event loop, with the shared pooled async client
+sending concurrently (send-rate limiter off): throughput and how long the event loop
+is stalled. Then injects
+random 429s and 500s and checks they are retried through to delivery.
+
+Usage: python benchmarks/bench_whatsapp_send.py [sends] [latency_ms]
+"""
+import asyncio
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import requests
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.whatsapp_client import WhatsAppClient
+
+PHONE_NUMBER_ID = "123456789"
+stub = FastAPI()
+stub_state = {"latency": 0.05, "failure_rate": 0.0, "calls": 0, "delivered": 0, "messages": []}
+
+
+@stub.post("/{version}/{phone_number_id}/messages")
+async def stub_messages(version: str, phone_number_id: str, request: Request):
+    payload = await request.json()
+    stub_state["calls"] += 1
+    await asyncio.sleep(stub_state["latency"])
+    if random.random() < stub_state["failure_rate"]:
+        if random.random() < 0.5:
+            return JSONResponse({"error": {"message": "Rate limit hit", "code": 130429}},
+                                status_code=429, headers={"Retry-After": "0"})
+        return JSONResponse({"error": {"message": "stub failure", "code": 1}}, status_code=500)
+    stub_state["delivered"] += 1
+    body = payload["text"]["body"] if payload["type"] == "text" else payload["template"]["name"]
+    stub_state["messages"].append((payload["to"], body, time.monotonic()))
+    return {"messaging_product": "whatsapp", "contacts": [{"wa_id": payload["to"]}],
+            "messages": [{"id": f"wamid.stub{stub_state['calls']}"}]}
+
+
+def serve_stub() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+async def loop_lag(stop: asyncio.Event) -> float:
+    """Longest gap between 5 ms ticks of the event loop"""
+    worst = 0.0
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.005)
+        now = time.perf_counter()
+        worst = max(worst, now - last - 0.005)
+        last = now
+    return worst
+
+
+async def blocking_run(base_url: str, sends: int):
+    """The previous send path: requests.post per message inside the async handler"""
+    async def send(i):
+        requests.post(f"{base_url}/v18.0/{PHONE_NUMBER_ID}/messages",
+                      headers={"Authorization": "Bearer stub-token"},
+                      json={"messaging_product": "whatsapp", "to": f"9190000{i:05d}",
+                            "type": "text", "text": {"body": "price update"}})
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(sends)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, await lag
+
+
+async def pooled_run(client: WhatsAppClient, sends: int):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(client.send_text(f"+91 90000{i:05d}", "price update") for i in range(sends)),
+                         return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, await lag
+
+
+def main():
+    sends = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    stub_state["latency"] = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    os.environ.setdefault("WHATSAPP_ACCESS_TOKEN", "stub-token")
+    os.environ.setdefault("WHATSAPP_PHONE_NUMBER_ID", PHONE_NUMBER_ID)
+    base_url = serve_stub()
+    print(f"{sends} sends against a Graph API stub with {stub_state['latency'] * 1000:.0f} ms latency")
+
+    elapsed, lag = asyncio.run(blocking_run(base_url, sends))
+    print(f"blocking requests.post: {sends / elapsed:7.1f} sends/s, event loop stalled up to {lag * 1000:7.1f} ms")
+
+    async def pooled():
+        client = WhatsAppClient(base_url=base_url, rate=0)
+        await client.start()
+        try:
+            return await pooled_run(client, sends)
+        finally:
+            await client.stop()
+
+    elapsed, lag = asyncio.run(pooled())
+    print(f"pooled async client:    {sends / elapsed:7.1f} sends/s, event loop stalled up to {lag * 1000:7.1f} ms")
+
+    print("\nretries: 10% of stub responses are a 429 or 500")
+    random.seed(7)
+    stub_state.update(failure_rate=0.1, calls=0, delivered=0)
+
+    async def flaky():
+        client = WhatsAppClient(base_url=base_url, backoff=0.02, rate=0)
+        try:
+            await pooled_run(client, sends)
+            return client.stats()
+        finally:
+            await client.stop()
+
+    stats = asyncio.run(flaky())
+    print(f"sent {stats['sent']}/{sends}, failed {stats['failed']}, retried {stats['retried']}, "
+          f"stub calls {stub_state['calls']}, delivered {stub_state['delivered']}")
+
+
+if __name__ == "__main__":
+    main()
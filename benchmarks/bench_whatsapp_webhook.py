@@ -0,0 +1,207 @@
+"""
+Benchmark: WhatsApp webhook
+Posts webhook deliveries at a steady rate (several farmers, several messages each)
+to the webhook handler while the replies go to the local Graph API stub from bench_whatsapp_send.py.
+Compares the previous inline handler, which generated and sent every reply before
+responding, with the acknowledge-first handler backed by the reply pipeline. Reports
+webhook latency percentiles, the time until every reply is delivered, and whether
+each farmer got their replies in order. Then redelivers part of the deliveries, as
+Meta does after a timeout, and checks each message is still answered once. Finally
+posts bursts batching many entries per delivery, as Meta does at busy times: the old
+handler only read the first change, and replies must stay under the send-rate limit.
+
+Usage: python benchmarks/bench_whatsapp_webhook.py [deliveries] [per_second] [latency_ms]
+"""
+import asyncio
+import os
+import random
+import re
+import sys
+import time
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_whatsapp_send import PHONE_NUMBER_ID, serve_stub, stub_state
+
+FARMERS = 50
+REDELIVER = 0.3
+BURST_FARMERS = 10
+BURST_MESSAGES = 4
+BURST_DELIVERIES = 25
+
+
+def delivery(farmer: int, seq: int, run_id: str = "") -> dict:
+    sender = f"9198{farmer:08d}"
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "0", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "messages": [{"from": sender, "id": f"wamid.{run_id}{farmer}.{seq}", "timestamp": str(int(time.time())),
+                          "type": "text", "text": {"body": f"seq {seq}"}}],
+        }}]}],
+    }
+
+
+def burst_delivery(farmers: range, seq: int, run_id: str) -> dict:
+    """One delivery as Meta batches it at busy times: an entry per farmer, status updates included"""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": str(farmer), "changes": [
+            {"field": "messages", "value": {
+                "messaging_product": "whatsapp",
+                "messages": [{"from": f"9198{farmer:08d}", "id": f"wamid.{run_id}{farmer}.{seq}.{k}",
+                              "type": "text", "text": {"body": f"seq {seq * BURST_MESSAGES + k}"}}
+                             for k in range(BURST_MESSAGES)],
+            }},
+            {"field": "messages", "value": {
+                "messaging_product": "whatsapp",
+                "statuses": [{"id": f"wamid.out.{run_id}{farmer}.{seq}", "status": "delivered",
+                              "recipient_id": f"9198{farmer:08d}"}],
+            }},
+        ]} for farmer in farmers],
+    }
+
+
+def peak_rate() -> float:
+    """Most replies the stub received in any one-second window"""
+    times = sorted(t for _, _, t in stub_state["messages"])
+    peak, first = 0, 0
+    for last, t in enumerate(times):
+        while t - times[first] >= 1.0:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+async def burst_run(app, deliveries: int) -> tuple:
+    """deliveries burst payloads of BURST_FARMERS entries each, posted back to back"""
+    stub_state.update(calls=0, delivered=0, messages=[])
+    run_id = f"{time.monotonic_ns()}."
+    expected = deliveries * BURST_FARMERS * BURST_MESSAGES
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for seq in range(deliveries):
+            farmers = range(seq % 5 * BURST_FARMERS, (seq % 5 + 1) * BURST_FARMERS)
+            response = await client.post("/api/webhook/whatsapp", json=burst_delivery(farmers, seq, run_id))
+            response.raise_for_status()
+    # Wait until replies stop arriving
+    delivered = -1
+    while stub_state["delivered"] != delivered:
+        delivered = stub_state["delivered"]
+        await asyncio.sleep(1.0)
+    elapsed = max(t for _, _, t in stub_state["messages"]) - min(t for _, _, t in stub_state["messages"])
+    return expected, delivered, elapsed
+
+
+def inline_app(whatsapp_webhook) -> FastAPI:
+    """The previous handler: reply and send before acknowledging"""
+    app = FastAPI()
+
+    @app.post("/api/webhook/whatsapp")
+    async def webhook(request: Request):
+        payload = await request.json()
+        for message in payload["entry"][0]["changes"][0]["value"]["messages"]:
+            await whatsapp_webhook.handle_incoming_batch([message])
+        return {"status": "received"}
+
+    return app
+
+
+def in_order() -> bool:
+    seen = {}
+    for to, body, _ in stub_state["messages"]:
+        seq = int(re.search(r"seq (\d+)", body).group(1))
+        if seq < seen.get(to, -1):
+            return False
+        seen[to] = seq
+    return True
+
+
+async def run(app, deliveries: int, rate: float, redeliver: float = 0.0):
+    """
+    Post deliveries at a steady rate, each as soon as it is due (as Meta does), not
+    after the last reply. A redeliver share of them is posted a second time shortly after.
+    """
+    stub_state.update(calls=0, delivered=0, messages=[])
+    run_id = f"{time.monotonic_ns()}."
+    latencies = []
+    rng = random.Random(11)
+    schedule = [(i / rate, i) for i in range(deliveries)]
+    schedule += [(i / rate + 0.2, i) for i in range(deliveries) if rng.random() < redeliver]
+
+    async def post(client, at, i):
+        await asyncio.sleep(at)
+        start = time.perf_counter()
+        response = await client.post("/api/webhook/whatsapp", json=delivery(i % FARMERS, i // FARMERS, run_id))
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(post(client, at, i) for at, i in schedule))
+    acknowledged = time.perf_counter() - start
+    while stub_state["delivered"] < deliveries:
+        await asyncio.sleep(0.01)
+    delivered = time.perf_counter() - start
+    # Give stray duplicate replies time to show up
+    await asyncio.sleep(1)
+    return latencies, acknowledged, delivered
+
+
+def main():
+    deliveries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    stub_state["latency"] = (float(sys.argv[3]) if len(sys.argv) > 3 else 300) / 1000
+    os.environ.setdefault("WHATSAPP_ACCESS_TOKEN", "stub-token")
+    os.environ.setdefault("WHATSAPP_PHONE_NUMBER_ID", PHONE_NUMBER_ID)
+    base_url = serve_stub()
+
+    from app.main import app
+    from app.message_dedup import seen_messages
+    from app.routers import whatsapp_webhook
+    from app.whatsapp_client import whatsapp_client
+    whatsapp_client.base_url = base_url
+
+    print(f"{deliveries} webhook deliveries from {FARMERS} farmers at {rate:.0f}/s, "
+          f"Graph API stub latency {stub_state['latency'] * 1000:.0f} ms")
+
+    async def bench():
+        await whatsapp_client.start()
+        await whatsapp_webhook.pipeline.start()
+        try:
+            for name, target in (("inline", inline_app(whatsapp_webhook)), ("pipeline", app)):
+                latencies, acknowledged, delivered = await run(target, deliveries, rate)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                print(f"{name:8s}: webhook p50 {p50:7.1f} ms p99 {p99:7.1f} ms, all acknowledged in "
+                      f"{acknowledged:5.2f} s, all replies delivered in {delivered:5.2f} s, "
+                      f"per-farmer order {'kept' if in_order() else 'BROKEN'}")
+            print(f"pipeline stats: {whatsapp_webhook.pipeline.stats()}")
+
+            print(f"\nredeliveries: {REDELIVER:.0%} of deliveries posted twice")
+            latencies, _, _ = await run(app, deliveries, rate, REDELIVER)
+            p99 = np.percentile(latencies, 99) * 1000
+            print(f"pipeline: {len(latencies)} webhook posts, p99 {p99:.1f} ms, {stub_state['delivered']} replies "
+                  f"sent for {deliveries} messages, dedup {seen_messages.stats()}")
+
+            print(f"\nbursts: {BURST_DELIVERIES} deliveries of {BURST_FARMERS} entries x {BURST_MESSAGES} messages "
+                  f"plus statuses, stub latency 100 ms, send rate limit {whatsapp_client.limiter.rate:.0f}/s")
+            stub_state["latency"] = 0.1
+            for name, target in (("inline", inline_app(whatsapp_webhook)), ("pipeline", app)):
+                expected, delivered, elapsed = await burst_run(target, BURST_DELIVERIES)
+                print(f"{name:8s}: {delivered}/{expected} messages answered, {delivered / elapsed:5.1f} replies/s, "
+                      f"peak {peak_rate():.0f} in one second, per-farmer order {'kept' if in_order() else 'BROKEN'}")
+            print(f"pipeline stats: {whatsapp_webhook.pipeline.stats()}")
+            print(f"delivery statuses: {dict(whatsapp_webhook.delivery_statuses)}")
+        finally:
+            await whatsapp_webhook.pipeline.stop()
+            await whatsapp_client.stop()
+
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from app.routers.voice_chat import generate_whatsapp_response
+from app.routers.whatsapp_webhook import generate_advisory_response
+
+PRICE_REPLY = "💰 Market Prices:"
+
+MENTIONS_WITHOUT_PRICE_QUESTION = [
+    "my tomato leaves have a disease",
+    "pest on onion",
+    "hello, is there help for potato farming",
+    "how to grow okra in my field",
+]
+
+PRICE_QUESTIONS = [
+    ("what is the tomato price today", "Tomato"),
+    ("onion rate in mandi", "Onion"),
+    ("tamatar ka bhav", "Tomato"),
+]
+
+
+def replies(text: str) -> list:
+    return [generate_whatsapp_response(text), asyncio.run(generate_advisory_response(text))]
+
+
+@pytest.mark.parametrize("text", MENTIONS_WITHOUT_PRICE_QUESTION)
+def test_crop_mention_is_not_a_price_question(text):
+    for reply in replies(text):
+        assert not reply.startswith(PRICE_REPLY)
+
+
+@pytest.mark.parametrize("text, commodity", PRICE_QUESTIONS)
+def test_price_question_gets_commodity_prices(text, commodity):
+    for reply in replies(text):
+        assert reply.startswith(PRICE_REPLY + "\n" + commodity)
+
+
+def test_price_question_without_commodity_gets_general_prices():
+    for reply in replies("what are market prices like"):
+        assert reply.startswith(PRICE_REPLY)
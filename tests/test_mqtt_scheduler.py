@@ -0,0 +1,56 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.mqtt_scheduler import CommandScheduler
+
+TZ = ZoneInfo("Asia/Kolkata")
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return CommandScheduler(publish=lambda command: None, store_path=str(tmp_path / "schedules.json"))
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime:
+    # 2024-01-01 is a Monday
+    return datetime(2024, 1, day, hour, minute, tzinfo=TZ)
+
+
+def overnight(days=None) -> dict:
+    return {"id": "s", "device": "motor", "start_time": "22:00", "end_time": "02:00", "days": days}
+
+
+def test_overnight_window_on_one_weekday_turns_off_next_morning(scheduler):
+    schedule = overnight(days=[0])
+    assert scheduler._next_edge(schedule, at(1, 12)) == (at(1, 22), "on", False)
+    # Just after Monday's on edge fired: off at 02:00 Tuesday, not the next Monday
+    assert scheduler._next_edge(schedule, at(1, 22, 0)) == (at(2, 2), "off", True)
+    assert scheduler._next_edge(schedule, at(2, 1, 30)) == (at(2, 2), "off", True)
+    # Window closed: next on is the following Monday
+    assert scheduler._next_edge(schedule, at(2, 2)) == (at(8, 22), "on", False)
+
+
+def test_overnight_window_every_day(scheduler):
+    schedule = overnight()
+    assert scheduler._next_edge(schedule, at(3, 23)) == (at(4, 2), "off", True)
+    assert scheduler._next_edge(schedule, at(4, 3)) == (at(4, 22), "on", False)
+
+
+def test_same_day_window(scheduler):
+    schedule = {"id": "s", "device": "motor", "start_time": "06:00", "end_time": "06:20", "days": [2]}
+    assert scheduler._next_edge(schedule, at(3, 6, 5)) == (at(3, 6, 20), "off", True)
+    assert scheduler._next_edge(schedule, at(3, 7)) == (at(10, 6), "on", False)
+
+
+def test_start_only_schedule(scheduler):
+    schedule = {"id": "s", "device": "hv", "start_time": "05:30", "end_time": None, "days": None}
+    assert scheduler._next_edge(schedule, at(1, 6)) == (at(2, 5, 30), "on", False)
+
+
+def test_end_time_equal_to_start_time_is_rejected(scheduler):
+    with pytest.raises(ValueError):
+        scheduler.add_schedule("motor", "06:00", "06:00")
+    with pytest.raises(ValueError):
+        scheduler.add_schedule("motor", "6:00", "06:00")